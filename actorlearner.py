@@ -0,0 +1,204 @@
+from board import GridStates, TTTBoard, TTTBoardDecision
+from game import SingleGame, GameSequence
+from learning import GenericLearning
+from statekey import packBoardState, unpackBoardState
+import multiprocessing
+import Queue
+import random
+import sys
+import time
+
+# Actor/learner training. Actor processes keep playing games with a frozen copy of the players and put
+# every game on a bounded queue as a trajectory: the packed board states after each move and the outcome.
+# The learner process replays the trajectories into the learning algorithms, and every snapshotInterval
+# games sends each actor a policy snapshot (see GenericLearning.getPolicySnapshot) to play on with.
+
+class FrozenLearning(GenericLearning):
+    # A learning algorithm that is only evaluated; learning happens in the learner process
+    def __init__(self, learningAlgo):
+        self.learningAlgo = learningAlgo
+
+    def getBoardStateValue(self, player, board, boardState):
+        return self.learningAlgo.getBoardStateValue(player, board, boardState)
+
+    def getBoardStateValues(self, player, board, boardStates):
+        return self.learningAlgo.getBoardStateValues(player, board, boardStates)
+
+    def acceptsPackedStates(self):
+        return self.learningAlgo.acceptsPackedStates()
+
+    def learnFromMove(self, player, board, prevBoardState):
+        pass
+
+    def setPolicySnapshot(self, snapshot):
+        self.learningAlgo.setPolicySnapshot(snapshot)
+
+class TrajectoryRecorder(object):
+    # Stands in for player 1 and records the board state after every move of the game
+    def __init__(self, player):
+        self.player = player
+        self.packedStates = []
+
+    def startNewGame(self):
+        self.packedStates = [0]     # The empty board
+        self.player.startNewGame()
+
+    def learnFromMove(self, prevBoardState):
+        packedState = packBoardState(self.player.board.getBoardState())
+        if packedState != self.packedStates[-1]:
+            self.packedStates.append(packedState)
+        self.player.learnFromMove(prevBoardState)
+
+    def __getattr__(self, name):
+        return getattr(self.player, name)
+
+class RecordedBoardView(object):
+    # What a learning algorithm gets to see as `board` while a trajectory is replayed. The next board is
+    # the tile the last move points at, even if it is decided; encoders treat that as a free choice too.
+    def __init__(self, boardState, decision, nextBoardLocation=(None, None)):
+        self.boardState = boardState
+        self.decision = decision
+        self.nextBoardLocation = list(nextBoardLocation)
+
+    def getBoardState(self):
+        return self.boardState
+
+    def getBoardDecision(self):
+        return self.decision
+
+    def getNextBoardLocation(self):
+        return self.nextBoardLocation
+
+def pointedBoardLocation(previousState, boardState):
+    # Tile the move from previousState to boardState points at
+    cell = next(k for k in xrange(81) if boardState[k] != previousState[k])
+    return (cell % 9 // 3, cell % 3)
+
+def takesPolicySnapshots(learningAlgo):
+    # Whether a learning algorithm implements policy snapshots, rather than inheriting the stubs
+    getPolicySnapshot = getattr(type(learningAlgo), 'getPolicySnapshot', None)
+    return getPolicySnapshot is not None and getPolicySnapshot.__func__ is not GenericLearning.getPolicySnapshot.__func__
+
+def getLearningPlayers(player1, player2):
+    # (player, learning algorithm) pairs the learner trains, in the order snapshots are sent. A learning
+    # algorithm without snapshots would only learn in the actors and lose it all, so it is refused.
+    learningPlayers = []
+    for (who, player) in ((GridStates.PLAYER_X, player1), (GridStates.PLAYER_O, player2)):
+        learningAlgo = getattr(player, 'learningAlgo', None)
+        if learningAlgo is None:
+            continue
+        if not takesPolicySnapshots(learningAlgo):
+            raise ValueError('%s has no policy snapshots to train it with ActorLearner, play it with GameSequence instead'
+                             % type(learningAlgo).__name__)
+        learningPlayers.append((who, learningAlgo))
+    return learningPlayers
+
+def runActor(player1, player2, BoardClass, BoardDecisionClass, trajectories, snapshots, stopEvent, actorId, seed):
+    random.seed(seed)
+    frozen = []
+    for player in (player1, player2):
+        if takesPolicySnapshots(getattr(player, 'learningAlgo', None)):
+            player.learningAlgo.stopPolicySnapshots()   # Tracking inherited from the learner is of no use here
+            player.learningAlgo = FrozenLearning(player.learningAlgo)
+            frozen.append(player.learningAlgo)
+    recorder = TrajectoryRecorder(player1)
+    blockedSeconds, fullCount = 0.0, 0
+    while not stopEvent.is_set():
+        while True:     # Snapshots are applied in order, as they may hold changes only
+            try:
+                snapshot = snapshots.get_nowait()
+            except Queue.Empty:
+                break
+            for (learningAlgo, learnerSnapshot) in zip(frozen, snapshot):
+                learningAlgo.setPolicySnapshot(learnerSnapshot)
+        decision = SingleGame(recorder, player2, BoardClass, BoardDecisionClass).playAGame()
+        message = (actorId, tuple(recorder.packedStates), decision, blockedSeconds, fullCount)
+        try:
+            trajectories.put_nowait(message)
+        except Queue.Full:
+            fullCount += 1
+            startTime = time.time()
+            while not stopEvent.is_set():
+                try:
+                    trajectories.put(message, timeout=0.1)
+                    break
+                except Queue.Full:
+                    pass
+            blockedSeconds += time.time() - startTime
+
+class ActorLearner(GameSequence):
+    # Plays numberOfGames over numberOfActors actor processes while training the players' learning
+    # algorithms in this process. The trajectory queue holds up to queueSize games; when it is full the
+    # actors wait, and lastRunStats reports how long (actorBlockedSeconds) along with how long the
+    # learner waited for games (learnerIdleSeconds) and the average queue depth.
+    def __init__(self, numberOfGames, player1, player2, BoardClass=TTTBoard, BoardDecisionClass=TTTBoardDecision,
+                 numberOfActors=None, queueSize=64, snapshotInterval=100):
+        super(ActorLearner, self).__init__(numberOfGames, player1, player2, BoardClass, BoardDecisionClass)
+        self.numberOfActors = multiprocessing.cpu_count() if numberOfActors is None else numberOfActors
+        self.queueSize = queueSize
+        self.snapshotInterval = snapshotInterval
+        self.lastRunStats = {}
+
+    def replayTrajectory(self, packedStates, decision):
+        boardStates = [unpackBoardState(packedState) for packedState in packedStates]
+        for (who, learningAlgo) in self.learningPlayers:
+            learningAlgo.resetForNewGame()
+            for k in range(1, len(boardStates)):
+                boardDecision = decision if k == len(boardStates) - 1 else self.BoardDecisionClass.ACTIVE
+                boardView = RecordedBoardView(boardStates[k], boardDecision,
+                                              pointedBoardLocation(boardStates[k-1], boardStates[k]))
+                learningAlgo.learnFromMove(who, boardView, boardStates[k-1])
+            learningAlgo.gameOver()
+
+    def playGamesAndGetWinPercent(self):
+        self.learningPlayers = getLearningPlayers(self.player1, self.player2)
+        for (who, learningAlgo) in self.learningPlayers:
+            learningAlgo.getPolicySnapshot()    # Actors start from the current state, changes are tracked from here
+        trajectories = multiprocessing.Queue(self.queueSize)
+        snapshotQueues = [multiprocessing.Queue() for k in range(self.numberOfActors)]
+        stopEvent = multiprocessing.Event()
+        actors = [multiprocessing.Process(target=runActor,
+                                          args=(self.player1, self.player2, self.BoardClass, self.BoardDecisionClass,
+                                                trajectories, snapshotQueues[k], stopEvent, k, random.randint(0, sys.maxint)))
+                  for k in range(self.numberOfActors)]
+        for actor in actors:
+            actor.daemon = True
+            actor.start()
+        results, idleSeconds, queueDepths, snapshotsSent = [], 0.0, 0, 0
+        actorStats = {}
+        startTime = time.time()
+        try:
+            while len(results) < self.numberOfGames:
+                waitStart = time.time()
+                actorId, packedStates, decision, blockedSeconds, fullCount = trajectories.get()
+                idleSeconds += time.time() - waitStart
+                queueDepths += trajectories.qsize()
+                actorStats[actorId] = (blockedSeconds, fullCount)
+                self.replayTrajectory(packedStates, decision)
+                results.append(decision)
+                if len(results) % self.snapshotInterval == 0 and len(results) < self.numberOfGames:
+                    snapshot = [learningAlgo.getPolicySnapshot() for (who, learningAlgo) in self.learningPlayers]
+                    for snapshotQueue in snapshotQueues:
+                        snapshotQueue.put(snapshot)
+                    snapshotsSent += 1
+        finally:
+            stopEvent.set()
+            while any(actor.is_alive() for actor in actors):    # Drain, so no actor stays blocked on a put
+                try:
+                    trajectories.get(timeout=0.1)
+                except Queue.Empty:
+                    pass
+            for actor in actors:
+                actor.join()
+            for snapshotQueue in snapshotQueues:   # Snapshots no actor is left to read
+                snapshotQueue.cancel_join_thread()
+            for (who, learningAlgo) in self.learningPlayers:
+                learningAlgo.stopPolicySnapshots()
+        elapsed = time.time() - startTime
+        self.lastRunStats = {'games': len(results), 'seconds': elapsed, 'gamesPerSecond': len(results) / elapsed,
+                             'learnerIdleSeconds': idleSeconds,
+                             'actorBlockedSeconds': sum(blocked for (blocked, full) in actorStats.itervalues()),
+                             'queueFullCount': sum(full for (blocked, full) in actorStats.itervalues()),
+                             'meanQueueDepth': float(queueDepths) / max(1, len(results)),
+                             'snapshotsSent': snapshotsSent}
+        return self.getWinPercent(results)
@@ -0,0 +1,223 @@
+from board import GridStates
+from ultimateboard import UTTTBoardDecision
+from ultimatebitboard import playMove, legalMoves, WIN_LINES, SUBBOARD_MASK
+from mcts import otherPlayer, outcomeFor
+import random
+import time
+
+# Depth-limited negamax with alpha-beta pruning over UTTTBitBoard positions, whose legalMoves follow the
+# same rules as UTTTBoard's getNextBoardLocation/getActiveBoardLocations/getEmptyBoardPlaces. Scores
+# are from the side to move; wins are worth WIN_SCORE less the number of plies to reach them.
+
+WIN_SCORE = 100000
+INFINITY = 10*WIN_SCORE
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+
+# Zobrist keys: one per (player, cell), one per next board constraint (NO_BOARD first) and one for O to move
+_zobristRandom = random.Random(20170101)
+ZOBRIST_CELLS = dict((who, [_zobristRandom.getrandbits(64) for cell in range(81)])
+                     for who in (GridStates.PLAYER_X, GridStates.PLAYER_O))
+ZOBRIST_NEXT_BOARD = [_zobristRandom.getrandbits(64) for k in range(10)]
+ZOBRIST_O_TO_MOVE = _zobristRandom.getrandbits(64)
+
+def zobristKey(position, whoToMove):
+    key = ZOBRIST_NEXT_BOARD[position[5] + 1] ^ (ZOBRIST_O_TO_MOVE if whoToMove == GridStates.PLAYER_O else 0)
+    for cell in range(81):
+        if position[0] & (1 << cell):
+            key ^= ZOBRIST_CELLS[GridStates.PLAYER_X][cell]
+        elif position[1] & (1 << cell):
+            key ^= ZOBRIST_CELLS[GridStates.PLAYER_O][cell]
+    return key
+
+def whoToMoveIn(position):
+    # X always moves first
+    return GridStates.PLAYER_X if bin(position[0]).count('1') == bin(position[1]).count('1') else GridStates.PLAYER_O
+
+# Heuristic: an open two is a line where one side has two marks and the other side none
+BIT_COUNTS = tuple(bin(m).count('1') for m in range(512))
+LINES_WITH_TWO = tuple(sum(1 << k for (k, line) in enumerate(WIN_LINES) if BIT_COUNTS[m & line] == 2) for m in range(512))
+LINES_TOUCHED = tuple(sum(1 << k for (k, line) in enumerate(WIN_LINES) if m & line) for m in range(512))
+BOARD_WEIGHTS = (3, 2, 3, 2, 4, 2, 3, 2, 3)     # Tiles by how many lines of the master board they are on
+BOARD_WEIGHT_SUMS = tuple(sum(BOARD_WEIGHTS[board] for board in range(9) if m & (1 << board)) for m in range(512))
+
+def openTwos(mine, theirs):
+    return BIT_COUNTS[LINES_WITH_TWO[mine] & ~LINES_TOUCHED[theirs]]
+
+def heuristicScore(position, who):
+    xMask, oMask, xWon, oWon, drawn = position[:5]
+    score = 10*(BOARD_WEIGHT_SUMS[xWon] - BOARD_WEIGHT_SUMS[oWon]) + \
+            8*(openTwos(xWon, oWon | drawn) - openTwos(oWon, xWon | drawn))
+    undecided = SUBBOARD_MASK & ~(xWon | oWon | drawn)
+    for board in range(9):
+        if undecided & (1 << board):
+            xBits, oBits = (xMask >> 9*board) & SUBBOARD_MASK, (oMask >> 9*board) & SUBBOARD_MASK
+            score += BOARD_WEIGHTS[board] * (openTwos(xBits, oBits) - openTwos(oBits, xBits))
+    return score if who == GridStates.PLAYER_X else -score
+
+class SearchTimeout(Exception):
+    pass
+
+class AlphaBetaSearch(object):
+    # Iterative deepening with a fixed-size transposition table indexed by the low bits of the Zobrist
+    # key. An entry is replaced by one from a later search or one searched at least as deep. Moves are
+    # tried best first: the table's move, then the two killer moves of the ply, then by history score.
+    # With an evaluator (e.g. mcts.LearnerEvaluator), leaves are scored by its value instead of
+    # heuristicScore. Positions found in a tablebase are not searched any further.
+    def __init__(self, transpositionTableSize=2**18, evaluator=None):
+        self.tableMask = transpositionTableSize - 1
+        if transpositionTableSize & self.tableMask:
+            raise ValueError('The transposition table size must be a power of two')
+        self.table = [None]*transpositionTableSize   # (key, depth, flag, score, move, generation)
+        self.generation = 0
+        self.evaluator = evaluator
+        self.tablebase = None       # Exact values of solved positions, see tablebase.py
+        self.history = dict((who, [0]*81) for who in (GridStates.PLAYER_X, GridStates.PLAYER_O))
+        self.killers = []
+        self.deadline = None
+        self.nodes, self.tableProbes, self.tableHits = 0, 0, 0
+        self.lastSearchStats = {}
+
+    def clear(self):
+        # Forget everything learned from earlier searches: the table, killer moves and history scores
+        self.table = [None]*len(self.table)
+        self.generation = 0
+        self.history = dict((who, [0]*81) for who in (GridStates.PLAYER_X, GridStates.PLAYER_O))
+        self.killers = []
+
+    def evaluate(self, position, who):
+        if self.evaluator is not None:
+            return int(200*(self.evaluator.evaluate(position, who) - 0.5))
+        return heuristicScore(position, who)
+
+    def probe(self, key):
+        self.tableProbes += 1
+        entry = self.table[key & self.tableMask]
+        if entry is not None and entry[0] == key:
+            self.tableHits += 1
+            return entry
+        return None
+
+    def store(self, key, depth, flag, score, move):
+        index = key & self.tableMask
+        entry = self.table[index]
+        if entry is None or entry[0] == key or entry[5] != self.generation or depth >= entry[1]:
+            self.table[index] = (key, depth, flag, score, move, self.generation)
+
+    def orderMoves(self, moves, tableMove, who, ply):
+        history, killers = self.history[who], self.killers[ply] if ply < len(self.killers) else ()
+        def priority(cell):
+            if cell == tableMove:
+                return 2*INFINITY
+            if cell in killers:
+                return INFINITY
+            return history[cell]
+        return sorted(moves, key=priority, reverse=True)
+
+    def recordCutoff(self, cell, who, depth, ply):
+        self.history[who][cell] += depth*depth
+        while len(self.killers) <= ply:
+            self.killers.append([])
+        killers = self.killers[ply]
+        if cell not in killers:
+            killers.insert(0, cell)
+            del killers[2:]
+
+    def negamax(self, position, who, key, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.deadline is not None and self.nodes & 1023 == 0 and time.time() > self.deadline:
+            raise SearchTimeout()
+        if position[6] != UTTTBoardDecision.ACTIVE:
+            return int(round((2*outcomeFor(position[6], who) - 1) * (WIN_SCORE - ply)))
+        if self.tablebase is not None:
+            value = self.tablebase.probe(position, who)
+            if value is not None:   # Solved, though not how many plies the win takes
+                return int(round((2*value - 1) * (WIN_SCORE - ply - 81)))
+        if depth == 0:
+            return self.evaluate(position, who)
+        originalAlpha, tableMove = alpha, None
+        entry = self.probe(key)
+        if entry is not None:
+            tableMove = entry[4]
+            if entry[1] >= depth:
+                score = self.scoreFromTable(entry[3], ply)
+                if entry[2] == EXACT:
+                    return score
+                if entry[2] == LOWER_BOUND:
+                    alpha = max(alpha, score)
+                else:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    return score
+        bestScore, bestMove = -INFINITY, None
+        opponent, sideKey = otherPlayer(who), ZOBRIST_O_TO_MOVE ^ ZOBRIST_NEXT_BOARD[position[5] + 1]
+        for cell in self.orderMoves(legalMoves(position), tableMove, who, ply):
+            child = playMove(position, who, cell)
+            childKey = key ^ sideKey ^ ZOBRIST_CELLS[who][cell] ^ ZOBRIST_NEXT_BOARD[child[5] + 1]
+            score = -self.negamax(child, opponent, childKey, depth - 1, -beta, -alpha, ply + 1)
+            if score > bestScore:
+                bestScore, bestMove = score, cell
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                self.recordCutoff(cell, who, depth, ply)
+                break
+        flag = UPPER_BOUND if bestScore <= originalAlpha else (LOWER_BOUND if bestScore >= beta else EXACT)
+        self.store(key, depth, flag, self.scoreToTable(bestScore, ply), bestMove)
+        return bestScore
+
+    def scoreToTable(self, score, ply):
+        # Win scores are stored relative to the position, not to the root
+        if score > WIN_SCORE // 2:
+            return score + ply
+        if score < -WIN_SCORE // 2:
+            return score - ply
+        return score
+
+    def scoreFromTable(self, score, ply):
+        if score > WIN_SCORE // 2:
+            return score - ply
+        if score < -WIN_SCORE // 2:
+            return score + ply
+        return score
+
+    def search(self, position, whoToMove, maxDepth=4, timeLimit=None):
+        # Deepens one ply at a time up to maxDepth, or until the time runs out, in which case the result
+        # of the last completed depth is used. Returns (bestMove, score).
+        self.generation += 1
+        self.killers = []
+        self.nodes, self.tableProbes, self.tableHits = 0, 0, 0
+        startTime = time.time()
+        self.deadline = None if timeLimit is None else startTime + timeLimit
+        key = zobristKey(position, whoToMove)
+        bestMove, bestScore, completedDepth, timeToDepth = None, 0, 0, {}
+        for depth in range(1, maxDepth + 1):
+            try:
+                score = self.negamax(position, whoToMove, key, depth, -INFINITY, INFINITY, 0)
+            except SearchTimeout:
+                break
+            entry = self.table[key & self.tableMask]
+            if entry is not None and entry[0] == key:
+                bestMove = entry[4]
+            bestScore, completedDepth = score, depth
+            timeToDepth[depth] = time.time() - startTime
+            if abs(score) > WIN_SCORE // 2:     # The outcome is known
+                break
+        if bestMove is None:    # Not even depth 1 finished
+            bestMove = self.orderMoves(legalMoves(position), None, whoToMove, 0)[0]
+        self.deadline = None
+        elapsed = time.time() - startTime
+        self.lastSearchStats = {'nodes': self.nodes, 'seconds': elapsed,
+                                'nodesPerSecond': self.nodes / elapsed if elapsed > 0 else 0.0,
+                                'tableProbes': self.tableProbes, 'tableHits': self.tableHits,
+                                'tableHitRate': float(self.tableHits) / self.tableProbes if self.tableProbes else 0.0,
+                                'completedDepth': completedDepth, 'timeToDepth': timeToDepth, 'score': bestScore}
+        return bestMove, bestScore
+
+    def getPositionValue(self, position, whoToMove, depth=4):
+        # Searched value of a position in [0, 1] for the side to move, e.g. as a training label. Scores
+        # of an evaluator are in [-100, 100]; heuristic scores are squashed from a range about 4 times wider.
+        move, score = self.search(position, whoToMove, depth)
+        if abs(score) > WIN_SCORE // 2:
+            return 1.0 if score > 0 else 0.0
+        scale = 200.0 if self.evaluator is not None else 800.0
+        return min(1.0, max(0.0, 0.5 + score / scale))
@@ -0,0 +1,165 @@
+from board import GridStates, TTTBoardDecision, WIN_LINES
+from ultimateboard import UTTTBoardDecision
+import numpy as np
+
+# Cell codes of the (N, 81) game array; cells are laid out as in UTTTBoard.getBoardState()
+EMPTY, PLAYER_X, PLAYER_O = 0, 1, 2
+CELL_CODES = {GridStates.EMPTY: EMPTY, GridStates.PLAYER_X: PLAYER_X, GridStates.PLAYER_O: PLAYER_O}
+STATE_CHARACTERS = np.array([ord(GridStates.EMPTY), ord(GridStates.PLAYER_X), ord(GridStates.PLAYER_O)], dtype=np.uint8)
+LINES = np.array(WIN_LINES, dtype=np.intp)
+NO_BOARD = -1
+
+class _ActiveBoardView(object):
+    # What a learning algorithm gets to see as `board` while a batched game is still running
+    def __init__(self):
+        self.boardState = None
+
+    def getBoardDecision(self):
+        return UTTTBoardDecision.ACTIVE
+
+    def getBoardState(self):
+        return self.boardState
+
+def decideBoards(cells, wonX, wonO):
+    # cells is (M, 9) of cell codes; returns the decision of each board, picking the first complete
+    # line in WIN_LINES order exactly like TTTBoard does
+    lineCells = cells[:, LINES]
+    xLines = (lineCells == wonX).all(axis=2)
+    oLines = (lineCells == wonO).all(axis=2)
+    anyLine = xLines | oLines
+    firstLine = anyLine.argmax(axis=1)
+    firstIsX = xLines[np.arange(len(cells)), firstLine]
+    decisions = np.where(anyLine.any(axis=1), np.where(firstIsX, TTTBoardDecision.WON_X, TTTBoardDecision.WON_O),
+                         TTTBoardDecision.ACTIVE)
+    return decisions.astype(np.int8)
+
+class RandomBatchPolicy(object):
+    # Picks a board and then a place uniformly at random, like RandomUTTTPlayer
+    def chooseMoves(self, simulator, games, who):
+        boardMask = simulator.getAvailableBoardMask(games)
+        boards = pickRandomTrue(simulator.rng, boardMask)
+        emptyPlaces = simulator.cells[games[:, None], 9*boards[:, None] + np.arange(9)] == EMPTY
+        return 9*boards + pickRandomTrue(simulator.rng, emptyPlaces)
+
+class TableBatchPolicy(RandomBatchPolicy):
+    # Greedy lookup of the learning algorithm's values, with random moves like RLUTTTPlayer makes.
+    # Only evaluates; the learning algorithm is not trained by batched games, and tables are only read
+    # (unseen states count as 0.5 without being added). The candidate states of all greedy games are
+    # built in NumPy and looked up in one call; with a CompactValueStore they are also hashed in NumPy.
+    # That is still about 100-200k games/min on one core against several million for RandomBatchPolicy,
+    # as a dict table needs every candidate as a string.
+    def __init__(self, learningAlgo, randomMoveProbability=0.2):
+        self.learningAlgo = learningAlgo
+        self.randomMoveProbability = randomMoveProbability
+        self.boardView = _ActiveBoardView()
+
+    def chooseMoves(self, simulator, games, who):
+        moves = super(TableBatchPolicy, self).chooseMoves(simulator, games, who)
+        greedy = np.flatnonzero(simulator.rng.random_sample(len(games)) >= self.randomMoveProbability)
+        if len(greedy) == 0:
+            return moves
+        greedyCells = simulator.cells[games[greedy]]
+        legalMasks = simulator.getLegalMoveMask(games[greedy])
+        rows, cells = np.nonzero(legalMasks)    # Every legal move of every greedy game, grouped by game
+        candidateCells = greedyCells[rows]
+        candidateCells[np.arange(len(rows)), cells] = CELL_CODES[who]
+        if hasattr(self.learningAlgo, 'peekCellArrayValues'):
+            values = self.learningAlgo.peekCellArrayValues(candidateCells)    # Cell codes are the statekey digits
+        else:
+            candidateStates = STATE_CHARACTERS[candidateCells].tostring()
+            candidates = [candidateStates[start:start+81] for start in xrange(0, len(candidateStates), 81)]
+            if hasattr(self.learningAlgo, 'peekBoardStateValues'):
+                values = self.learningAlgo.peekBoardStateValues(candidates)
+            else:
+                states = STATE_CHARACTERS[greedyCells]
+                starts = np.searchsorted(rows, np.arange(len(greedy) + 1)).tolist()
+                values = []
+                for k in range(len(greedy)):
+                    self.boardView.boardState = states[k].tostring()   # Candidates are one move on from it, which encoders may need
+                    values.extend(self.learningAlgo.getBoardStateValues(who, self.boardView, candidates[starts[k]:starts[k+1]]))
+        valueGrid = np.full(legalMasks.shape, -np.inf)
+        valueGrid[rows, cells] = values
+        moves[greedy] = valueGrid.argmax(axis=1)    # The first best cell, as RLUTTTPlayer picks
+        return moves
+
+def pickRandomTrue(rng, mask):
+    # Index of a uniformly chosen True entry in each row of a 2-d boolean mask
+    runningCounts = mask.cumsum(axis=1, dtype=np.int8)
+    picks = (rng.random_sample(len(mask)) * runningCounts[:, -1]).astype(np.int8)
+    return (runningCounts > picks[:, None]).argmax(axis=1)
+
+class BatchGameSimulator(object):
+    # Plays N Ultimate TTT games at once, one ply of every live game per step, with the same rules as UTTTBoard
+    def __init__(self, numberOfGames, policyX=None, policyO=None, seed=None):
+        self.numberOfGames = numberOfGames
+        self.policyX = RandomBatchPolicy() if policyX is None else policyX
+        self.policyO = RandomBatchPolicy() if policyO is None else policyO
+        self.rng = np.random.RandomState(seed)
+        self.reset()
+
+    def reset(self):
+        self.cells = np.zeros((self.numberOfGames, 81), dtype=np.int8)
+        self.boardDecisions = np.full((self.numberOfGames, 9), TTTBoardDecision.ACTIVE, dtype=np.int8)
+        self.emptyCounts = np.full((self.numberOfGames, 9), 9, dtype=np.int8)
+        self.nextBoards = np.full(self.numberOfGames, NO_BOARD, dtype=np.int8)
+        self.decisions = np.full(self.numberOfGames, UTTTBoardDecision.ACTIVE, dtype=np.int8)
+
+    def getAvailableBoardMask(self, games):
+        # Boards a player may pick from: the board it was sent to, or any undecided board (as in
+        # UTTTBoard.getActiveBoardLocations)
+        available = self.boardDecisions[games] == TTTBoardDecision.ACTIVE
+        nextBoards = self.nextBoards[games]
+        sent = nextBoards != NO_BOARD
+        available[sent] = False
+        available[np.flatnonzero(sent), nextBoards[sent]] = True
+        return available
+
+    def getLegalMoveMask(self, games):
+        boardMask = self.getAvailableBoardMask(games)
+        return (self.cells[games] == EMPTY) & np.repeat(boardMask, 9, axis=1)
+
+    def applyMoves(self, games, moves, who):
+        self.cells[games, moves] = CELL_CODES[who]
+        boards, places = moves // 9, moves % 9
+        self.emptyCounts[games, boards] -= 1
+        boardCells = self.cells[games[:, None], 9*boards[:, None] + np.arange(9)]
+        boardDecisions = decideBoards(boardCells, PLAYER_X, PLAYER_O)
+        full = self.emptyCounts[games, boards] == 0
+        boardDecisions[(boardDecisions == TTTBoardDecision.ACTIVE) & full] = TTTBoardDecision.DRAW
+        changed = np.flatnonzero(boardDecisions != self.boardDecisions[games, boards])
+        self.boardDecisions[games, boards] = boardDecisions
+
+        if len(changed) > 0:    # The master board can only change when one of its boards did
+            changedGames = games[changed]
+            allBoards = self.boardDecisions[changedGames]
+            decisions = decideBoards(allBoards, TTTBoardDecision.WON_X, TTTBoardDecision.WON_O)
+            self.decisions[changedGames] = np.where(decisions == TTTBoardDecision.WON_X, UTTTBoardDecision.WON_X,
+                                           np.where(decisions == TTTBoardDecision.WON_O, UTTTBoardDecision.WON_O,
+                                           np.where((allBoards == TTTBoardDecision.ACTIVE).any(axis=1),
+                                                    UTTTBoardDecision.ACTIVE, UTTTBoardDecision.DRAW)))
+        sendable = (self.decisions[games] == UTTTBoardDecision.ACTIVE) & \
+                   (self.boardDecisions[games, places] == TTTBoardDecision.ACTIVE)
+        self.nextBoards[games] = np.where(sendable, places, NO_BOARD)
+
+    def playGames(self):
+        self.reset()
+        who = GridStates.PLAYER_X
+        while True:
+            games = np.flatnonzero(self.decisions == UTTTBoardDecision.ACTIVE)
+            if len(games) == 0:
+                break
+            policy = self.policyX if who == GridStates.PLAYER_X else self.policyO
+            self.applyMoves(games, policy.chooseMoves(self, games, who), who)
+            who = GridStates.PLAYER_O if who == GridStates.PLAYER_X else GridStates.PLAYER_X
+        return self.decisions
+
+    def playGamesAndGetWinPercent(self):
+        results = self.playGames()
+        xpct, opct, drawpct = float(np.count_nonzero(results == UTTTBoardDecision.WON_X))/float(self.numberOfGames), \
+                              float(np.count_nonzero(results == UTTTBoardDecision.WON_O))/float(self.numberOfGames), \
+                              float(np.count_nonzero(results == UTTTBoardDecision.DRAW))/float(self.numberOfGames)
+        return (xpct, opct, drawpct)
+
+if __name__ == '__main__':
+    simulator = BatchGameSimulator(10000)
+    print simulator.playGamesAndGetWinPercent()
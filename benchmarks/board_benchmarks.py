@@ -0,0 +1,92 @@
+from benchmarks.common import seedEverything, quiet, timed, rate
+from board import GridStates
+from ultimateboard import UTTTBoard, UTTTBoardDecision, CELL_MOVES, cellsOfMask
+from ultimatebitboard import UTTTBitBoard
+import random
+
+# Board operations: makeMove, unmakeMove, determineBoardState and move generation on recorded random games
+
+def recordGames(numberOfGames):
+    # Moves of seeded random games, as (who, boardLocation, placeOnBoard)
+    games = []
+    with quiet():
+        for k in range(numberOfGames):
+            board, who, moves = UTTTBitBoard(), GridStates.PLAYER_X, []
+            while board.getBoardDecision() == UTTTBoardDecision.ACTIVE:
+                nextBoardLocation = board.getNextBoardLocation()
+                if None in nextBoardLocation:
+                    nextBoardLocation = random.choice(board.getActiveBoardLocations())
+                move = (who, tuple(nextBoardLocation), random.choice(board.getEmptyBoardPlaces(nextBoardLocation)))
+                board.makeMove(*move)
+                moves.append(move)
+                who = GridStates.PLAYER_O if who == GridStates.PLAYER_X else GridStates.PLAYER_X
+            games.append(moves)
+    return games
+
+def replayGames(BoardClass, games):
+    boards = []
+    for moves in games:
+        board = BoardClass()
+        for move in moves:
+            board.makeMove(*move)
+        boards.append(board)
+    return boards
+
+def generateMoves(boards):
+    count = 0
+    for board in boards:
+        nextBoardLocation = board.getNextBoardLocation()
+        boardLocations = board.getActiveBoardLocations() if None in nextBoardLocation else [nextBoardLocation]
+        for boardLocation in boardLocations:
+            count += len(board.getEmptyBoardPlaces(boardLocation))
+    return count
+
+def generateMovesFromMasks(boards):
+    count = 0
+    for board in boards:
+        count += len(cellsOfMask(board.legalMoveMask()))
+    return count
+
+def makeAndUnmakeMoves(boards):
+    # Every legal move of every board made and taken back, as a search would
+    count = 0
+    for board in boards:
+        boardState = board.getBoardState()
+        who = GridStates.PLAYER_X if boardState.count(GridStates.PLAYER_X) == boardState.count(GridStates.PLAYER_O) else GridStates.PLAYER_O
+        for cell in cellsOfMask(board.legalMoveMask()):
+            board.makeMove(who, *CELL_MOVES[cell])
+            board.unmakeMove()
+            count += 1
+    return count
+
+def determineBoardStates(boards, repeats):
+    for k in range(repeats):
+        for board in boards:
+            board.determineBoardState()
+
+def run(quick=False):
+    seedEverything()
+    games = recordGames(20 if quick else 200)
+    numberOfMoves = sum(len(moves) for moves in games)
+    halfGames = [moves[:len(moves) // 2] for moves in games]
+    results = {'moves': numberOfMoves}
+    for BoardClass in (UTTTBoard, UTTTBitBoard):
+        with quiet():
+            seconds, boards = timed(replayGames, BoardClass, games)
+            midgameBoards = replayGames(BoardClass, halfGames)
+        generateSeconds, unused = timed(generateMoves, midgameBoards * 50)
+        maskSeconds, unused = timed(generateMovesFromMasks, midgameBoards * 50)
+        for board in midgameBoards:
+            board.verbose = False
+        unmakeSeconds, numberOfUnmakes = timed(makeAndUnmakeMoves, midgameBoards * 10)
+        results[BoardClass.__name__] = {'makeMovesPerSecond': rate(numberOfMoves, seconds),
+                                        'moveGenerationsPerSecond': rate(50 * len(midgameBoards), generateSeconds),
+                                        'maskMoveGenerationsPerSecond': rate(50 * len(midgameBoards), maskSeconds),
+                                        'makeUnmakesPerSecond': rate(numberOfUnmakes, unmakeSeconds)}
+    # determineBoardState is UTTTBoard's; the bitboard decides incrementally within makeMove
+    with quiet():
+        boards = replayGames(UTTTBoard, halfGames)
+    repeats = 5 if quick else 50
+    seconds, unused = timed(determineBoardStates, boards, repeats)
+    results['UTTTBoard']['determineBoardStatesPerSecond'] = rate(repeats * len(boards), seconds)
+    return results
@@ -0,0 +1,61 @@
+import contextlib
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+
+# Helpers shared by the benchmark scenarios. Every scenario seeds its own random generators, so that a
+# run does the same work on every build.
+
+BENCHMARK_SEED = 2017
+
+def seedEverything(seed=BENCHMARK_SEED):
+    random.seed(seed)
+    np.random.seed(seed)
+
+@contextlib.contextmanager
+def quiet():
+    # The boards print every finished game
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def timed(function, *args):
+    startTime = time.time()
+    result = function(*args)
+    return time.time() - startTime, result
+
+def rate(count, seconds):
+    return count / seconds if seconds > 0 else 0.0
+
+def latencySummary(seconds):
+    # Milliseconds, as latency budgets are given
+    milliseconds = np.asarray(seconds) * 1000.0
+    return {'count': len(milliseconds), 'meanMs': float(milliseconds.mean()),
+            'p50Ms': float(np.percentile(milliseconds, 50)), 'p95Ms': float(np.percentile(milliseconds, 95)),
+            'maxMs': float(milliseconds.max())}
+
+def currentRSS():
+    # Resident set size in bytes
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def peakRSS():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024    # Kilobytes on Linux
+
+def environmentInfo():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'machine': platform.machine(),
+            'numpy': np.__version__, 'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'seed': BENCHMARK_SEED}
@@ -0,0 +1,18 @@
+from benchmarks.common import seedEverything, quiet, timed, rate
+from game import GameSequence
+from ultimateboard import UTTTBoard, UTTTBoardDecision
+from ultimatebitboard import UTTTBitBoard
+from ultimateplayer import RandomUTTTPlayer
+
+# Random vs. random games through SingleGame (by way of GameSequence)
+
+def run(quick=False):
+    numberOfGames = 50 if quick else 500
+    results = {'games': numberOfGames}
+    for BoardClass in (UTTTBoard, UTTTBitBoard):
+        seedEverything()
+        games = GameSequence(numberOfGames, RandomUTTTPlayer(), RandomUTTTPlayer(), BoardClass, UTTTBoardDecision)
+        with quiet():
+            seconds, winPercent = timed(games.playGamesAndGetWinPercent)
+        results[BoardClass.__name__] = {'gamesPerSecond': rate(numberOfGames, seconds), 'winPercent': winPercent}
+    return results
@@ -0,0 +1,37 @@
+import json
+import os
+import subprocess
+import sys
+
+# Start-up cost: the time to import each module in a fresh interpreter (the median of a few runs), and
+# which heavy frameworks the import pulls in. Modules that workers and command line tools start from
+# are expected to import within IMPORT_BUDGET_MS without loading any of HEAVY_MODULES.
+
+IMPORT_BUDGET_MS = 100.0
+BUDGETED_MODULES = ['board', 'ultimateboard', 'ultimatebitboard', 'game', 'learning', 'ultimateplayer']
+OTHER_MODULES = ['valuestore', 'tablebase', 'batchgame']
+HEAVY_MODULES = ['numpy', 'keras', 'tensorflow']
+
+MEASURE_IMPORT = '''
+import json, sys, time
+startTime = time.time()
+import %s
+print json.dumps({'ms': (time.time() - startTime) * 1000.0,
+                  'heavy': [name for name in %r if name in sys.modules]})
+'''
+
+def measureImport(moduleName):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', MEASURE_IMPORT % (moduleName, HEAVY_MODULES)], cwd=root)
+    return json.loads(output.splitlines()[-1])
+
+def run(quick=False):
+    repeats = 3 if quick else 9
+    results = {'budgetMs': IMPORT_BUDGET_MS, 'overBudget': []}
+    for moduleName in BUDGETED_MODULES + OTHER_MODULES:
+        measurements = [measureImport(moduleName) for k in range(repeats)]
+        milliseconds = sorted(measurement['ms'] for measurement in measurements)
+        results[moduleName] = {'importMs': milliseconds[len(milliseconds) // 2], 'heavyModules': measurements[0]['heavy']}
+        if moduleName in BUDGETED_MODULES and (results[moduleName]['importMs'] > IMPORT_BUDGET_MS or measurements[0]['heavy']):
+            results['overBudget'].append(moduleName)
+    return results
@@ -0,0 +1,42 @@
+from benchmarks.common import seedEverything, quiet, latencySummary
+from game import GameSequence
+from learning import TableLearning
+from ultimateboard import UTTTBoard, UTTTBoardDecision
+from ultimateplayer import RandomUTTTPlayer, RLUTTTPlayer
+import time
+
+# Latency of RLUTTTPlayer.makeNextMove against a random player, with either learning algorithm
+
+def measureMoveLatency(player, numberOfGames):
+    latencies = []
+    makeNextMove = player.makeNextMove
+    def timedMakeNextMove():
+        active = player.isBoardActive()
+        startTime = time.time()
+        previousState = makeNextMove()
+        if active:
+            latencies.append(time.time() - startTime)
+        return previousState
+    player.makeNextMove = timedMakeNextMove
+    with quiet():
+        GameSequence(numberOfGames, player, RandomUTTTPlayer(), UTTTBoard, UTTTBoardDecision).playGamesAndGetWinPercent()
+    del player.makeNextMove
+    return latencySummary(latencies)
+
+def run(quick=False):
+    results = {}
+    seedEverything()
+    player = RLUTTTPlayer(TableLearning(UTTTBoardDecision))
+    with quiet():   # Latency with a table that has seen some games
+        GameSequence(100 if quick else 1000, player, RandomUTTTPlayer(), UTTTBoard, UTTTBoardDecision).playGamesAndGetWinPercent()
+    results['TableLearning'] = measureMoveLatency(player, 20 if quick else 200)
+    results['TableLearning']['states'] = len(player.learningAlgo.values)
+    seedEverything()
+    try:
+        from learning import NNUltimateLearning
+        player = RLUTTTPlayer(NNUltimateLearning(UTTTBoardDecision))
+    except ImportError as error:    # Keras is optional
+        results['NNUltimateLearning'] = {'skipped': str(error)}
+    else:
+        results['NNUltimateLearning'] = measureMoveLatency(player, 5 if quick else 50)
+    return results
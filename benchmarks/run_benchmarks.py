@@ -0,0 +1,83 @@
+import argparse
+import importlib
+import json
+import sys
+import traceback
+from benchmarks.common import environmentInfo
+
+# Runs the benchmark scenarios and writes their results as JSON. From the repository root:
+#     python -m benchmarks.run_benchmarks --output results.json
+#     python -m benchmarks.run_benchmarks --quick --compare results.json
+# With --compare, every rate that dropped (or time that grew) by more than --tolerance against the
+# given earlier results is listed, and the exit status is 1 if there is any.
+
+SCENARIOS = ['board', 'game', 'player', 'storage', 'import']
+HIGHER_IS_BETTER = ('PerSecond',)
+LOWER_IS_BETTER = ('Seconds', 'Ms', 'Bytes')
+
+def runScenarios(names, quick):
+    results = {}
+    for name in names:
+        try:
+            module = importlib.import_module('benchmarks.%s_benchmarks' % name)
+            results[name] = module.run(quick)
+        except Exception:   # A scenario that cannot run (e.g. a missing dependency) is reported, not fatal
+            results[name] = {'error': traceback.format_exc().splitlines()[-1]}
+        sys.stderr.write('%s done\n' % name)
+    return results
+
+def flatten(results, prefix=''):
+    if isinstance(results, dict):
+        items = results.iteritems()
+    elif isinstance(results, list):
+        items = enumerate(results)
+    else:
+        return {prefix: results}
+    flat = {}
+    for (key, value) in items:
+        flat.update(flatten(value, '%s/%s' % (prefix, key) if prefix else str(key)))
+    return flat
+
+def isMeasurement(value):
+    # Counts such as byte sizes are ints; flags such as 'quick' are not measurements
+    return isinstance(value, (int, long, float)) and not isinstance(value, bool)
+
+def findRegressions(results, baseline, tolerance):
+    regressions = []
+    current, previous = flatten(results), flatten(baseline)
+    for (name, value) in sorted(current.iteritems()):
+        before = previous.get(name)
+        if not isMeasurement(value) or not isMeasurement(before) or before <= 0:
+            continue
+        if name.endswith(HIGHER_IS_BETTER) and value < before * (1 - tolerance):
+            regressions.append((name, before, value))
+        elif name.endswith(LOWER_IS_BETTER) and value > before * (1 + tolerance):
+            regressions.append((name, before, value))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Ultimate TTT performance benchmarks')
+    parser.add_argument('--quick', action='store_true', help='smaller scenarios, for a fast check')
+    parser.add_argument('--only', action='append', choices=SCENARIOS, help='run only this scenario (repeatable)')
+    parser.add_argument('--output', help='write the JSON results here instead of to stdout')
+    parser.add_argument('--compare', help='JSON results of an earlier run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative change that counts as a regression')
+    args = parser.parse_args()
+    report = {'environment': environmentInfo(), 'quick': args.quick,
+              'results': runScenarios(args.only or SCENARIOS, args.quick)}
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(output + '\n')
+    else:
+        print output
+    if args.compare:
+        with open(args.compare) as infile:
+            regressions = findRegressions(report['results'], json.load(infile)['results'], args.tolerance)
+        for (name, before, value) in regressions:
+            sys.stderr.write('Regression in %s: %.4g -> %.4g\n' % (name, before, value))
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+from benchmarks.common import seedEverything, timed, currentRSS, peakRSS
+from batchgame import STATE_CHARACTERS
+from learning import TableLearning
+from ultimateboard import UTTTBoardDecision
+from valuestore import CompactValueStore
+import multiprocessing
+import numpy as np
+import os
+import shutil
+import tempfile
+
+# Save/load time, file size and memory of TableLearning as the table grows. Every size is measured in
+# a process of its own, so the peak RSS of one does not hide the next.
+
+def randomBoardStates(count):
+    cells = STATE_CHARACTERS[np.random.randint(0, 3, size=(count, 81))]
+    return [row.tostring() for row in cells]
+
+def measureTable(numberOfStates, storeName, directory):
+    seedEverything()
+    boardStates, values = randomBoardStates(numberOfStates), np.random.random_sample(numberOfStates).tolist()
+    rssBefore = currentRSS()
+    learningAlgo = TableLearning(UTTTBoardDecision, CompactValueStore() if storeName == 'CompactValueStore' else None)
+    buildSeconds, unused = timed(learningAlgo.values.update, dict(zip(boardStates, values)))
+    del boardStates
+    rssAfter = currentRSS()
+    filename = os.path.join(directory, 'values_%s_%s.bin' % (storeName, numberOfStates))
+    saveSeconds, unused = timed(learningAlgo.saveLearning, filename)
+    loaded = TableLearning(UTTTBoardDecision, CompactValueStore() if storeName == 'CompactValueStore' else None)
+    loadSeconds, unused = timed(loaded.loadLearning, filename)
+    return {'states': numberOfStates, 'buildSeconds': buildSeconds, 'saveSeconds': saveSeconds,
+            'loadSeconds': loadSeconds, 'fileBytes': os.path.getsize(filename),
+            'tableRSSBytes': rssAfter - rssBefore, 'peakRSSBytes': peakRSS()}
+
+def _measureInChild(args, resultQueue):
+    resultQueue.put(measureTable(*args))
+
+def run(quick=False):
+    sizes = [10000, 50000] if quick else [10000, 100000, 1000000]
+    directory = tempfile.mkdtemp(prefix='uttt_benchmark_')
+    results = {}
+    try:
+        for storeName in ('dict', 'CompactValueStore'):
+            results[storeName] = []
+            for numberOfStates in sizes:
+                resultQueue = multiprocessing.Queue()
+                child = multiprocessing.Process(target=_measureInChild, args=((numberOfStates, storeName, directory), resultQueue))
+                child.start()
+                results[storeName].append(resultQueue.get())
+                child.join()
+    finally:
+        shutil.rmtree(directory)
+    return results
@@ -11,9 +11,57 @@ class TTTBoardDecision():
     WON_X = 2
     WON_O = 3
 
+GRID_DIGITS = {GridStates.EMPTY: 0, GridStates.PLAYER_X: 1, GridStates.PLAYER_O: 2}
+POWERS_OF_THREE = [3**k for k in range(9)]
+
+# Cells of a board in the order TTTBoard.determineBoardState has always scanned them: rows, columns,
+# then both diagonals. The first complete line decides the winner.
+WIN_LINES = [(0, 1, 2), (3, 4, 5), (6, 7, 8),
+             (0, 3, 6), (1, 4, 7), (2, 5, 8),
+             (0, 4, 8), (2, 4, 6)]
+
+def decideCells(cells):
+    # cells is a flat list of 9 GridStates, cell (i, j) being at position 3*i+j
+    for (a, b, c) in WIN_LINES:
+        if cells[a] != GridStates.EMPTY and cells[a] == cells[b] == cells[c]:
+            return TTTBoardDecision.WON_X if cells[a] == GridStates.PLAYER_X else TTTBoardDecision.WON_O
+    if GridStates.EMPTY in cells:
+        return TTTBoardDecision.ACTIVE
+    return TTTBoardDecision.DRAW
+
+def buildBoardTable():
+    # One (decision, emptyPlaces, hasEmptyCell) entry per base-3 encoding of a board,
+    # where cell (i, j) is digit 3*i+j and EMPTY/X/O are the digits 0/1/2. Built from the 9-bit masks
+    # of the X and O cells, as this runs on every import (same entries as decideCells would give).
+    lineMasks = [sum(1 << k for k in line) for line in WIN_LINES]
+    firstLine = [min([index for (index, line) in enumerate(lineMasks) if m & line == line] or [len(WIN_LINES)])
+                 for m in range(512)]
+    digitSums = [sum(POWERS_OF_THREE[k] for k in range(9) if m & (1 << k)) for m in range(512)]
+    emptyPlaces = [tuple((k // 3, k % 3) for k in range(9) if m & (1 << k)) for m in range(512)]
+    table = [None]*3**9
+    for xMask in range(512):
+        free = 0x1FF & ~xMask
+        oMask = free
+        while True:     # Every subset of the cells that X does not have
+            if firstLine[xMask] < firstLine[oMask]:
+                decision = TTTBoardDecision.WON_X
+            elif firstLine[oMask] < firstLine[xMask]:
+                decision = TTTBoardDecision.WON_O
+            else:
+                decision = TTTBoardDecision.ACTIVE if oMask != free else TTTBoardDecision.DRAW
+            places = emptyPlaces[free & ~oMask]
+            table[digitSums[xMask] + 2*digitSums[oMask]] = (decision, places, len(places) > 0)
+            if oMask == 0:
+                break
+            oMask = (oMask - 1) & free
+    return table
+
+BOARD_TABLE = buildBoardTable()
+
 class TTTBoard():
     def __init__(self):
         self.board = self.emptyState()
+        self.code = 0   # Base-3 index of the board into BOARD_TABLE
         self.decision = TTTBoardDecision.ACTIVE
 
     def emptyState(self):
@@ -22,39 +70,14 @@ class TTTBoard():
                 [GridStates.EMPTY, GridStates.EMPTY, GridStates.EMPTY]]
 
     def determineBoardState(self):
-        def winCheck(listOfThree):
-            return len(set(listOfThree)) == 1 and GridStates.EMPTY not in listOfThree
-
-        def getWinState(listOfThree):
-            return TTTBoardDecision.WON_O if GridStates.PLAYER_O in listOfThree else TTTBoardDecision.WON_X
-
-        for row in self.board:  # Check rows first
-            if winCheck(row):  # The row was won
-                self.decision = getWinState(row)
-                return
-        for j in range(3):  # Check columns next
-            column = [self.board[0][j], self.board[1][j], self.board[2][j]]
-            if winCheck(column):
-                self.decision = getWinState(column)
-                return
-        diagonal1 = [self.board[i][j] for (i,j) in zip(range(3), range(3))]
-        diagonal2 = [self.board[i][j] for (i, j) in zip(range(3), range(2,-1,-1))]
-        if winCheck(diagonal1):
-            self.decision = getWinState(diagonal1)
-            return
-        if winCheck(diagonal2):
-            self.decision = getWinState(diagonal2)
-            return
-        if filter(lambda x: GridStates.EMPTY in x, self.board):  # Board is full
-            self.decision = TTTBoardDecision.ACTIVE
-        else:
-            self.decision = TTTBoardDecision.DRAW
+        self.decision = BOARD_TABLE[self.code][0]
 
     def makeMove(self, who, i, j, verbose=True):   # who is PLAYER_X or PLAYER_O
         if self.board[i][j] != GridStates.EMPTY:
             print 'That location is not empty'
             return
         self.board[i][j] = who
+        self.code += GRID_DIGITS[who]*POWERS_OF_THREE[3*i+j]
         #self.printBoard()
         self.determineBoardState()
         if self.decision == TTTBoardDecision.DRAW and verbose is True:
@@ -62,6 +85,17 @@ class TTTBoard():
         elif self.decision != TTTBoardDecision.ACTIVE and verbose is True:
             print 'This TTT game was won by %s'%(GridStates.PLAYER_X if self.decision == TTTBoardDecision.WON_X else GridStates.PLAYER_O)
 
+    def unmakeMove(self, i, j):
+        self.code -= GRID_DIGITS[self.board[i][j]]*POWERS_OF_THREE[3*i+j]
+        self.board[i][j] = GridStates.EMPTY
+        self.determineBoardState()
+
+    def setBoardState(self, boardState):
+        # The inverse of getBoardState: 9 GridStates, cell (i, j) at position 3*i+j
+        self.board = [list(boardState[0:3]), list(boardState[3:6]), list(boardState[6:9])]
+        self.code = sum(GRID_DIGITS[grid]*POWERS_OF_THREE[k] for (k, grid) in enumerate(boardState))
+        self.determineBoardState()
+
     def printBoard(self):
         delimiter = "-------------"
         BOARD_FORMAT = "%s\n%s\n%s\n%s\n%s\n%s\n%s"%(delimiter, self.getBoardRowString(0),
@@ -79,20 +113,13 @@ class TTTBoard():
         return self.board[i][j]
 
     def getEmptyBoardPlaces(self):
-        emptyPlaces = []
-        for (i,j) in itertools.product(range(3), range(3)):
-            if self.board[i][j] == GridStates.EMPTY:
-                emptyPlaces.append((i,j))
-        return emptyPlaces
+        return BOARD_TABLE[self.code][1]
 
     def getBoardState(self):
         return ''.join([''.join(row) for row in self.board])
 
     def getDoesBoardHaveEmptyCell(self):
-        for (i,j) in itertools.product(range(3), range(3)):
-            if self.board[i][j] == GridStates.EMPTY:
-                return True
-        return False
+        return BOARD_TABLE[self.code][2]
 
     def getBoardDecision(self):
         return self.decision
@@ -0,0 +1,85 @@
+from board import GridStates, TTTBoardDecision
+from batchgame import decideBoards, EMPTY, PLAYER_X, PLAYER_O
+from statekey import unpackBoardState
+import numpy as np
+
+# Network inputs for batches of board states, in one vectorized pass over the bytes of the states.
+# Every input is a stack of planes of 81 values, one per cell in getBoardState() order:
+#   cells           1 for X, -1 for O, 0 for empty (the input NNUltimateLearning has always used)
+#   sideToMove      1 everywhere when X is to move, -1 when O is
+#   legalMoves      1 where the next move may be played
+#   boardDecisions  1 on the cells of tiles won by X, -1 on those won by O
+# The legal moves depend on the tile the last move points at (its place), which a board state alone
+# does not tell: it is given as nextBoards, or found by comparing each state with the previous state.
+
+PLANES = ('cells', 'sideToMove', 'legalMoves', 'boardDecisions')
+
+CELL_VALUES = np.zeros(256, dtype=np.float32)   # Byte of a cell -> value in the cells plane
+CELL_VALUES[ord(GridStates.PLAYER_X)], CELL_VALUES[ord(GridStates.PLAYER_O)] = 1.0, -1.0
+CELL_CODES = np.zeros(256, dtype=np.int8)       # Byte of a cell -> EMPTY/PLAYER_X/PLAYER_O of batchgame.py
+CELL_CODES[ord(GridStates.PLAYER_X)], CELL_CODES[ord(GridStates.PLAYER_O)] = PLAYER_X, PLAYER_O
+DECISION_VALUES = np.zeros(TTTBoardDecision.WON_O + 1, dtype=np.float32)
+DECISION_VALUES[TTTBoardDecision.WON_X], DECISION_VALUES[TTTBoardDecision.WON_O] = 1.0, -1.0
+
+def stateBytes(boardStates):
+    # (N, 81) uint8 array of board states given as strings or packed states
+    states = [state if isinstance(state, basestring) else unpackBoardState(state) for state in boardStates]
+    return np.frombuffer(''.join(states), dtype=np.uint8).reshape(len(states), 81)
+
+def pointedBoards(cells, previousState):
+    # Place of the cell where each state differs from previousState, i.e. the tile its last move points at
+    previous = np.frombuffer(previousState, dtype=np.uint8)
+    return ((cells != previous).argmax(axis=1) % 9).astype(np.intp)
+
+class StateEncoder(object):
+    def __init__(self, sideToMove=False, legalMoves=False, boardDecisions=False):
+        # Without any of the extra planes, inputs are exactly the 81 cell values of earlier versions
+        self.planes = [plane for (plane, used) in zip(PLANES, (True, sideToMove, legalMoves, boardDecisions)) if used]
+        self.inputSize = 81 * len(self.planes)
+        self.needsNextBoards = legalMoves
+
+    def encode(self, boardStates, nextBoards=None, previousState=None):
+        # (N, inputSize) float32 inputs. nextBoards holds the tile (3*row + column) each state's last move
+        # points at, or -1 when any undecided tile may be played (as for the empty board); a tile that is
+        # decided also leaves the choice free, so getNextBoardLocation() works as well. Without nextBoards,
+        # they are found from previousState, the state all of boardStates were reached from by one move.
+        return self.encodePlanes(boardStates, nextBoards, previousState).reshape(-1, self.inputSize)
+
+    def encodePlanes(self, boardStates, nextBoards=None, previousState=None):
+        # The same inputs as (N, planes, 81)
+        cells = stateBytes(boardStates)
+        count = len(cells)
+        inputs = np.empty((count, len(self.planes), 81), dtype=np.float32)
+        inputs[:, 0] = CELL_VALUES[cells]
+        if len(self.planes) == 1:
+            return inputs
+        codes = CELL_CODES[cells]
+        boardDecisions = decideBoards(codes.reshape(count*9, 9), PLAYER_X, PLAYER_O).reshape(count, 9)
+        for (k, plane) in enumerate(self.planes[1:], 1):
+            if plane == 'sideToMove':
+                xToMove = (codes == PLAYER_X).sum(axis=1) == (codes == PLAYER_O).sum(axis=1)
+                inputs[:, k] = np.where(xToMove, 1.0, -1.0)[:, None]
+            elif plane == 'legalMoves':
+                inputs[:, k] = self.legalMoves(codes, boardDecisions, nextBoards, cells, previousState)
+            else:
+                inputs[:, k] = np.repeat(DECISION_VALUES[boardDecisions], 9, axis=1)
+        return inputs
+
+    def legalMoves(self, codes, boardDecisions, nextBoards, cells, previousState):
+        count = len(codes)
+        if nextBoards is not None:
+            nextBoards = np.asarray(nextBoards, dtype=np.intp)
+        elif previousState is not None:
+            nextBoards = pointedBoards(cells, previousState)
+        else:
+            nextBoards = np.full(count, -1, dtype=np.intp)
+        empty = codes == EMPTY
+        # Full tiles without a line come out of decideBoards as ACTIVE, but are drawn
+        activeBoards = (boardDecisions == TTTBoardDecision.ACTIVE) & empty.reshape(count, 9, 9).any(axis=2)
+        rows = np.arange(count)
+        pointedActive = (nextBoards >= 0) & activeBoards[rows, np.maximum(nextBoards, 0)]
+        allowedBoards = np.where(pointedActive[:, None], np.arange(9) == nextBoards[:, None], activeBoards)
+        # No moves at all once the game is won
+        gameDecisions = decideBoards(boardDecisions, TTTBoardDecision.WON_X, TTTBoardDecision.WON_O)
+        allowedBoards &= (gameDecisions == TTTBoardDecision.ACTIVE)[:, None]
+        return empty & np.repeat(allowedBoards, 9, axis=1)
@@ -1,11 +1,16 @@
 from board import TTTBoardDecision, GridStates, TTTBoard
+import multiprocessing
+import random
+import sys
 
 class SingleGame(object):
-    def __init__(self, player1, player2, BoardClass=TTTBoard, BoardDecisionClass=TTTBoardDecision):
+    def __init__(self, player1, player2, BoardClass=TTTBoard, BoardDecisionClass=TTTBoardDecision, recorder=None):
+        # A recorder (see gamerecord.py) gets the board and its decision at the end of the game
         self.player1 = player1
         self.player2 = player2
         self.board = BoardClass()
         self.BoardDecisionClass = BoardDecisionClass
+        self.recorder = recorder
 
     def playAGame(self):
         self.player1.startNewGame()
@@ -21,26 +26,102 @@ class SingleGame(object):
             self.player2.learnFromMove(pState2)
         self.player1.finishGame()
         self.player2.finishGame()
-        return self.board.getBoardDecision()
+        decision = self.board.getBoardDecision()
+        if self.recorder is not None:
+            self.recorder.recordGame(self.board, decision)
+        return decision
 
 class GameSequence(object):
-    def __init__(self, numberOfGames, player1, player2, BoardClass=TTTBoard, BoardDecisionClass=TTTBoardDecision):
+    def __init__(self, numberOfGames, player1, player2, BoardClass=TTTBoard, BoardDecisionClass=TTTBoardDecision,
+                 recorder=None):
         self.player1 = player1
         self.player2 = player2
         self.numberOfGames = numberOfGames
         self.BoardClass = BoardClass
         self.BoardDecisionClass = BoardDecisionClass
+        self.recorder = recorder
 
     def playGamesAndGetWinPercent(self):
         results = []
         for i in range(self.numberOfGames):
-            game = SingleGame(self.player1, self.player2, self.BoardClass, self.BoardDecisionClass)
+            game = SingleGame(self.player1, self.player2, self.BoardClass, self.BoardDecisionClass, self.recorder)
             results.append(game.playAGame())
+        return self.getWinPercent(results)
+
+    def getWinPercent(self, results):
         xpct, opct, drawpct = float(results.count(self.BoardDecisionClass.WON_X))/float(self.numberOfGames), \
                               float(results.count(self.BoardDecisionClass.WON_O))/float(self.numberOfGames), \
                               float(results.count(self.BoardDecisionClass.DRAW))/float(self.numberOfGames)
         return (xpct, opct, drawpct)
 
+def getShardedLearners(player1, player2):
+    # Learning algorithms whose experience is played out in worker processes and merged back. Any other
+    # learning algorithm would learn only in the workers and lose it all, so it is refused.
+    learners = []
+    for player in (player1, player2):
+        learningAlgo = getattr(player, 'learningAlgo', None)
+        if learningAlgo is None or learningAlgo in learners:
+            continue
+        if not hasattr(learningAlgo, 'getValueDeltas'):
+            raise ValueError('%s cannot merge what it learns in worker processes, play it with GameSequence instead'
+                             % type(learningAlgo).__name__)
+        learners.append(learningAlgo)
+    return learners
+
+_shardSetup = None   # (player1, player2, BoardClass, BoardDecisionClass, recording), inherited by forked workers
+
+def playGameShard(args):
+    # Game records, if recording, are sent back with the results and written by the parent
+    numberOfGames, seed = args
+    player1, player2, BoardClass, BoardDecisionClass, recording = _shardSetup
+    random.seed(seed)
+    learners = getShardedLearners(player1, player2)
+    for learningAlgo in learners:
+        learningAlgo.startValueJournal()
+    recorder = None
+    if recording:
+        from gamerecord import GameRecordList
+        recorder = GameRecordList()
+    results = [SingleGame(player1, player2, BoardClass, BoardDecisionClass, recorder).playAGame() for i in range(numberOfGames)]
+    return results, [learningAlgo.getValueDeltas() for learningAlgo in learners], recorder.records if recording else None
+
+class ParallelGameSequence(GameSequence):
+    # Plays the games over a pool of processes. Each round, every worker plays up to `syncInterval` games
+    # against a snapshot of the players (the pool is forked from the parent, so tables are not copied
+    # up front), and sends back the changes of the value tables which are then merged into the parent.
+    # States a worker only looked at come back only if their value changed, so the parent's table holds
+    # fewer states than after the same games played with GameSequence.
+    def __init__(self, numberOfGames, player1, player2, BoardClass=TTTBoard, BoardDecisionClass=TTTBoardDecision,
+                 numberOfProcesses=None, syncInterval=100, recorder=None):
+        super(ParallelGameSequence, self).__init__(numberOfGames, player1, player2, BoardClass, BoardDecisionClass,
+                                                   recorder)
+        self.numberOfProcesses = multiprocessing.cpu_count() if numberOfProcesses is None else numberOfProcesses
+        self.syncInterval = syncInterval
+
+    def playGamesAndGetWinPercent(self):
+        global _shardSetup
+        results, remainingGames = [], self.numberOfGames
+        learners = getShardedLearners(self.player1, self.player2)
+        while remainingGames > 0:
+            shardSizes = []
+            while remainingGames > 0 and len(shardSizes) < self.numberOfProcesses:
+                shardSizes.append(min(self.syncInterval, remainingGames))
+                remainingGames -= shardSizes[-1]
+            _shardSetup = (self.player1, self.player2, self.BoardClass, self.BoardDecisionClass, self.recorder is not None)
+            pool = multiprocessing.Pool(len(shardSizes))
+            try:
+                shards = pool.map(playGameShard, [(size, random.randint(0, sys.maxint)) for size in shardSizes])
+            finally:
+                pool.terminate()
+                _shardSetup = None
+            for (shardResults, shardDeltas, shardRecords) in shards:
+                results.extend(shardResults)
+                if self.recorder is not None:
+                    self.recorder.addRecords(shardRecords)
+                for (learningAlgo, deltas) in zip(learners, shardDeltas):
+                    learningAlgo.mergeValueDeltas(deltas)
+        return self.getWinPercent(results)
+
 if __name__ == '__main__':
     from ultimateplayer import RandomUTTTPlayer
     from ultimateboard import UTTTBoard, UTTTBoardDecision
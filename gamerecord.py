@@ -0,0 +1,173 @@
+from board import GridStates
+from ultimateboard import UTTTBoard, UTTTBoardDecision, CELL_MOVES
+import numpy as np
+import os
+import re
+import struct
+import zlib
+
+# Game records: one byte per move, the cell played (0-80, indexed as in getBoardState(): 9*board + place),
+# then one byte for the result. Result bytes are the only ones from 0x80 up, so they also end the record.
+# X always moves first. GameRecorder appends records to the files of a directory, where every file is a
+# sequence of blocks of many games, each zlib-compressed or not, and a new file is started once a file
+# reaches maxFileBytes. Files are only ever appended to; a block cut short by a crash is skipped when
+# reading. readGameRecords streams the games back, to be replayed on a board (replayGame), as board
+# states (replayStates) or as encoded training batches (iterTrainingBatches).
+
+RECORD_FILE_PREFIX = 'games-'
+RECORD_FILE_SUFFIX = '.rec'
+BLOCK_MAGIC = 'UTGR'
+BLOCK_HEADER = struct.Struct('<4sBII')  # magic, flags, number of games, payload bytes
+COMPRESSED = 1
+RESULT_BYTES = {UTTTBoardDecision.DRAW: 0x80, UTTTBoardDecision.WON_X: 0x81, UTTTBoardDecision.WON_O: 0x82,
+                UTTTBoardDecision.ACTIVE: 0x83}     # ACTIVE for games stopped before the end
+RESULT_OF_BYTE = dict((resultByte, decision) for (decision, resultByte) in RESULT_BYTES.iteritems())
+RECORD_PATTERN = re.compile('([\x00-\x7f]*)([\x80-\xff])')
+
+def encodeGame(cells, decision):
+    return str(bytearray(cells)) + chr(RESULT_BYTES[decision])
+
+class GameRecordList(object):
+    # Keeps the records in memory, e.g. for games played in worker processes
+    def __init__(self):
+        self.records = []
+
+    def recordGame(self, board, decision):
+        self.records.append(encodeGame(board.getMoveHistory(), decision))
+
+    def addRecords(self, records):
+        self.records.extend(records)
+
+class GameRecorder(object):
+    def __init__(self, directory, compress=True, gamesPerBlock=1000, maxFileBytes=64*2**20):
+        # Games are written once gamesPerBlock of them are pending, and on flush() or close(). Every
+        # recorder starts a new file, after the ones already in the directory.
+        self.directory = directory
+        self.compress = compress
+        self.gamesPerBlock = gamesPerBlock
+        self.maxFileBytes = maxFileBytes
+        self.pendingRecords = []
+        self.outfile = None
+        self.gamesWritten = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def recordGame(self, board, decision):
+        # Called by SingleGame at the end of every game (see game.py)
+        self.addRecords([encodeGame(board.getMoveHistory(), decision)])
+
+    def addRecords(self, records):
+        self.pendingRecords.extend(records)
+        if len(self.pendingRecords) >= self.gamesPerBlock:
+            self.flush()
+
+    def flush(self):
+        if not self.pendingRecords:
+            return
+        payload, flags = ''.join(self.pendingRecords), 0
+        if self.compress:
+            payload, flags = zlib.compress(payload), COMPRESSED
+        outfile = self.getFile()
+        outfile.write(BLOCK_HEADER.pack(BLOCK_MAGIC, flags, len(self.pendingRecords), len(payload)) + payload)
+        outfile.flush()
+        self.gamesWritten += len(self.pendingRecords)
+        self.pendingRecords = []
+
+    def getFile(self):
+        if self.outfile is not None and self.outfile.tell() >= self.maxFileBytes:
+            self.outfile.close()
+            self.outfile = None
+        if self.outfile is None:
+            numbers = [int(name[len(RECORD_FILE_PREFIX):-len(RECORD_FILE_SUFFIX)]) for name in getRecordFiles(self.directory)]
+            filename = '%s%06d%s' % (RECORD_FILE_PREFIX, max(numbers) + 1 if numbers else 0, RECORD_FILE_SUFFIX)
+            self.outfile = open(os.path.join(self.directory, filename), 'ab')
+        return self.outfile
+
+    def close(self):
+        self.flush()
+        if self.outfile is not None:
+            self.outfile.close()
+            self.outfile = None
+
+def getRecordFiles(directory):
+    # Names of the record files of a directory, in the order they were written
+    return sorted(name for name in os.listdir(directory)
+                  if name.startswith(RECORD_FILE_PREFIX) and name.endswith(RECORD_FILE_SUFFIX))
+
+def readBlocks(filename):
+    # Generator of the payloads of the blocks of a record file, uncompressed
+    with open(filename, 'rb') as infile:
+        while True:
+            header = infile.read(BLOCK_HEADER.size)
+            if len(header) < BLOCK_HEADER.size:
+                return
+            magic, flags, games, length = BLOCK_HEADER.unpack(header)
+            if magic != BLOCK_MAGIC:
+                raise ValueError('%s is not a game record file' % filename)
+            payload = infile.read(length)
+            if len(payload) < length:
+                return
+            yield zlib.decompress(payload) if flags & COMPRESSED else payload
+
+def readGameRecords(path):
+    # Generator of (cells, decision) for every game recorded in path, a directory of record files or a
+    # single one. cells is a bytearray of the cells played.
+    filenames = [os.path.join(path, name) for name in getRecordFiles(path)] if os.path.isdir(path) else [path]
+    for filename in filenames:
+        for payload in readBlocks(filename):
+            for match in RECORD_PATTERN.finditer(payload):
+                yield bytearray(match.group(1)), RESULT_OF_BYTE[ord(match.group(2))]
+
+def replayGame(cells, BoardClass=UTTTBoard):
+    # Generator of (board, previousState) after every move of a game, played on a single board
+    board = BoardClass(verbose=False)
+    for (k, cell) in enumerate(cells):
+        previousState = board.getBoardState()
+        (whichBoard, whichLocation) = CELL_MOVES[cell]
+        board.makeMove(GridStates.PLAYER_O if k % 2 else GridStates.PLAYER_X, whichBoard, whichLocation)
+        yield board, previousState
+
+def replayStates(cells):
+    # Generator of (boardState, nextBoard) after every move of a game, without a board: nextBoard is the
+    # tile the move points at, as StateEncoder.encode takes it
+    state = bytearray(GridStates.EMPTY*81)
+    for (k, cell) in enumerate(cells):
+        state[cell] = GridStates.PLAYER_O if k % 2 else GridStates.PLAYER_X
+        yield str(state), cell % 9
+
+def getOutcomeValue(decision, player):
+    # Value of a finished game for player: 1 for a win, 0 for a loss and 0.5 for a draw
+    if decision == UTTTBoardDecision.DRAW:
+        return 0.5
+    return 1.0 if (decision == UTTTBoardDecision.WON_X) == (player == GridStates.PLAYER_X) else 0.0
+
+def trainFromRecords(learningAlgo, records, player=GridStates.PLAYER_X, BoardClass=UTTTBoard):
+    # Replays recorded games into a learning algorithm as if it had played them as `player`: it learns
+    # from every move and gets gameOver() after every game, as in SingleGame. Returns the number of games.
+    games = 0
+    for (cells, decision) in records:
+        learningAlgo.resetForNewGame()
+        for (board, previousState) in replayGame(cells, BoardClass):
+            learningAlgo.learnFromMove(player, board, previousState)
+        learningAlgo.gameOver()
+        games += 1
+    return games
+
+def iterTrainingBatches(records, encoder, batchSize=4096, player=GridStates.PLAYER_X):
+    # Generator of (inputs, targets) over every position of the finished recorded games, encoded by a
+    # StateEncoder (see encoding.py) with the outcome of the game for player as target, e.g. to fit
+    # NNUltimateLearning with trainModel(inputs, targets)
+    states, nextBoards, targets = [], [], []
+    for (cells, decision) in records:
+        if decision == UTTTBoardDecision.ACTIVE:
+            continue
+        value = getOutcomeValue(decision, player)
+        for (boardState, nextBoard) in replayStates(cells):
+            states.append(boardState)
+            nextBoards.append(nextBoard)
+            targets.append(value)
+            if len(states) == batchSize:
+                yield encoder.encode(states, nextBoards), np.array(targets, dtype=np.float32)
+                states, nextBoards, targets = [], [], []
+    if states:
+        yield encoder.encode(states, nextBoards), np.array(targets, dtype=np.float32)
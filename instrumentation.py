@@ -0,0 +1,168 @@
+import cProfile
+import csv
+import importlib
+import json
+import os
+import pstats
+import time
+
+# Opt-in instrumentation of the hot paths of training runs. While enabled, the methods listed in HOT_PATHS
+# are replaced on their classes by wrappers that count calls and add up their (inclusive) time; disabling
+# puts the originals back, so there is no cost at all when it is not in use. Every `snapshotEvery` games a
+# row of counters, gauges (table sizes, cache hit rates, memory) and games/sec goes to a CSV or JSON lines
+# file, and every `profileEvery`-th game can be run under cProfile.
+
+HOT_PATHS = [('game', 'SingleGame', ['playAGame']),
+             ('board', 'TTTBoard', ['determineBoardState']),
+             ('ultimateboard', 'UTTTBoard', ['makeMove', 'determineBoardState']),
+             ('ultimatebitboard', 'UTTTBitBoard', ['makeMove']),
+             ('ultimateplayer', 'RandomUTTTPlayer', ['makeNextMove']),
+             ('ultimateplayer', 'RLUTTTPlayer', ['makeNextMove', 'learnFromMove']),
+             ('ultimateplayer', 'MCTSUTTTPlayer', ['makeNextMove']),
+             ('ultimateplayer', 'AlphaBetaUTTTPlayer', ['makeNextMove']),
+             ('learning', 'TableLearning', ['getBoardStateValue', 'getBoardStateValues', 'learnFromMove',
+                                            'saveLearning', 'loadLearning']),
+             ('learning', 'NNUltimateLearning', ['getBoardStateValue', 'getBoardStateValues', 'learnFromMove',
+                                                 'predict', 'trainModel', 'trainFromReplayBuffer', 'gameOver',
+                                                 'saveLearning', 'loadLearning'])]
+
+FIRST_COLUMNS = ['time', 'games', 'rssMB', 'gamesPerSecond']
+
+def _currentRSS():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+class Instrumentation(object):
+    def __init__(self, output=None, snapshotEvery=100, profileEvery=None, hotPaths=HOT_PATHS):
+        # output is a .csv file, or any other name for JSON lines; rows are appended to it
+        self.output = output
+        self.snapshotEvery = snapshotEvery
+        self.profileEvery = profileEvery
+        self.hotPaths = hotPaths
+        self.callStats = {}     # label -> [calls, seconds]
+        self.gauges = []        # (name, function) pairs sampled at every snapshot
+        self.patched = []       # (class, name, original) to restore
+        self.profile = None
+        self.games = 0
+        self.snapshotTime, self.snapshotGames = None, 0
+        self.csvColumns = None
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    def enable(self):
+        if self.patched:
+            return
+        for (moduleName, className, methodNames) in self.hotPaths:
+            try:
+                cls = getattr(importlib.import_module(moduleName), className)
+            except ImportError:     # e.g. Keras is not installed for learning.py
+                continue
+            for name in methodNames:
+                if name in cls.__dict__:
+                    self.patch(cls, name, '%s.%s' % (className, name))
+        self.snapshotTime, self.snapshotGames = time.time(), self.games
+
+    def disable(self):
+        for (cls, name, original) in reversed(self.patched):
+            setattr(cls, name, original)
+        self.patched = []
+
+    def patch(self, cls, name, label):
+        # Also usable for methods that are not in HOT_PATHS
+        original = cls.__dict__[name]
+        wrapper = self.wrapGame(original) if label == 'SingleGame.playAGame' else self.wrap(original, label)
+        setattr(cls, name, wrapper)
+        self.patched.append((cls, name, original))
+
+    def wrap(self, function, label):
+        stats = self.callStats.setdefault(label, [0, 0.0])
+        clock = time.time
+        def wrapper(*args, **kwargs):
+            startTime = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stats[0] += 1
+                stats[1] += clock() - startTime
+        wrapper.__name__, wrapper.__doc__ = function.__name__, function.__doc__
+        return wrapper
+
+    def wrapGame(self, function):
+        timedFunction = self.wrap(function, 'SingleGame.playAGame')
+        def playAGame(game):
+            self.games += 1
+            if self.profileEvery and self.games % self.profileEvery == 0:
+                if self.profile is None:
+                    self.profile = cProfile.Profile()
+                result = self.profile.runcall(timedFunction, game)
+            else:
+                result = timedFunction(game)
+            if self.snapshotEvery and self.games % self.snapshotEvery == 0:
+                self.writeSnapshot()
+            return result
+        return playAGame
+
+    def addGauge(self, name, function):
+        self.gauges.append((name, function))
+
+    def watchLearner(self, learningAlgo, name='learner'):
+        # Table size and the hit rate of value stores that count hits (see valuestore.py). Stores keep count
+        # of their states, so the size costs nothing per snapshot.
+        values = getattr(learningAlgo, 'values', None)
+        if values is None:
+            return
+        self.addGauge(name + '.tableSize', lambda: len(learningAlgo.values))
+        def hitRate():
+            stats = learningAlgo.values.getStats() if hasattr(learningAlgo.values, 'getStats') else {}
+            lookups = stats.get('hits', 0) + stats.get('misses', 0)
+            return float(stats['hits']) / lookups if lookups else None
+        self.addGauge(name + '.hitRate', hitRate)
+
+    def watchTablebase(self, tablebase, name='tablebase'):
+        self.addGauge(name + '.hitRate', lambda: float(tablebase.hits) / tablebase.probes if tablebase.probes else None)
+
+    def snapshot(self):
+        now = time.time()
+        seconds = now - self.snapshotTime if self.snapshotTime is not None else 0.0
+        row = {'time': now, 'games': self.games,
+               'gamesPerSecond': (self.games - self.snapshotGames) / seconds if seconds > 0 else 0.0,
+               'rssMB': _currentRSS() / float(1 << 20)}
+        for (label, (calls, totalSeconds)) in sorted(self.callStats.iteritems()):
+            row[label + '.calls'] = calls
+            row[label + '.seconds'] = totalSeconds
+        for (name, function) in self.gauges:
+            row[name] = function()
+        self.snapshotTime, self.snapshotGames = now, self.games
+        return row
+
+    def writeSnapshot(self):
+        row = self.snapshot()
+        if self.output is None:
+            return row
+        isNewFile = not os.path.isfile(self.output) or os.path.getsize(self.output) == 0
+        with open(self.output, 'a') as outfile:
+            if self.output.endswith('.csv'):
+                # Games and memory as the 2nd and 3rd columns, like memory_scaling.csv, so that
+                # test_scripts.plotMemoryUsageFromFile plots them too (it skips the header row)
+                if self.csvColumns is None:
+                    self.csvColumns = FIRST_COLUMNS + sorted(set(row) - set(FIRST_COLUMNS))
+                    if isNewFile:
+                        csv.writer(outfile).writerow(self.csvColumns)
+                csv.DictWriter(outfile, self.csvColumns, extrasaction='ignore').writerow(row)
+            else:
+                outfile.write(json.dumps(row, sort_keys=True) + '\n')
+        return row
+
+    def printProfile(self, sortBy='cumulative', limit=30):
+        if self.profile is not None:
+            pstats.Stats(self.profile).sort_stats(sortBy).print_stats(limit)
+
+    def dumpProfile(self, filename):
+        # Readable with pstats or tools such as snakeviz
+        if self.profile is not None:
+            self.profile.dump_stats(filename)
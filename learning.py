@@ -1,15 +1,34 @@
 from board import GridStates, TTTBoardDecision
+from statekey import packBoardState
 import json
-from keras.models import Sequential, load_model
-from keras.layers import Dense
-from keras.utils import plot_model
-import numpy as np
+import os
+
+# Keras (and with it TensorFlow) and NumPy are only imported once a neural network learner is created,
+# see loadKerasBackend, so that table learning, players and short-lived worker processes start quickly
+Sequential = load_model = Dense = NumpyDenseNetwork = StateEncoder = np = None
+
+def loadKerasBackend():
+    global Sequential, load_model, Dense, NumpyDenseNetwork, StateEncoder, np
+    if np is None:
+        from keras.models import Sequential, load_model
+        from keras.layers import Dense
+        from nninference import NumpyDenseNetwork
+        from encoding import StateEncoder
+        import numpy as np
 
 class GenericLearning(object):
     def getBoardStateValue(self, player, board, boardState):
         # Return the perceived `value` of a given board state
         raise NotImplementedError
 
+    def getBoardStateValues(self, player, board, boardStates):
+        # Return the values of several candidate board states at once (override to batch the work)
+        return [self.getBoardStateValue(player, board, boardState) for boardState in boardStates]
+
+    def acceptsPackedStates(self):
+        # Whether board states may also be given as packed integers (see statekey.py) instead of strings
+        return False
+
     def learnFromMove(self, player, board, prevBoardState):
         # Learn from the previous board state and the current state of the board
         raise NotImplementedError
@@ -24,6 +43,19 @@ class GenericLearning(object):
         # Use only if also saving the intermediate state above
         raise NotImplementedError
 
+    def getPolicySnapshot(self):
+        # Picklable state that lets a copy of this algorithm in another process play like this one
+        # (see actorlearner.py); it may hold only what changed since the previous snapshot
+        raise NotImplementedError
+
+    def setPolicySnapshot(self, snapshot):
+        # Apply a snapshot from getPolicySnapshot
+        raise NotImplementedError
+
+    def stopPolicySnapshots(self):
+        # Stop tracking what changes for the next snapshot, once no more snapshots will be taken
+        pass
+
     def resetForNewGame(self):
         pass
 
@@ -31,55 +63,200 @@ class GenericLearning(object):
         pass
 
 class TableLearning(GenericLearning):
-    def __init__(self, DecisionClass=TTTBoardDecision):
-        self.values = {}
+    def __init__(self, DecisionClass=TTTBoardDecision, valueStore=None):
+        # valueStore can be any dict-like store of state values, e.g. valuestore.CompactValueStore
+        self.values = {} if valueStore is None else valueStore
         self.DecisionClass = DecisionClass
+        self.valueJournal = None    # Value of every state before its first change, while journaling
+        self.snapshotStates = None  # States changed since the last policy snapshot, while taking snapshots
+        self.learningFile = None    # Last file saved to or loaded from, and the states changed since
+        self.changedStates = None
+
+    def setBoardStateValue(self, boardState, value):
+        if self.valueJournal is not None:
+            if isinstance(boardState, basestring) and self.acceptsPackedStates():
+                boardState = packBoardState(boardState)     # One journal entry per state, however it was given
+            if boardState not in self.valueJournal:
+                self.valueJournal[boardState] = self.values.get(boardState, 0.5)
+        if self.changedStates is not None:
+            self.changedStates.add(boardState)
+        if self.snapshotStates is not None:
+            self.snapshotStates.add(boardState)
+        self.values[boardState] = value
 
     def getBoardStateValue(self, player, board, boardState):
         decision = board.getBoardDecision()
         if decision == self.DecisionClass.WON_X:
-            self.values[boardState] = 1.0 if player == GridStates.PLAYER_X else 0.0
+            self.setBoardStateValue(boardState, 1.0 if player == GridStates.PLAYER_X else 0.0)
         if decision == self.DecisionClass.WON_O:
-            self.values[boardState] = 1.0 if player == GridStates.PLAYER_O else 0.0
+            self.setBoardStateValue(boardState, 1.0 if player == GridStates.PLAYER_O else 0.0)
         if decision == self.DecisionClass.DRAW or boardState not in self.values:
-            self.values[boardState] = 0.5
+            self.setBoardStateValue(boardState, 0.5)
         return self.values[boardState]
 
+    def getBoardStateValues(self, player, board, boardStates):
+        if board.getBoardDecision() != self.DecisionClass.ACTIVE:
+            return super(TableLearning, self).getBoardStateValues(player, board, boardStates)
+        if hasattr(self.values, 'getMany'):
+            values = self.values.getMany(boardStates)
+        else:
+            values = map(self.values.get, boardStates)
+        for (k, value) in enumerate(values):
+            if value is None:   # Unseen states start out at 0.5, as in getBoardStateValue
+                self.setBoardStateValue(boardStates[k], 0.5)
+                values[k] = 0.5
+        return values
+
+    def peekBoardStateValues(self, boardStates):
+        # Values of board states as they stand, without adding unseen states to the table (they count as 0.5)
+        if hasattr(self.values, 'getMany'):
+            return self.values.getMany(boardStates, 0.5)
+        return [self.values.get(boardState, 0.5) for boardState in boardStates]
+
+    def peekCellArrayValues(self, cells):
+        # peekBoardStateValues for an (N, 81) array of cell digits; stores keyed by state hashes get
+        # them all hashed at once, with NumPy
+        from valuestore import cellArrayStates, hashCellArrays
+        if hasattr(self.values, 'getManyHashed'):
+            return self.values.getManyHashed(hashCellArrays(cells), 0.5)
+        return self.peekBoardStateValues(cellArrayStates(cells))
+
     def learnFromMove(self, player, board, prevBoardState):
         curBoardState = board.getBoardState()
         curBoardStateValue = self.getBoardStateValue(player, board, curBoardState)
         if prevBoardState not in self.values:
             self.getBoardStateValue(player, board, prevBoardState)
-        self.values[prevBoardState] = self.values[prevBoardState] + 0.2*(curBoardStateValue - self.values[prevBoardState])
+        self.setBoardStateValue(prevBoardState, self.values[prevBoardState] + 0.2*(curBoardStateValue - self.values[prevBoardState]))
+
+    def acceptsPackedStates(self):
+        # Stores keyed by state hashes hash a string and its packed integer the same way
+        return hasattr(self.values, 'getHashedArrays')
+
+    def startValueJournal(self):
+        self.valueJournal = {}
+
+    def getValueDeltas(self):
+        # Changes to the values since startValueJournal(); the journal starts over afterwards. States
+        # evicted from the value store since are left out.
+        deltas = {}
+        for (boardState, originalValue) in self.valueJournal.iteritems():
+            value = self.values.get(boardState)
+            if value is None:
+                continue
+            delta = value - originalValue
+            if delta != 0.0:
+                deltas[boardState] = delta
+        self.valueJournal = {}
+        return deltas
+
+    def mergeValueDeltas(self, deltas):
+        # Deltas from several shards are added up; values are kept within the [0, 1] range of outcomes
+        for (boardState, delta) in deltas.iteritems():
+            self.setBoardStateValue(boardState, min(1.0, max(0.0, self.values.get(boardState, 0.5) + delta)))
+
+    def getPolicySnapshot(self):
+        # The values changed since the previous snapshot. Tracking starts with the first call, which returns
+        # nothing: copies are expected to start out from the whole table, e.g. in forked processes.
+        # Tracking goes on until stopPolicySnapshots().
+        if self.snapshotStates is None:
+            self.snapshotStates = set()
+            return {}
+        snapshot = dict((boardState, self.values.get(boardState)) for boardState in self.snapshotStates)
+        self.snapshotStates = set()
+        return dict((boardState, value) for (boardState, value) in snapshot.iteritems() if value is not None)
+
+    def setPolicySnapshot(self, snapshot):
+        for (boardState, value) in snapshot.iteritems():
+            self.values[boardState] = value
+
+    def stopPolicySnapshots(self):
+        self.snapshotStates = None
 
     def printValues(self):
         from pprint import pprint
         pprint(self.values)
         print 'Total number of states: %s' % (len(self.values))
         print 'Total number of knowledgeable states: %s' % (len(filter(lambda x: x!=0.5, self.values.values())))
+        if hasattr(self.values, 'getStats'):
+            print 'Value store statistics: %s' % (self.values.getStats())
 
     def saveLearning(self, filename):
-        json.dump(self.values, open(filename,'w'))
+        # Saving again to the same file only appends the states changed since the last save or load
+        from valuefile import writeValueFile, appendValueSegment
+        from valuestore import getHashedValueArrays
+        if filename == self.learningFile and os.path.isfile(filename):
+            changedValues = dict((boardState, self.values.get(boardState)) for boardState in self.changedStates)
+            changedValues = dict((k, v) for (k, v) in changedValues.iteritems() if v is not None)   # Evicted since
+            appendValueSegment(filename, *getHashedValueArrays(changedValues))
+            if hasattr(self.values, 'reload'):
+                self.values.reload()
+        else:
+            writeValueFile(filename, *getHashedValueArrays(self.values))
+        self.learningFile, self.changedStates = filename, set()
 
     def loadLearning(self, filename):
-        self.values = json.load(open(filename, 'r'))
+        from valuefile import isValueFile, MappedValueFile
+        from valuestore import MappedValueStore
+        if not isValueFile(filename):   # Tables saved as JSON by earlier versions
+            self.values = json.load(open(filename, 'r'))
+            self.learningFile, self.changedStates = None, None
+            return
+        if hasattr(self.values, 'loadHashedArrays'):
+            valueFile = MappedValueFile(filename)
+            self.values.loadHashedArrays(*valueFile.getValueArrays())
+            valueFile.close()
+        else:
+            self.values = MappedValueStore(filename)
+        self.learningFile, self.changedStates = filename, set()
 
 
 class NNUltimateLearning(GenericLearning):
     STATE_TO_NUMBER_MAP = {GridStates.EMPTY: 0, GridStates.PLAYER_O: -1, GridStates.PLAYER_X: 1}
 
-    def __init__(self, DecisionClass=TTTBoardDecision):
+    def __init__(self, DecisionClass=TTTBoardDecision, numpyInference=True, quantizeInference=False,
+                 replayBuffer=None, trainEvery=1, batchSize=32, batchesPerTraining=16, encoder=None):
+        # With numpyInference, predictions are made by a NumPy copy of the model that is refreshed
+        # whenever the Keras model is trained or loaded; quantizeInference stores its weights as int8.
+        # With a replayBuffer (see replaybuffer.py), every game's states are stored in it, and every
+        # `trainEvery` games the model is fit on `batchesPerTraining` minibatches sampled from it.
+        # The encoder (see encoding.py) turns board states into inputs; by default they are the 81 cell
+        # values. A replay buffer needs the same inputSize as the encoder.
         self.DecisionClass = DecisionClass
         self.values = {}
+        self.nextBoards = {}    # Board state -> tile its last move points at, for encoders that need it
+        self.numpyInference = numpyInference
+        self.quantizeInference = quantizeInference
+        self.inferenceNetwork = None
+        self.replayBuffer = replayBuffer
+        self.trainEvery = trainEvery
+        self.batchSize = batchSize
+        self.batchesPerTraining = batchesPerTraining
+        self.gamesSinceTraining = 0
+        loadKerasBackend()
+        self.encoder = StateEncoder() if encoder is None else encoder
         self.initializeModel()
+        self.refreshInferenceNetwork()
+
+    def refreshInferenceNetwork(self):
+        if self.numpyInference:
+            self.inferenceNetwork = NumpyDenseNetwork.fromKerasModel(self.model, self.quantizeInference)
+
+    def predict(self, inputs):
+        if self.inferenceNetwork is not None:
+            return self.inferenceNetwork.predict(inputs)
+        return self.model.predict(inputs)
 
     def initializeModel(self):
         self.model = Sequential()
-        self.model.add(Dense(81, input_dim=81, activation='relu'))
+        self.model.add(Dense(81, input_dim=self.encoder.inputSize, activation='relu'))
         #self.model.add(Dense(81, activation='relu'))
         self.model.add(Dense(1, activation='linear', kernel_initializer='glorot_uniform'))
         self.model.compile(loss='mean_squared_error', optimizer='adam', metrics=['accuracy'])
-        plot_model(self.model, to_file='model.png')
+
+    def plotModel(self, filename='model.png'):
+        # Diagram of the model; needs pydot and graphviz
+        from keras.utils import plot_model
+        plot_model(self.model, to_file=filename)
 
     def initialModelTraining(self, jsonFile):
         # If the neural network model should be seeded from some known state/value pairs
@@ -90,25 +267,65 @@ class NNUltimateLearning(GenericLearning):
 
     def resetForNewGame(self):
         self.values = {}
+        self.nextBoards = {}
 
     def gameOver(self):
-        boardStates, predYs = [], []
-        for (k,v) in self.values.iteritems():
-            boardStates.append(self.convertBoardStateToInput(k))
-            predYs.append(v)
-        self.trainModel(boardStates, predYs)
+        boardStates = self.values.keys()
+        inputs = self.encodeStates(boardStates)
+        targets = np.fromiter((self.values[boardState] for boardState in boardStates), dtype=np.float32, count=len(boardStates))
+        if self.replayBuffer is None:
+            self.trainModel(inputs, targets)
+            return
+        if boardStates:
+            self.replayBuffer.add(inputs, targets, np.abs(targets - self.predict(inputs)[:, 0]))
+        self.gamesSinceTraining += 1
+        if self.gamesSinceTraining >= self.trainEvery and len(self.replayBuffer) >= self.batchSize:
+            self.trainFromReplayBuffer()
+            self.gamesSinceTraining = 0
+
+    def trainFromReplayBuffer(self):
+        # All minibatches go to a single fit call, which takes one gradient step per minibatch
+        indices, inputs, targets = self.replayBuffer.sample(self.batchSize * self.batchesPerTraining)
+        self.model.fit(inputs, targets, batch_size=self.batchSize, epochs=1, shuffle=False, verbose=0)
+        self.refreshInferenceNetwork()
+        self.replayBuffer.updatePriorities(indices, np.abs(targets - self.predict(inputs)[:, 0]))
 
     def convertBoardStateToInput(self, boardState):
-        return map(lambda x: self.STATE_TO_NUMBER_MAP.get(x), boardState)
+        return self.encodeStates([boardState])[0]
 
-    def trainModel(self, boardStates, y):
-        self.model.fit(np.asarray(boardStates), np.asarray(y), verbose=0)
+    def encodeStates(self, boardStates, previousState=None):
+        # Inputs for the board states, which were all reached from previousState by one move if given
+        if not self.encoder.needsNextBoards or previousState is not None:
+            return self.encoder.encode(boardStates, previousState=previousState)
+        return self.encoder.encode(boardStates, [self.nextBoards.get(boardState, -1) for boardState in boardStates])
+
+    def recordNextBoard(self, board, boardState):
+        # Remembers where the last move of the board's current state points, for encoders that need it
+        if self.encoder.needsNextBoards and hasattr(board, 'getNextBoardLocation') and board.getBoardState() == boardState:
+            nextBoardLocation = board.getNextBoardLocation()
+            self.nextBoards[boardState] = -1 if None in nextBoardLocation else 3*nextBoardLocation[0] + nextBoardLocation[1]
+
+    def trainModel(self, inputs, y):
+        self.model.fit(np.asarray(inputs, dtype=np.float32), np.asarray(y, dtype=np.float32), verbose=0)
+        self.refreshInferenceNetwork()
 
     def getPrediction(self, boardState):
-        return self.model.predict(np.asarray([self.convertBoardStateToInput(boardState)]))[0]
+        return self.predict(self.encodeStates([boardState]))[0]
+
+    def getPredictions(self, boardStates, previousState=None):
+        return self.predict(self.encodeStates(boardStates, previousState))[:, 0]
+
+    def getBoardStateValues(self, player, board, boardStates):
+        # One forward pass for all candidates; decided boards get the same fixed values as in getBoardStateValue
+        decision = board.getBoardDecision()
+        if decision != self.DecisionClass.ACTIVE:
+            return super(NNUltimateLearning, self).getBoardStateValues(player, board, boardStates)
+        previousState = board.getBoardState() if self.encoder.needsNextBoards and hasattr(board, 'getBoardState') else None
+        return self.getPredictions(boardStates, previousState).tolist()
 
-    def getBoardStateValue(self, player, board, boardState):  #TODO: Can batch the inputs to do several predictions at once
+    def getBoardStateValue(self, player, board, boardState):
         decision = board.getBoardDecision()
+        self.recordNextBoard(board, boardState)
         predY = self.getPrediction(boardState)[0]
         if decision == self.DecisionClass.WON_X:
             predY = 1.0 if player == GridStates.PLAYER_X else 0.0   #TODO: Explore using -1.0 instead of 0.0
@@ -127,6 +344,16 @@ class NNUltimateLearning(GenericLearning):
         prevBoardStateValue = self.getPrediction(prevBoardState)[0]
         self.values[prevBoardState] = prevBoardStateValue + 0.2 * (curBoardStateValue - prevBoardStateValue)
 
+    def getPolicySnapshot(self):
+        # All the weights, as (kernel, bias, activation) of every Dense layer
+        return [layer[:1] + layer[2:] for layer in NumpyDenseNetwork.fromKerasModel(self.model).layers]
+
+    def setPolicySnapshot(self, snapshot):
+        if self.numpyInference:
+            self.inferenceNetwork = NumpyDenseNetwork(snapshot, self.quantizeInference)
+        else:
+            self.model.set_weights([weights for (kernel, bias, activation) in snapshot for weights in (kernel, bias)])
+
     def printValues(self):
         pass
 
@@ -135,3 +362,4 @@ class NNUltimateLearning(GenericLearning):
 
     def loadLearning(self, filename):
         self.model = load_model(filename)
+        self.refreshInferenceNetwork()
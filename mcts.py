@@ -0,0 +1,406 @@
+from board import GridStates
+from ultimateboard import UTTTBoardDecision, CELL_MOVES
+from ultimatebitboard import playMove, legalMoves, boardStateOf
+from statekey import CELL_DIGITS, CELL_WEIGHTS, packBoardState
+import ctypes
+import math
+import multiprocessing
+import random
+import sys
+import time
+
+# Monte Carlo Tree Search over UTTTBitBoard positions. Positions are immutable tuples (see
+# ultimatebitboard.py), so every node keeps its own and playouts start from it without copying a board.
+
+def otherPlayer(who):
+    return GridStates.PLAYER_O if who == GridStates.PLAYER_X else GridStates.PLAYER_X
+
+def outcomeFor(decision, who):
+    # Value of a finished game for `who`: 1 for a win, 0 for a loss and 0.5 for a draw
+    if decision == UTTTBoardDecision.DRAW:
+        return 0.5
+    return 1.0 if (decision == UTTTBoardDecision.WON_X) == (who == GridStates.PLAYER_X) else 0.0
+
+def cellToMove(cell):
+    # (boardLocation, placeOnBoard) of a cell, as taken by UTTTBoard.makeMove
+    return CELL_MOVES[cell]
+
+class _PositionView(object):
+    # What a learning algorithm gets to see as `board` when evaluating a position of the tree
+    def __init__(self, position):
+        self.position = position
+
+    def getBoardDecision(self):
+        return self.position[6]
+
+    def getBoardState(self):
+        return boardStateOf(self.position)
+
+    def getNextBoardLocation(self):
+        nextBoard = self.position[5]
+        return [None, None] if nextBoard == -1 else [nextBoard // 3, nextBoard % 3]
+
+class LearnerEvaluator(object):
+    # Values of tree positions from a learning algorithm that was trained for `player`; for the
+    # opponent, the value is turned around
+    def __init__(self, learningAlgo, player):
+        self.learningAlgo = learningAlgo
+        self.player = player
+
+    def evaluate(self, position, who):
+        value = self.learningAlgo.getBoardStateValue(self.player, _PositionView(position), boardStateOf(position))
+        return value if who == self.player else 1.0 - value
+
+    def evaluateMoves(self, position, who, cells):
+        # Values for `who` of the positions after `who` plays each of the cells, in one batch
+        state = boardStateOf(position)
+        if self.learningAlgo.acceptsPackedStates():
+            packedState = packBoardState(state)
+            states = [packedState + CELL_DIGITS[who]*CELL_WEIGHTS[cell] for cell in cells]
+        else:
+            states = [state[:cell] + who + state[cell+1:] for cell in cells]
+        values = self.learningAlgo.getBoardStateValues(self.player, _PositionView(position), states)
+        return values if who == self.player else [1.0 - value for value in values]
+
+class MCTSNode(object):
+    # `who` made `move` to reach this position, and totalValue adds up playout results from their side
+    __slots__ = ('position', 'who', 'move', 'parent', 'children', 'untriedMoves', 'visits', 'totalValue', 'prior')
+
+    def __init__(self, position, who, move=None, parent=None, prior=0.0):
+        self.position = position
+        self.who = who
+        self.move = move
+        self.parent = parent
+        self.children = {}          # cell -> MCTSNode
+        self.untriedMoves = None    # (prior, cell) pairs, the next one to expand last
+        self.visits = 0
+        self.totalValue = 0.0
+        self.prior = prior
+
+class MCTSSearch(object):
+    # UCT search. With an evaluator (e.g. a LearnerEvaluator), leafEvaluation replaces random playouts
+    # by the evaluator's value, and a priorWeight > 0 adds priorWeight * prior / (1 + visits) to the UCT
+    # score of a child, priors being the evaluator's values; children are then expanded best prior first.
+    def __init__(self, explorationConstant=1.4, evaluator=None, leafEvaluation=False, priorWeight=0.0, seed=None):
+        self.explorationConstant = explorationConstant
+        self.evaluator = evaluator
+        self.leafEvaluation = leafEvaluation
+        self.priorWeight = priorWeight
+        self.rng = random.Random(seed)
+        self.root = None
+        self.lastSearchStats = {}
+        self.iterationBatchSize = 1     # Iterations run between checks of the budget
+        self.tablebase = None           # Exact values of solved positions, see tablebase.py
+
+    def resetTree(self):
+        self.root = None
+
+    def setRoot(self, position, whoToMove, reuseTree=True):
+        # Continues from the matching node of the previous search, if the position is still in the tree
+        node = self.findDescendant(self.root, position) if reuseTree and self.root is not None else None
+        if node is None or node.who == whoToMove:
+            node = MCTSNode(position, otherPlayer(whoToMove))
+        node.parent = None      # Lets the rest of the old tree go
+        self.root = node
+        return node
+
+    def findDescendant(self, node, position, maxDepth=2):
+        # Follows the cells that were played since `node`, e.g. our last move and the opponent's reply
+        if node.position == position:
+            return node
+        occupied, nodeOccupied = position[0] | position[1], node.position[0] | node.position[1]
+        if maxDepth == 0 or nodeOccupied & ~occupied:
+            return None
+        added = occupied & ~nodeOccupied
+        while added:
+            bit = added & -added
+            child = node.children.get(bit.bit_length() - 1)
+            if child is not None:
+                found = self.findDescendant(child, position, maxDepth - 1)
+                if found is not None:
+                    return found
+            added ^= bit
+        return None
+
+    def expand(self, node):
+        moves = legalMoves(node.position)
+        whoToMove = otherPlayer(node.who)
+        if self.evaluator is not None and self.priorWeight > 0.0 and moves:
+            node.untriedMoves = sorted(zip(self.evaluator.evaluateMoves(node.position, whoToMove, moves), moves))
+        else:
+            self.rng.shuffle(moves)
+            node.untriedMoves = [(0.0, cell) for cell in moves]
+
+    def selectChild(self, node):
+        logVisits = math.log(node.visits)
+        best, bestScore = None, -1.0
+        for child in node.children.itervalues():
+            score = child.totalValue / child.visits + self.explorationConstant * math.sqrt(logVisits / child.visits)
+            if self.priorWeight > 0.0:
+                score += self.priorWeight * child.prior / (1 + child.visits)
+            if score > bestScore:
+                best, bestScore = child, score
+        return best
+
+    def playout(self, position, who):
+        # Uniformly random moves until the game ends; returns the result for `who`, who moved last
+        rng, player = self.rng, otherPlayer(who)
+        while position[6] == UTTTBoardDecision.ACTIVE:
+            position = playMove(position, player, rng.choice(legalMoves(position)))
+            player = otherPlayer(player)
+        return outcomeFor(position[6], who)
+
+    def selectLeaf(self):
+        # Walks down to a new (or finished) node, counting the visit on the way: until its value is
+        # backed up, the path looks like a loss, which steers simultaneous selections apart (virtual loss).
+        # Nodes get their moves listed when first walked through, so leaves cost nothing until revisited.
+        node, depth = self.root, 0
+        node.visits += 1
+        while True:
+            if node.untriedMoves is None:
+                self.expand(node)
+            if node.untriedMoves or not node.children:
+                break
+            node, depth = self.selectChild(node), depth + 1
+            node.visits += 1
+        if node.untriedMoves:
+            prior, cell = node.untriedMoves.pop()
+            child = MCTSNode(playMove(node.position, otherPlayer(node.who), cell), otherPlayer(node.who), cell, node, prior)
+            node.children[cell] = child
+            node, depth = child, depth + 1
+            node.visits += 1
+        return node, depth
+
+    def backpropagate(self, node, value):
+        # value is the result for node.who
+        while node is not None:
+            node.totalValue += value
+            value = 1.0 - value
+            node = node.parent
+
+    def evaluateLeaf(self, node):
+        if node.position[6] != UTTTBoardDecision.ACTIVE:
+            return outcomeFor(node.position[6], node.who)
+        if self.tablebase is not None:
+            value = self.tablebase.probe(node.position, otherPlayer(node.who))
+            if value is not None:
+                return 1.0 - value
+        if self.leafEvaluation and self.evaluator is not None:
+            return self.evaluator.evaluate(node.position, node.who)
+        return None     # Needs a playout
+
+    def runIteration(self):
+        node, depth = self.selectLeaf()
+        value = self.evaluateLeaf(node)
+        self.backpropagate(node, self.playout(node.position, node.who) if value is None else value)
+        return depth
+
+    def runIterations(self, count):
+        # Returns the depth of the deepest leaf reached
+        return max(self.runIteration() for k in range(count))
+
+    def search(self, iterations=None, timeLimit=None):
+        # Runs until either budget is used up (at least one iteration); with neither, 1000 iterations are run
+        if iterations is None and timeLimit is None:
+            iterations = 1000
+        reusedVisits = self.root.visits
+        startTime = time.time()
+        deadline = None if timeLimit is None else startTime + timeLimit
+        count, maxDepth = 0, 0
+        while count == 0 or ((iterations is None or count < iterations) and (deadline is None or time.time() < deadline)):
+            batch = self.iterationBatchSize if iterations is None else min(self.iterationBatchSize, iterations - count)
+            maxDepth = max(maxDepth, self.runIterations(max(1, batch)))
+            count += max(1, batch)
+        elapsed = time.time() - startTime
+        self.lastSearchStats = {'iterations': count, 'seconds': elapsed,
+                                'iterationsPerSecond': count / elapsed if elapsed > 0 else 0.0,
+                                'reusedVisits': reusedVisits, 'rootVisits': self.root.visits, 'maxDepth': maxDepth}
+        return self.lastSearchStats
+
+    def getVisitCounts(self):
+        return dict((cell, child.visits) for (cell, child) in self.root.children.iteritems())
+
+    def bestMove(self):
+        # Most visited child of the root, the usual robust choice
+        return max(self.root.children.itervalues(), key=lambda child: child.visits).move
+
+# Parallel search. Pools are forked when first needed, so workers inherit the search set up for them
+# through the module globals below (like game.ParallelGameSequence does) instead of having it pickled.
+
+_workerSearch = None    # MCTSSearch of the root-parallel workers
+_workerSearchNumber = None  # Search the root-parallel worker last ran a shard of
+_sharedPlayouts = None  # (positions, whoMovedLast, results) shared-memory arrays of the leaf-parallel workers
+
+def _searchRootShard(args):
+    # A worker may be handed more than one shard of a search; those after the first start a new tree,
+    # or the visits of the earlier shard would be counted again
+    global _workerSearchNumber
+    position, whoToMove, evaluatorPlayer, iterations, timeLimit, seed, reuseTree, searchNumber = args
+    search = _workerSearch
+    search.rng.seed(seed)
+    if search.evaluator is not None:
+        search.evaluator.player = evaluatorPlayer
+    search.setRoot(position, whoToMove, reuseTree and searchNumber != _workerSearchNumber)
+    _workerSearchNumber = searchNumber
+    stats = search.search(iterations, timeLimit)
+    return dict((cell, (child.visits, child.totalValue)) for (cell, child) in search.root.children.iteritems()), stats
+
+class RootParallelSearch(object):
+    # Root parallelism: every worker process searches the same position with its own tree and random
+    # seed, then the visit counts of the root moves are added up. Time limits apply to every worker and
+    # an iteration budget is split among them.
+    def __init__(self, search, numberOfProcesses=None, seed=None):
+        self.workerSearch = search  # The MCTSSearch every worker starts from
+        self.numberOfProcesses = multiprocessing.cpu_count() if numberOfProcesses is None else numberOfProcesses
+        self.rng = random.Random(seed)
+        self.pool = None
+        self.position, self.whoToMove, self.reuseTree = None, None, True
+        self.searchNumber = 0
+        self.rootStatistics = {}    # cell -> (visits, totalValue) added up over the workers
+        self.lastSearchStats = {}
+
+    @property
+    def evaluator(self):
+        # Set before the first search, as workers keep the one they were forked with (only the
+        # evaluator's player is sent along with every search)
+        return self.workerSearch.evaluator
+
+    @evaluator.setter
+    def evaluator(self, evaluator):
+        self.workerSearch.evaluator = evaluator
+
+    @property
+    def tablebase(self):
+        return self.workerSearch.tablebase
+
+    @tablebase.setter
+    def tablebase(self, tablebase):
+        self.workerSearch.tablebase = tablebase
+
+    def startPool(self):
+        global _workerSearch
+        if self.pool is None:
+            _workerSearch = self.workerSearch
+            try:
+                self.pool = multiprocessing.Pool(self.numberOfProcesses)
+            finally:
+                _workerSearch = None
+
+    def closePool(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def resetTree(self):
+        self.position = None
+
+    def setRoot(self, position, whoToMove, reuseTree=True):
+        self.position, self.whoToMove, self.reuseTree = position, whoToMove, reuseTree
+
+    def search(self, iterations=None, timeLimit=None):
+        self.startPool()
+        if iterations is None and timeLimit is None:
+            iterations = 1000
+        shardIterations = None if iterations is None else -(-iterations // self.numberOfProcesses)
+        evaluatorPlayer = None if self.workerSearch.evaluator is None else self.workerSearch.evaluator.player
+        self.searchNumber += 1
+        startTime = time.time()
+        shards = self.pool.map(_searchRootShard, [(self.position, self.whoToMove, evaluatorPlayer, shardIterations, timeLimit,
+                                                   self.rng.randint(0, sys.maxint), self.reuseTree, self.searchNumber)
+                                                  for k in range(self.numberOfProcesses)])
+        elapsed = time.time() - startTime
+        self.rootStatistics = {}
+        for (children, stats) in shards:
+            for (cell, (visits, totalValue)) in children.iteritems():
+                mergedVisits, mergedValue = self.rootStatistics.get(cell, (0, 0.0))
+                self.rootStatistics[cell] = (mergedVisits + visits, mergedValue + totalValue)
+        count = sum(stats['iterations'] for (children, stats) in shards)
+        self.lastSearchStats = {'iterations': count, 'seconds': elapsed,
+                                'iterationsPerSecond': count / elapsed if elapsed > 0 else 0.0,
+                                'reusedVisits': sum(stats['reusedVisits'] for (children, stats) in shards),
+                                'rootVisits': sum(stats['rootVisits'] for (children, stats) in shards),
+                                'maxDepth': max(stats['maxDepth'] for (children, stats) in shards),
+                                'processes': self.numberOfProcesses}
+        return self.lastSearchStats
+
+    def getVisitCounts(self):
+        return dict((cell, visits) for (cell, (visits, totalValue)) in self.rootStatistics.iteritems())
+
+    def bestMove(self):
+        return max(self.rootStatistics.iteritems(), key=lambda item: item[1][0])[0]
+
+# Positions in the shared arrays take POSITION_FIELDS int64 words each: both 81-bit occupancy masks are
+# split in two, then come the won/drawn/next board fields and the decision
+POSITION_FIELDS = 9
+LOW_BITS = 41
+LOW_MASK = (1 << LOW_BITS) - 1
+
+def writeSharedPosition(array, slot, position):
+    offset = POSITION_FIELDS*slot
+    xMask, oMask = position[0], position[1]
+    array[offset:offset+POSITION_FIELDS] = [xMask & LOW_MASK, xMask >> LOW_BITS, oMask & LOW_MASK, oMask >> LOW_BITS] + \
+                                           list(position[2:])
+
+def readSharedPosition(array, slot):
+    fields = array[POSITION_FIELDS*slot:POSITION_FIELDS*(slot+1)]
+    return (int(fields[0]) | int(fields[1]) << LOW_BITS, int(fields[2]) | int(fields[3]) << LOW_BITS) + \
+           tuple(int(field) for field in fields[4:])
+
+def _playoutShard(args):
+    start, end, seed = args
+    positions, whoMovedLast, results = _sharedPlayouts
+    search = MCTSSearch(seed=seed)
+    for slot in range(start, end):
+        who = GridStates.PLAYER_X if whoMovedLast[slot] == 0 else GridStates.PLAYER_O
+        results[slot] = search.playout(readSharedPosition(positions, slot), who)
+
+class LeafParallelSearch(MCTSSearch):
+    # Leaf parallelism: one tree, from which leafBatchSize leaves are selected at a time (kept apart by
+    # virtual loss). Their positions go to shared-memory arrays, the worker processes play out a slice
+    # each, and the results are backed up. With leafEvaluation, leaves are evaluated here instead.
+    def __init__(self, explorationConstant=1.4, evaluator=None, leafEvaluation=False, priorWeight=0.0, seed=None,
+                 numberOfProcesses=None, leafBatchSize=None):
+        super(LeafParallelSearch, self).__init__(explorationConstant, evaluator, leafEvaluation, priorWeight, seed)
+        self.numberOfProcesses = multiprocessing.cpu_count() if numberOfProcesses is None else numberOfProcesses
+        self.iterationBatchSize = 8*self.numberOfProcesses if leafBatchSize is None else leafBatchSize
+        self.positions = multiprocessing.RawArray(ctypes.c_int64, POSITION_FIELDS*self.iterationBatchSize)
+        self.whoMovedLast = multiprocessing.RawArray(ctypes.c_int8, self.iterationBatchSize)
+        self.results = multiprocessing.RawArray(ctypes.c_double, self.iterationBatchSize)
+        self.pool = None
+
+    def startPool(self):
+        global _sharedPlayouts
+        if self.pool is None:
+            _sharedPlayouts = (self.positions, self.whoMovedLast, self.results)
+            try:
+                self.pool = multiprocessing.Pool(self.numberOfProcesses)
+            finally:
+                _sharedPlayouts = None
+
+    def closePool(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def runIterations(self, count):
+        if self.leafEvaluation and self.evaluator is not None:
+            return super(LeafParallelSearch, self).runIterations(count)
+        self.startPool()
+        leaves, maxDepth = [], 0
+        for k in range(count):
+            node, depth = self.selectLeaf()
+            maxDepth = max(maxDepth, depth)
+            value = self.evaluateLeaf(node)
+            if value is None:
+                writeSharedPosition(self.positions, len(leaves), node.position)
+                self.whoMovedLast[len(leaves)] = 0 if node.who == GridStates.PLAYER_X else 1
+                leaves.append(node)
+            else:
+                self.backpropagate(node, value)
+        if leaves:
+            sliceSize = -(-len(leaves) // self.numberOfProcesses)
+            self.pool.map(_playoutShard, [(start, min(start + sliceSize, len(leaves)), self.rng.randint(0, sys.maxint))
+                                          for start in range(0, len(leaves), sliceSize)])
+            for (slot, node) in enumerate(leaves):
+                self.backpropagate(node, self.results[slot])
+        return maxDepth
@@ -0,0 +1,86 @@
+import json
+import numpy as np
+
+# Forward pass of a stack of Dense layers (like the NNUltimateLearning model) with plain NumPy matmuls.
+# Only NumPy is needed, so processes that just evaluate positions never have to import Keras/TensorFlow.
+
+def _relu(x):
+    return np.maximum(x, 0.0, out=x)
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+ACTIVATIONS = {'linear': lambda x: x, 'relu': _relu, 'tanh': np.tanh, 'sigmoid': _sigmoid}
+
+class NumpyDenseNetwork(object):
+    def __init__(self, layers, quantize=False):
+        # layers is a list of (kernel, bias, activation) with kernel of shape (inputs, outputs). With
+        # quantize, kernels are stored as int8 with one float32 scale per output unit.
+        self.quantized = quantize
+        self.layers = []
+        for (kernel, bias, activation) in layers:
+            if activation not in ACTIVATIONS:
+                raise ValueError('Unsupported activation: %s' % activation)
+            kernel, bias = np.asarray(kernel, dtype=np.float32), np.asarray(bias, dtype=np.float32)
+            scale = None
+            if quantize:
+                scale = np.abs(kernel).max(axis=0) / 127.0
+                scale[scale == 0.0] = 1.0
+                kernel = np.round(kernel / scale).astype(np.int8)
+            self.layers.append((kernel, scale, bias, activation))
+
+    @classmethod
+    def fromKerasModel(cls, model, quantize=False):
+        layers = []
+        for layer in model.layers:
+            if not layer.get_weights():     # e.g. an explicit input layer
+                continue
+            kernel, bias = layer.get_weights()
+            layers.append((kernel, bias, layer.get_config()['activation']))
+        return cls(layers, quantize)
+
+    @classmethod
+    def fromH5File(cls, filename, quantize=False):
+        # Reads a model saved by Keras' model.save() with h5py only
+        import h5py
+        with h5py.File(filename, 'r') as h5file:
+            config = json.loads(h5file.attrs['model_config'])['config']
+            layerConfigs = config['layers'] if isinstance(config, dict) else config
+            weightGroup = h5file['model_weights']
+            layers = []
+            for layerConfig in layerConfigs:
+                if layerConfig['class_name'] != 'Dense':
+                    continue
+                name = layerConfig['config']['name']
+                weightNames = weightGroup[name].attrs['weight_names']
+                kernel, bias = [np.asarray(weightGroup[name][weightName]) for weightName in weightNames]
+                layers.append((kernel, bias, layerConfig['config']['activation']))
+        return cls(layers, quantize)
+
+    @classmethod
+    def load(cls, filename, quantize=False):
+        saved = np.load(filename)
+        activations = json.loads(saved['activations'].tostring())
+        return cls([(saved['kernel%d' % k], saved['bias%d' % k], activation) for (k, activation) in enumerate(activations)],
+                   quantize)
+
+    def save(self, filename):
+        # Float32 weights in a .npz file, loadable with NumpyDenseNetwork.load
+        arrays = {'activations': np.frombuffer(json.dumps([layer[3] for layer in self.layers]), dtype=np.uint8)}
+        for (k, (kernel, scale, bias, activation)) in enumerate(self.layers):
+            arrays['kernel%d' % k] = kernel if scale is None else kernel.astype(np.float32) * scale
+            arrays['bias%d' % k] = bias
+        with open(filename, 'wb') as outfile:
+            np.savez(outfile, **arrays)
+
+    def predict(self, inputs):
+        x = np.asarray(inputs, dtype=np.float32)
+        for (kernel, scale, bias, activation) in self.layers:
+            if scale is None:
+                x = np.dot(x, kernel)
+            else:
+                x = np.dot(x, kernel.astype(np.float32))
+                x *= scale
+            x += bias
+            x = ACTIVATIONS[activation](x)
+        return x
@@ -0,0 +1,62 @@
+import numpy as np
+
+class ReplayBuffer(object):
+    # Fixed-capacity ring buffer of (input, target) training pairs in preallocated arrays. Once full, the
+    # oldest pairs are overwritten. With prioritized sampling, pairs are drawn with probability
+    # proportional to priority**priorityExponent, the priority being the last seen absolute TD error.
+    def __init__(self, capacity, inputSize=81, prioritized=False, priorityExponent=0.6, seed=None):
+        self.capacity = capacity
+        self.inputs = np.zeros((capacity, inputSize), dtype=np.float32)
+        self.targets = np.zeros(capacity, dtype=np.float32)
+        self.priorities = np.zeros(capacity, dtype=np.float32) if prioritized else None
+        self.priorityExponent = priorityExponent
+        self.rng = np.random.RandomState(seed)
+        self.position = 0   # Where the next pair goes
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, inputs, targets, priorities=None):
+        inputs, targets = np.asarray(inputs, dtype=np.float32), np.asarray(targets, dtype=np.float32)
+        if len(inputs) > self.capacity:
+            inputs, targets = inputs[-self.capacity:], targets[-self.capacity:]
+            priorities = None if priorities is None else priorities[-self.capacity:]
+        indices = (self.position + np.arange(len(inputs))) % self.capacity
+        self.inputs[indices] = inputs
+        self.targets[indices] = targets
+        if self.priorities is not None:
+            # Pairs without a known error get the highest priority, so they are seen at least once
+            self.priorities[indices] = self.priorities[:self.size].max() if priorities is None and self.size > 0 else \
+                                       (1.0 if priorities is None else priorities)
+        self.position = (self.position + len(inputs)) % self.capacity
+        self.size = min(self.capacity, self.size + len(inputs))
+
+    def sample(self, batchSize):
+        if self.priorities is None:
+            indices = self.rng.randint(0, self.size, size=batchSize)
+        else:
+            weights = (self.priorities[:self.size] + 1e-6) ** self.priorityExponent
+            indices = self.rng.choice(self.size, size=batchSize, p=weights / weights.sum())
+        return indices, self.inputs[indices], self.targets[indices]
+
+    def updatePriorities(self, indices, priorities):
+        if self.priorities is not None:
+            self.priorities[indices] = priorities
+
+    def getState(self):
+        # A copy of the contents and of the sampling generator, e.g. for checkpoints
+        return {'capacity': self.capacity, 'inputs': self.inputs[:self.size].copy(), 'targets': self.targets[:self.size].copy(),
+                'priorities': None if self.priorities is None else self.priorities[:self.size].copy(),
+                'position': self.position, 'size': self.size, 'rngState': self.rng.get_state()}
+
+    def setState(self, state):
+        if state['capacity'] != self.capacity or state['inputs'].shape[1:] != self.inputs.shape[1:] or \
+                (state['priorities'] is None) != (self.priorities is None):
+            raise ValueError('The saved replay buffer does not fit this one')
+        size = state['size']
+        self.inputs[:size], self.targets[:size] = state['inputs'], state['targets']
+        if self.priorities is not None:
+            self.priorities[:size] = state['priorities']
+        self.position, self.size = state['position'], size
+        self.rng.set_state(state['rngState'])
@@ -0,0 +1,41 @@
+from board import GridStates
+import string
+
+# Board states (81-character strings from getBoardState) packed into integers: every cell is a base-3
+# digit, EMPTY/X/O being 0/1/2, with cell 0 as the most significant digit. A packed state needs up to
+# 129 bits; hashBoardState() folds it into 64 bits for use as a compact table key.
+
+STATE_DIGITS = string.maketrans(GridStates.EMPTY + GridStates.PLAYER_X + GridStates.PLAYER_O, '012')
+DIGIT_STATES = (GridStates.EMPTY, GridStates.PLAYER_X, GridStates.PLAYER_O)
+CELL_DIGITS = {GridStates.EMPTY: 0, GridStates.PLAYER_X: 1, GridStates.PLAYER_O: 2}
+CELL_WEIGHTS = [3**(80-cell) for cell in range(81)]   # Value of a digit 1 at a cell of the packed state
+MASK64 = (1 << 64) - 1
+
+def packBoardState(boardState):
+    return int(boardState.translate(STATE_DIGITS), 3)
+
+def unpackBoardState(packedState):
+    cells = []
+    for cell in range(81):
+        packedState, digit = divmod(packedState, 3)
+        cells.append(DIGIT_STATES[digit])
+    return ''.join(reversed(cells))
+
+def hashPackedState(packedState):
+    # The 64-bit words of the packed state are folded with odd multipliers, then the splitmix64 finalizer
+    # spreads every bit over the result. Signed, so it can be stored in an int64 array, and never 0,
+    # which marks unused slots.
+    value = (packedState + (packedState >> 64) * 0x9E3779B97F4A7C15 + (packedState >> 128) * 0xC2B2AE3D27D4EB4F) & MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    value ^= value >> 31
+    if value >= 1 << 63:
+        value -= 1 << 64
+    return value or 1
+
+def hashBoardState(boardState):
+    return hashPackedState(packBoardState(boardState))
+
+def hashOf(state):
+    # Accepts a board state string or a packed state
+    return hashBoardState(state) if isinstance(state, basestring) else hashPackedState(state)
@@ -0,0 +1,142 @@
+from learning import GenericLearning
+from operator import itemgetter
+
+# Ultimate TTT is unchanged by the 8 rotations and reflections of the 9x9 grid (the dihedral group D4),
+# applied to the master board and to every tile at once. A board state cell 9*(3*i+j) + 3*r+c sits at
+# grid row 3*i+r and column 3*j+c; each symmetry maps grid coordinates (row, column) of a square grid
+# of the given size to new ones.
+SYMMETRIES = [lambda row, column, n: (row, column),
+              lambda row, column, n: (column, n-1-row),
+              lambda row, column, n: (n-1-row, n-1-column),
+              lambda row, column, n: (n-1-column, row),
+              lambda row, column, n: (row, n-1-column),
+              lambda row, column, n: (n-1-row, column),
+              lambda row, column, n: (column, row),
+              lambda row, column, n: (n-1-column, n-1-row)]
+
+def _cellToGrid(cell):
+    board, place = divmod(cell, 9)
+    return 3*(board // 3) + place // 3, 3*(board % 3) + place % 3
+
+def _gridToCell(row, column):
+    return 9*(3*(row // 3) + column // 3) + 3*(row % 3) + column % 3
+
+def _buildPermutation(symmetry):
+    # permutation[newCell] is the cell whose contents move to newCell
+    permutation = [None]*81
+    for cell in range(81):
+        row, column = _cellToGrid(cell)
+        permutation[_gridToCell(*symmetry(row, column, 9))] = cell
+    return permutation
+
+CELL_PERMUTATIONS = [_buildPermutation(symmetry) for symmetry in SYMMETRIES]
+_PERMUTERS = [itemgetter(*permutation) for permutation in CELL_PERMUTATIONS]
+
+def transformBoardState(boardState, symmetryIndex):
+    return ''.join(_PERMUTERS[symmetryIndex](boardState))
+
+def transformBoardLocation(boardLocation, symmetryIndex):
+    # Tiles of the master board move the same way cells of a tile do
+    if None in boardLocation:
+        return boardLocation
+    return list(SYMMETRIES[symmetryIndex](boardLocation[0], boardLocation[1], 3))
+
+def canonicalBoardState(boardState):
+    # Smallest of the 8 images of the board state: all symmetric positions share it
+    return min(''.join(permuter(boardState)) for permuter in _PERMUTERS)
+
+def canonicalizeWithBoardLocation(boardState, nextBoardLocation):
+    # Canonical board state plus the next-board constraint moved along with it. When several symmetries
+    # give the canonical state, the smallest resulting location is used so the pair is canonical too.
+    images = [(''.join(permuter(boardState)), symmetryIndex) for (symmetryIndex, permuter) in enumerate(_PERMUTERS)]
+    canonicalState = min(images)[0]
+    locations = [transformBoardLocation(nextBoardLocation, symmetryIndex)
+                 for (image, symmetryIndex) in images if image == canonicalState]
+    return canonicalState, min(locations)
+
+def _pointedBoardLocation(boardState, nextState):
+    # Tile the move from boardState to nextState points at
+    for (cell, (before, after)) in enumerate(zip(boardState, nextState)):
+        if before != after:
+            return list(divmod(cell % 9, 3))
+    return [None, None]
+
+class CanonicalBoardView(object):
+    # A board seen in canonical form, for learning algorithms that read the current state: the state and
+    # the tile its last move points at are canonicalized together. Given a boardState one move on from
+    # the board's, the view shows that position instead. Anything else, e.g. the decision, is the board's.
+    def __init__(self, board, boardState=None):
+        self.board = board
+        currentState = board.getBoardState()
+        if boardState is None or boardState == currentState:
+            boardState, nextBoardLocation = currentState, board.getNextBoardLocation()
+        else:
+            nextBoardLocation = _pointedBoardLocation(currentState, boardState)
+        self.boardState, self.nextBoardLocation = canonicalizeWithBoardLocation(boardState, nextBoardLocation)
+
+    def getBoardState(self):
+        return self.boardState
+
+    def getNextBoardLocation(self):
+        return self.nextBoardLocation
+
+    def __getattr__(self, name):
+        return getattr(self.board, name)
+
+class SymmetricLearning(GenericLearning):
+    # Wraps any learning algorithm so that it only ever sees canonical board states: all 8 symmetric
+    # images of a position share one value, and experience from one of them counts for all
+    def __init__(self, learningAlgo):
+        self.learningAlgo = learningAlgo
+
+    def needsNextBoards(self):
+        # Whether the wrapped algorithm reads where the last move points (see encoding.py), which then has
+        # to be canonicalized along with every state
+        return getattr(getattr(self.learningAlgo, 'encoder', None), 'needsNextBoards', False)
+
+    def getBoardStateValue(self, player, board, boardState):
+        if self.needsNextBoards():
+            view = CanonicalBoardView(board, boardState)
+            return self.learningAlgo.getBoardStateValue(player, view, view.getBoardState())
+        return self.learningAlgo.getBoardStateValue(player, board, canonicalBoardState(boardState))
+
+    def getBoardStateValues(self, player, board, boardStates):
+        if self.needsNextBoards():
+            # Candidates may take different symmetries to their canonical states, so the board's state can't
+            # stand for the state they were reached from: each one is evaluated with the tile its move points at
+            return [self.getBoardStateValue(player, board, boardState) for boardState in boardStates]
+        return self.learningAlgo.getBoardStateValues(player, board, map(canonicalBoardState, boardStates))
+
+    @property
+    def peekBoardStateValues(self):
+        # Only there when the wrapped algorithm has it, as callers check for it (see batchgame.py)
+        peekBoardStateValues = self.learningAlgo.peekBoardStateValues
+        return lambda boardStates: peekBoardStateValues(map(canonicalBoardState, boardStates))
+
+    def learnFromMove(self, player, board, prevBoardState):
+        self.learningAlgo.learnFromMove(player, CanonicalBoardView(board), canonicalBoardState(prevBoardState))
+
+    def resetForNewGame(self):
+        self.learningAlgo.resetForNewGame()
+
+    def gameOver(self):
+        self.learningAlgo.gameOver()
+
+    def getPolicySnapshot(self):
+        # Values are keyed by canonical states inside, so snapshots carry over as they are
+        return self.learningAlgo.getPolicySnapshot()
+
+    def setPolicySnapshot(self, snapshot):
+        self.learningAlgo.setPolicySnapshot(snapshot)
+
+    def stopPolicySnapshots(self):
+        self.learningAlgo.stopPolicySnapshots()
+
+    def printValues(self):
+        self.learningAlgo.printValues()
+
+    def saveLearning(self, filename):
+        self.learningAlgo.saveLearning(filename)
+
+    def loadLearning(self, filename):
+        self.learningAlgo.loadLearning(filename)
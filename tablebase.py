@@ -0,0 +1,104 @@
+from board import GridStates
+from ultimateboard import UTTTBoardDecision
+from ultimatebitboard import EMPTY_POSITION, playMove, legalMoves, positionFromBoard
+from statekey import CELL_WEIGHTS, hashPackedState
+from valuefile import writeValueFile, appendValueSegment, MappedValueFile
+from mcts import otherPlayer, outcomeFor
+from alphabeta import whoToMoveIn
+import os
+import random
+
+# Endgame tablebase: exact game values of UTTTBitBoard positions with few empty cells. Unlike the learned
+# tables, a key covers the whole position: the cells, the next board constraint and the side to move.
+# Values are for the side to move (1 win, 0.5 draw, 0 loss) and are stored in the value file format
+# (see valuefile.py), so the file is memory-mapped and shared by all processes probing it.
+
+def packPosition(position):
+    # Same packing as statekey.packBoardState(boardStateOf(position)), straight from the masks
+    packed = 0
+    for (mask, digit) in ((position[0], 1), (position[1], 2)):
+        while mask:
+            bit = mask & -mask
+            packed += digit*CELL_WEIGHTS[bit.bit_length() - 1]
+            mask ^= bit
+    return packed
+
+def tablebaseKey(position, whoToMove):
+    return hashPackedState(20*packPosition(position) + 2*(position[5] + 1) + (whoToMove == GridStates.PLAYER_O))
+
+def emptyCellCount(position):
+    return 81 - bin(position[0] | position[1]).count('1')
+
+class TablebaseSolver(object):
+    # Exhaustive minimax with every solved position remembered, so that transpositions are solved once
+    # and every position of a solved subtree ends up in the tablebase
+    def __init__(self):
+        self.solved = {}    # tablebaseKey -> value for the side to move
+
+    def solve(self, position, whoToMove):
+        if position[6] != UTTTBoardDecision.ACTIVE:
+            return outcomeFor(position[6], whoToMove)
+        key = tablebaseKey(position, whoToMove)
+        value = self.solved.get(key)
+        if value is None:
+            value, opponent = 0.0, otherPlayer(whoToMove)
+            for cell in legalMoves(position):
+                value = max(value, 1.0 - self.solve(playMove(position, whoToMove, cell), opponent))
+                if value == 1.0:
+                    break
+            self.solved[key] = value
+        return value
+
+def generateTablebase(filename, maxEmptyCells=10, numberOfGames=1000, seed=None, append=False, positions=None):
+    # Plays random games until they get down to maxEmptyCells empty cells, then solves the rest of the
+    # game from there completely; or solves the given (position, whoToMove) pairs, e.g. positions
+    # collected from real games. All positions reached by the solver are written to `filename`, or
+    # appended to it as a new segment. Returns the number of positions solved.
+    rng, solver = random.Random(seed), TablebaseSolver()
+    if positions is None:
+        positions = []
+        for k in range(numberOfGames):
+            position, who = EMPTY_POSITION, GridStates.PLAYER_X
+            while position[6] == UTTTBoardDecision.ACTIVE and emptyCellCount(position) > maxEmptyCells:
+                position = playMove(position, who, rng.choice(legalMoves(position)))
+                who = otherPlayer(who)
+            positions.append((position, who))
+    for (position, who) in positions:
+        if emptyCellCount(position) <= maxEmptyCells:
+            solver.solve(position, who)
+    keys, values = solver.solved.keys(), solver.solved.values()
+    if append and os.path.isfile(filename):
+        appendValueSegment(filename, keys, values)
+    else:
+        writeValueFile(filename, keys, values)
+    return len(keys)
+
+class Tablebase(object):
+    # Probes a tablebase file. Positions with more than maxEmptyCells empty cells (when given) are not
+    # looked up at all.
+    def __init__(self, filename, maxEmptyCells=None):
+        self.valueFile = MappedValueFile(filename)
+        self.maxEmptyCells = 81 if maxEmptyCells is None else maxEmptyCells
+        self.probes, self.hits = 0, 0
+
+    def probe(self, position, whoToMove):
+        # Exact value of the position for whoToMove, or None if it is not in the tablebase
+        if emptyCellCount(position) > self.maxEmptyCells:
+            return None
+        self.probes += 1
+        value = self.valueFile.lookup(tablebaseKey(position, whoToMove))
+        if value is not None:
+            self.hits += 1
+        return value
+
+    def probeBoard(self, board, player):
+        # Exact value for `player` of the position of a UTTTBoard or UTTTBitBoard, or None
+        if board.getBoardState().count(GridStates.EMPTY) > self.maxEmptyCells:
+            return None
+        position = getattr(board, 'position', None) or positionFromBoard(board)
+        whoToMove = whoToMoveIn(position)
+        value = self.probe(position, whoToMove)
+        return value if value is None or whoToMove == player else 1.0 - value
+
+    def close(self):
+        self.valueFile.close()
@@ -5,9 +5,12 @@ from learning import NNUltimateLearning, TableLearning
 from plotting import drawXYPlotByFactor
 import os, csv
 from game import GameSequence
+from training import TrainingRun
+from tournament import Tournament
 
 LEARNING_FILE = 'ultimate_player_nn1.h5'
 WIN_PCT_FILE = 'win_pct_player_1.csv'
+TRAINING_DIRECTORY = 'ultimate_run_nn1'
 
 def playTTTAndPlotResults():
     learningPlayer = RLTTTPlayer()
@@ -23,28 +26,25 @@ def playTTTAndPlotResults():
     drawXYPlotByFactor(plotValues, 'Number of Sets (of 100 Games)', 'Fraction', title='RL Player (X) vs. Random Player (O)')
 
 def playUltimateAndPlotResults():
+    # Results stream to TRAINING_DIRECTORY/results.csv; rerunning after a crash resumes from the last checkpoint.
+    # A new run starts from the model in LEARNING_FILE, where the trained model is saved at the end.
     learningModel = NNUltimateLearning(UTTTBoardDecision)
     learningPlayer = RLUTTTPlayer(learningModel)
     randomPlayer = RandomUTTTPlayer()
-    results = []
     numberOfSetsOfGames = 60
-    if os.path.isfile(LEARNING_FILE):
+    trainingRun = TrainingRun(TRAINING_DIRECTORY, learningPlayer, randomPlayer, UTTTBoard, UTTTBoardDecision,
+                              gamesPerSet=100, checkpointEvery=1000)
+    if trainingRun.resume() == 0 and os.path.isfile(LEARNING_FILE):
         learningPlayer.loadLearning(LEARNING_FILE)
-    for i in range(numberOfSetsOfGames):
-        games = GameSequence(100, learningPlayer, randomPlayer, BoardClass=UTTTBoard, BoardDecisionClass=UTTTBoardDecision)
-        results.append(games.playGamesAndGetWinPercent())
+    trainingRun.run(numberOfSetsOfGames)
     learningPlayer.saveLearning(LEARNING_FILE)
-    writeResultsToFile(results)
-    plotValues = {'X Win Fraction': zip(range(numberOfSetsOfGames), map(lambda x: x[0], results)),
-                  'O Win Fraction': zip(range(numberOfSetsOfGames), map(lambda x: x[1], results)),
-                  'Draw Fraction': zip(range(numberOfSetsOfGames), map(lambda x: x[2], results))}
-    drawXYPlotByFactor(plotValues, 'Number of Sets (of 100 Games)', 'Fraction',title='RL Player (O) vs. Random Player (X)')
+    plotResultsFromFile(trainingRun.getResultsFilename())
 
 def playUltimateForTraining():
     learningModel = TableLearning()
     learningPlayer = RLUTTTPlayer(learningModel)
     randomPlayer = RandomUTTTPlayer()
-    results, tempFileName = [], 'temp_learning.json'
+    results, tempFileName = [], 'temp_learning.bin'
     for i in range(40):
         games = GameSequence(1000, learningPlayer, randomPlayer, BoardClass=UTTTBoard, BoardDecisionClass=UTTTBoardDecision)
         games.playGamesAndGetWinPercent()
@@ -53,6 +53,16 @@ def playUltimateForTraining():
     print '\n'.join(map(str, results))
     os.remove(tempFileName)
 
+def gateLearnedPlayer(candidateFile, baselineFile):
+    # Whether the table in candidateFile plays at least 50 Elo better than the one in baselineFile
+    roster = [{'name': 'candidate', 'type': 'rl', 'file': candidateFile},
+              {'name': 'baseline', 'type': 'rl', 'file': baselineFile},
+              {'name': 'random', 'type': 'random'}]
+    tournament = Tournament(roster, pairings=[(0, 1), (0, 2)], elo0=0.0, elo1=50.0)
+    results = tournament.run(verbose=True)
+    tournament.printStandings()
+    return results[0]['decision'] == 'H1'
+
 def writeResultsToFile(results):
     with open(WIN_PCT_FILE, 'a') as outfile:
         for result in results:
@@ -72,8 +82,8 @@ def plotResultsFromFile(resultsFile):
 def plotMemoryUsageFromFile(memoryFile):
     results = []
     with open(memoryFile, 'r') as infile:
-        reader = csv.reader(infile)
-        results = map(tuple, reader)
+        # Files written by instrumentation.py start with a header row
+        results = [tuple(row) for row in csv.reader(infile) if row and row[0] != 'time']
     plotValues = {'Memory Usage': zip(map(lambda x: x[1], results), map(lambda x: x[2], results))}
     drawXYPlotByFactor(plotValues, 'Number of Simulations', 'Memory Usage (MB)')
 
@@ -0,0 +1,273 @@
+from actorlearner import FrozenLearning
+from game import SingleGame
+from learning import TableLearning
+from ultimateboard import UTTTBoardDecision
+from ultimatebitboard import UTTTBitBoard
+from ultimateplayer import RandomUTTTPlayer, RLUTTTPlayer, MCTSUTTTPlayer, AlphaBetaUTTTPlayer
+import collections
+import functools
+import math
+import multiprocessing
+import numpy as np
+import random
+
+# Tournaments between players described by configs, e.g.
+#   {'name': 'random', 'type': 'random'}
+#   {'name': 'table-v2', 'type': 'rl', 'learning': 'table', 'file': 'values_v2.bin'}
+#   {'name': 'nn', 'type': 'rl', 'learning': 'nn', 'file': 'ultimate_player_nn1.h5'}
+#   {'name': 'mcts-400', 'type': 'mcts', 'iterations': 400}
+#   {'name': 'alphabeta-3', 'type': 'alphabeta', 'maxDepth': 3}
+# Every pairing plays pairs of games with colors swapped between them, spread over a pool of processes
+# that each build the players once. The results give an Elo difference with a confidence interval per
+# pairing, and a sequential probability ratio test (SPRT) of elo0 against elo1 stops a pairing as soon as
+# either is accepted. Learning players are frozen: they play on their table or model but do not learn.
+
+CONFIDENCE_Z = 1.96     # 95% confidence intervals
+
+def createPlayer(config):
+    # A player from a roster config; other keys than name/type/learning/file/learn go to the constructor
+    playerType = config['type']
+    options = dict((k, v) for (k, v) in config.iteritems() if k not in ('name', 'type', 'learning', 'file', 'learn'))
+    if playerType == 'random':
+        return RandomUTTTPlayer()
+    if playerType == 'rl':
+        if config.get('learning', 'table') == 'nn':
+            from learning import NNUltimateLearning
+            learningAlgo = NNUltimateLearning(UTTTBoardDecision)
+        else:
+            learningAlgo = TableLearning(UTTTBoardDecision)
+        if config.get('file'):
+            learningAlgo.loadLearning(config['file'])
+        if not config.get('learn', False):
+            learningAlgo = FrozenLearning(learningAlgo)
+        return RLUTTTPlayer(learningAlgo, **options)
+    if playerType == 'mcts':
+        if options.get('numberOfProcesses', 1) > 1:     # Pool workers cannot start pools of their own
+            raise ValueError('Search players play in a single process in tournaments: %s' % config.get('name', playerType))
+        return MCTSUTTTPlayer(**options)
+    if playerType == 'alphabeta':
+        return AlphaBetaUTTTPlayer(**options)
+    raise ValueError('Unknown player type: %s' % playerType)
+
+def expectedScore(elo):
+    return 1.0 / (1.0 + 10.0 ** (-elo / 400.0))
+
+def eloFromScore(score):
+    score = min(max(score, 1e-6), 1.0 - 1e-6)
+    return -400.0 * math.log10(1.0 / score - 1.0)
+
+class PairingStats(object):
+    # Results of `first` against `second`, as scores of `first`: 1 for a win, 0.5 for a draw, 0 for a loss
+    def __init__(self, first, second):
+        self.first = first
+        self.second = second
+        self.wins, self.draws, self.losses = 0, 0, 0
+        self.scheduledGames = 0
+        self.decision = None    # 'H0', 'H1' or 'maxGames' once the pairing is over
+
+    def getGames(self):
+        return self.wins + self.draws + self.losses
+
+    def addScore(self, score):
+        if score == 1.0:
+            self.wins += 1
+        elif score == 0.0:
+            self.losses += 1
+        else:
+            self.draws += 1
+
+    def getScore(self):
+        games = self.getGames()
+        return (self.wins + 0.5*self.draws) / games if games else 0.5
+
+    def getScoreVariance(self):
+        # Variance of the score of a single game
+        games = self.getGames()
+        if not games:
+            return 0.25
+        score = self.getScore()
+        return (self.wins + 0.25*self.draws) / float(games) - score*score
+
+    def getEloDifference(self):
+        return eloFromScore(self.getScore())
+
+    def getEloInterval(self):
+        games = self.getGames()
+        margin = CONFIDENCE_Z * math.sqrt(self.getScoreVariance() / games) if games else 0.5
+        score = self.getScore()
+        return eloFromScore(score - margin), eloFromScore(score + margin)
+
+    def getLogLikelihoodRatio(self, elo0, elo1):
+        # Normal approximation of the log-likelihood ratio of elo1 over elo0 given the scores; the
+        # variance is kept away from 0 so that a few games with a single outcome do not decide the test
+        score0, score1 = expectedScore(elo0), expectedScore(elo1)
+        variance = max(self.getScoreVariance(), 0.01)
+        return self.getGames() * (score1 - score0) * (2*self.getScore() - score0 - score1) / (2*variance)
+
+    def getSummary(self):
+        low, high = self.getEloInterval()
+        return {'first': self.first, 'second': self.second, 'games': self.getGames(), 'wins': self.wins,
+                'draws': self.draws, 'losses': self.losses, 'score': self.getScore(),
+                'eloDifference': self.getEloDifference(), 'eloInterval': (low, high), 'decision': self.decision}
+
+_workerSetup = None     # (roster, BoardClass, BoardDecisionClass) of the worker process
+_workerPlayers = {}     # Roster index -> player, built on first use
+
+def _initializeWorker(roster, BoardClass, BoardDecisionClass):
+    global _workerSetup, _workerPlayers
+    _workerSetup, _workerPlayers = (roster, BoardClass, BoardDecisionClass), {}
+
+def _getRosterPlayer(index):
+    if index not in _workerPlayers:
+        _workerPlayers[index] = createPlayer(_workerSetup[0][index])
+    return _workerPlayers[index]
+
+def _scoreFor(decision, firstIsX):
+    if decision == UTTTBoardDecision.DRAW:
+        return 0.5
+    return 1.0 if (decision == UTTTBoardDecision.WON_X) == firstIsX else 0.0
+
+def _resetPlayer(player, seed):
+    # Search players keep a random generator, tree or table from game to game. They start every game pair
+    # afresh from its seed, so that results do not depend on what the worker played before.
+    search = getattr(player, 'search', None)
+    if hasattr(search, 'rng'):
+        search.rng.seed(seed)
+    if hasattr(search, 'resetTree'):
+        search.resetTree()
+    if hasattr(search, 'clear'):
+        search.clear()
+
+def playGamePair(task):
+    # The first player as X and then as O; returns the pairing and the two scores of the first player
+    pairing, first, second, seed = task
+    roster, BoardClass, BoardDecisionClass = _workerSetup
+    random.seed(seed)
+    np.random.seed(seed & 0xFFFFFFFF)
+    for (k, index) in enumerate((first, second)):
+        _resetPlayer(_getRosterPlayer(index), seed + k)
+    scores = []
+    for (playerX, playerO) in ((first, second), (second, first)):
+        game = SingleGame(_getRosterPlayer(playerX), _getRosterPlayer(playerO), BoardClass, BoardDecisionClass)
+        scores.append(_scoreFor(game.playAGame(), playerX == first))
+    return pairing, scores
+
+class Tournament(object):
+    def __init__(self, roster, pairings=None, BoardClass=None, BoardDecisionClass=UTTTBoardDecision,
+                 numberOfProcesses=None, maxGamesPerPairing=2000, minGamesPerPairing=20, elo0=0.0, elo1=50.0,
+                 alpha=0.05, beta=0.05, seed=None):
+        # roster is a list of player configs (see createPlayer). pairings are (first, second) index pairs,
+        # by default every player against every later one. For each pairing the SPRT decides between H0,
+        # the first player is elo0 stronger, and H1, it is elo1 stronger, with error rates alpha and beta.
+        # Search players must run in a single process each (see createPlayer), since pool workers cannot
+        # start processes.
+        self.roster = roster
+        if pairings is None:
+            pairings = [(i, j) for i in range(len(roster)) for j in range(i + 1, len(roster))]
+        self.pairings = pairings
+        self.BoardClass = functools.partial(UTTTBitBoard, verbose=False) if BoardClass is None else BoardClass
+        self.BoardDecisionClass = BoardDecisionClass
+        self.numberOfProcesses = multiprocessing.cpu_count() if numberOfProcesses is None else numberOfProcesses
+        self.maxGamesPerPairing = maxGamesPerPairing
+        self.minGamesPerPairing = minGamesPerPairing
+        self.elo0, self.elo1 = elo0, elo1
+        self.lowerBound = math.log(beta / (1.0 - alpha))
+        self.upperBound = math.log((1.0 - beta) / alpha)
+        self.rng = random.Random(seed)
+        self.stats = [PairingStats(self.getName(i), self.getName(j)) for (i, j) in pairings]
+
+    def getName(self, index):
+        return self.roster[index].get('name', '%s-%d' % (self.roster[index]['type'], index))
+
+    def nextTask(self):
+        # Game pairs go round-robin to the pairings that are still undecided and below maxGamesPerPairing
+        candidates = [k for (k, stats) in enumerate(self.stats)
+                      if stats.decision is None and stats.scheduledGames < self.maxGamesPerPairing]
+        if not candidates:
+            return None
+        pairing = min(candidates, key=lambda k: self.stats[k].scheduledGames)
+        self.stats[pairing].scheduledGames += 2
+        first, second = self.pairings[pairing]
+        return pairing, first, second, self.rng.randint(0, 2**62)
+
+    def recordResult(self, pairing, scores):
+        # Returns True when these results decided the pairing. Game pairs that were already scheduled
+        # when it was decided still count towards its results.
+        stats = self.stats[pairing]
+        for score in scores:
+            stats.addScore(score)
+        if stats.decision is not None or stats.getGames() < self.minGamesPerPairing:
+            return False
+        llr = stats.getLogLikelihoodRatio(self.elo0, self.elo1)
+        if llr >= self.upperBound:
+            stats.decision = 'H1'
+        elif llr <= self.lowerBound:
+            stats.decision = 'H0'
+        elif stats.getGames() >= self.maxGamesPerPairing:
+            stats.decision = 'maxGames'
+        return stats.decision is not None
+
+    def run(self, verbose=False):
+        # Plays until every pairing is decided; returns the summary of every pairing. Results are taken
+        # in the order the game pairs were scheduled, so a seeded tournament is reproducible for a given
+        # numberOfProcesses (which sets how many game pairs are scheduled ahead), as long as no player
+        # searches against a timeLimit.
+        pool = None
+        if self.numberOfProcesses > 1:
+            pool = multiprocessing.Pool(self.numberOfProcesses, _initializeWorker,
+                                        (self.roster, self.BoardClass, self.BoardDecisionClass))
+        else:
+            _initializeWorker(self.roster, self.BoardClass, self.BoardDecisionClass)
+        inFlight = collections.deque()
+        try:
+            while True:
+                while len(inFlight) < 2*max(self.numberOfProcesses, 1):
+                    task = self.nextTask()
+                    if task is None:
+                        break
+                    inFlight.append(pool.apply_async(playGamePair, (task,)) if pool is not None else playGamePair(task))
+                if not inFlight:
+                    break
+                result = inFlight.popleft()
+                pairing, scores = result.get() if pool is not None else result
+                if self.recordResult(pairing, scores) and verbose:
+                    self.printPairing(self.stats[pairing])
+        finally:
+            if pool is not None:
+                pool.terminate()
+        return [stats.getSummary() for stats in self.stats]
+
+    def getRatings(self):
+        # Elo ratings of the whole roster from all games played (Bradley-Terry by minorization-maximization,
+        # draws as half wins, with one virtual draw per pairing so that unbeaten players stay finite).
+        # Ratings average 0.
+        size = len(self.roster)
+        wins, games = [0.0]*size, [[0.0]*size for k in range(size)]
+        for ((i, j), stats) in zip(self.pairings, self.stats):
+            score = stats.wins + 0.5*stats.draws
+            wins[i] += score + 0.5
+            wins[j] += stats.getGames() - score + 0.5
+            games[i][j] += stats.getGames() + 1
+            games[j][i] += stats.getGames() + 1
+        strengths = [1.0]*size
+        for iteration in range(200):
+            for i in range(size):
+                denominator = sum(games[i][j] / (strengths[i] + strengths[j]) for j in range(size) if games[i][j])
+                if denominator:
+                    strengths[i] = wins[i] / denominator
+            meanLog = sum(math.log10(strength) for strength in strengths) / size
+            strengths = [strength / 10.0**meanLog for strength in strengths]
+        return dict((self.getName(i), 400.0*math.log10(strengths[i])) for i in range(size))
+
+    def printPairing(self, stats):
+        summary = stats.getSummary()
+        print '%s vs %s: +%d =%d -%d, score %.3f, Elo %+.0f [%+.0f, %+.0f], %s' % \
+              (summary['first'], summary['second'], summary['wins'], summary['draws'], summary['losses'],
+               summary['score'], summary['eloDifference'], summary['eloInterval'][0], summary['eloInterval'][1],
+               summary['decision'])
+
+    def printStandings(self):
+        for stats in self.stats:
+            self.printPairing(stats)
+        for (name, rating) in sorted(self.getRatings().iteritems(), key=lambda item: -item[1]):
+            print '%-20s %+7.0f' % (name, rating)
@@ -0,0 +1,212 @@
+from game import GameSequence
+from valuefile import writeValueFile
+import copy
+import cPickle as pickle
+import numpy as np
+import os
+import random
+import shutil
+import threading
+import time
+
+# Long training runs that survive crashes. TrainingRun plays sets of games and appends every set's
+# (X win, O win, draw) fractions to results.csv as soon as the set is over. Every `checkpointEvery`
+# games (at the end of a set) it checkpoints the learning algorithms and the random generator states
+# into the run directory, and resume() carries on from the last checkpoint exactly as if the run had
+# not stopped. Neural network learners are checkpointed with their optimizer state and replay buffer.
+# Only the copy of the learner state is made between sets; writing it to disk happens on a background
+# thread while the games go on.
+
+RESULTS_FILE = 'results.csv'
+LATEST_FILE = 'LATEST'
+STATE_FILE = 'state.pkl'
+
+def _writePickle(filename, data):
+    with open(filename, 'wb') as outfile:
+        pickle.dump(data, outfile, pickle.HIGHEST_PROTOCOL)
+
+def _captureTable(learningAlgo):
+    # A copy of the values now, and a function that writes it. A store backed by a value file is written
+    # as one (see valuefile.py); other stores, such as dicts and CompactValueStores, are pickled whole, so
+    # they come back as the same kind of store with their own keys (value files only keep state hashes)
+    # and eviction bookkeeping.
+    values = learningAlgo.values
+    if hasattr(values, 'reload'):
+        keys, valueArray = values.getHashedArrays()
+        return '.bin', lambda filename: writeValueFile(filename, keys, valueArray)
+    values = dict(values) if isinstance(values, dict) else copy.deepcopy(values)
+    return '.values.pkl', lambda filename: _writePickle(filename, values)
+
+def _captureNetwork(learningAlgo):
+    # Weights, optimizer state (e.g. Adam's moments) and replay buffer, so training goes on as it would have
+    model = learningAlgo.model
+    optimizer = getattr(model, 'optimizer', None)
+    state = {'weights': model.get_weights(), 'optimizerWeights': optimizer.get_weights() if hasattr(optimizer, 'get_weights') else [],
+             'gamesSinceTraining': learningAlgo.gamesSinceTraining,
+             'replayBuffer': None if learningAlgo.replayBuffer is None else learningAlgo.replayBuffer.getState()}
+    return lambda filename: _writePickle(filename, state)
+
+def captureLearner(learningAlgo):
+    # (file extension, writer) for the current state of a learning algorithm
+    if hasattr(getattr(learningAlgo, 'model', None), 'get_weights'):
+        return '.network.pkl', _captureNetwork(learningAlgo)
+    if hasattr(learningAlgo, 'values'):
+        return _captureTable(learningAlgo)
+    raise ValueError('Cannot checkpoint a %s' % type(learningAlgo).__name__)
+
+def _restoreNetwork(learningAlgo, state):
+    model = learningAlgo.model
+    model.set_weights(state['weights'])
+    if state['optimizerWeights']:
+        if hasattr(model, '_make_train_function'):
+            model._make_train_function()    # Keras only creates the optimizer's weights with it
+        model.optimizer.set_weights(state['optimizerWeights'])
+    learningAlgo.refreshInferenceNetwork()
+    learningAlgo.gamesSinceTraining = state['gamesSinceTraining']
+    if (state['replayBuffer'] is None) != (learningAlgo.replayBuffer is None):
+        raise ValueError('The checkpoint was made %s a replay buffer' % ('without' if state['replayBuffer'] is None else 'with'))
+    if learningAlgo.replayBuffer is not None:
+        learningAlgo.replayBuffer.setState(state['replayBuffer'])
+
+def restoreLearner(learningAlgo, filename, valueFilename):
+    # valueFilename is where a store backed by a value file gets a copy of its checkpoint to keep reading
+    # from, as checkpoints are deleted once they are old
+    if filename.endswith('.npz'):   # Weights only, from earlier versions
+        saved = np.load(filename)
+        learningAlgo.model.set_weights([saved['arr_%d' % k] for k in range(len(saved.files))])
+        learningAlgo.refreshInferenceNetwork()
+    elif filename.endswith('.pkl'):
+        with open(filename, 'rb') as infile:
+            state = pickle.load(infile)
+        if filename.endswith('.network.pkl'):
+            _restoreNetwork(learningAlgo, state)
+        else:
+            learningAlgo.values = state
+    else:
+        shutil.copyfile(filename, valueFilename + '.tmp')
+        os.rename(valueFilename + '.tmp', valueFilename)    # A store still mapping the old copy keeps it
+        learningAlgo.loadLearning(valueFilename)
+
+def _writeAtomically(filename, data):
+    tempFilename = filename + '.tmp'
+    with open(tempFilename, 'wb') as outfile:
+        outfile.write(data)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.rename(tempFilename, filename)
+
+class TrainingRun(object):
+    def __init__(self, directory, player1, player2, BoardClass, BoardDecisionClass, gamesPerSet=100,
+                 checkpointEvery=1000, keepCheckpoints=2, GameSequenceClass=GameSequence):
+        self.directory = directory
+        self.player1 = player1
+        self.player2 = player2
+        self.BoardClass = BoardClass
+        self.BoardDecisionClass = BoardDecisionClass
+        self.gamesPerSet = gamesPerSet
+        self.checkpointEvery = checkpointEvery
+        self.keepCheckpoints = keepCheckpoints
+        self.GameSequenceClass = GameSequenceClass
+        self.learners = []
+        for player in (player1, player2):
+            learningAlgo = getattr(player, 'learningAlgo', None)
+            if learningAlgo is not None and learningAlgo not in self.learners:
+                self.learners.append(learningAlgo)
+        self.setsCompleted = 0
+        self.gamesSinceCheckpoint = 0
+        self.checkpointThread = None
+        self.checkpointSeconds = 0.0    # Total time spent writing checkpoints in the background
+        self.stallSeconds = 0.0         # Time play waited for the previous checkpoint to be written
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def getResultsFilename(self):
+        return os.path.join(self.directory, RESULTS_FILE)
+
+    def run(self, numberOfSets):
+        # Plays until numberOfSets sets have been completed in total, counting sets of earlier runs. The
+        # sets played since the last checkpoint are checkpointed at the end, unless the run failed: a set
+        # cut short has already changed the learners, so resuming goes back to the last checkpoint instead.
+        finished = False
+        try:
+            while self.setsCompleted < numberOfSets:
+                games = self.GameSequenceClass(self.gamesPerSet, self.player1, self.player2, self.BoardClass,
+                                               self.BoardDecisionClass)
+                result = games.playGamesAndGetWinPercent()
+                with open(self.getResultsFilename(), 'a') as outfile:
+                    outfile.write('%s,%s,%s\n' % result)
+                self.setsCompleted += 1
+                self.gamesSinceCheckpoint += self.gamesPerSet
+                if self.gamesSinceCheckpoint >= self.checkpointEvery:
+                    self.checkpoint()
+            finished = True
+        finally:
+            if finished and self.gamesSinceCheckpoint > 0:
+                self.checkpoint()
+            self.waitForCheckpoint()
+
+    def checkpoint(self):
+        # Copies what is needed right away; the files are written by a background thread
+        self.waitForCheckpoint()
+        resultsFilename = self.getResultsFilename()
+        state = {'setsCompleted': self.setsCompleted, 'gamesPerSet': self.gamesPerSet,
+                 'resultsBytes': os.path.getsize(resultsFilename) if os.path.isfile(resultsFilename) else 0,
+                 'randomState': random.getstate(), 'numpyRandomState': np.random.get_state(), 'learnerFiles': []}
+        writers = []
+        for (k, learningAlgo) in enumerate(self.learners):
+            extension, writer = captureLearner(learningAlgo)
+            state['learnerFiles'].append('learner%d%s' % (k, extension))
+            writers.append(writer)
+        self.gamesSinceCheckpoint = 0
+        self.checkpointThread = threading.Thread(target=self.writeCheckpoint, args=(state, writers))
+        self.checkpointThread.daemon = True
+        self.checkpointThread.start()
+
+    def waitForCheckpoint(self):
+        if self.checkpointThread is not None:
+            startTime = time.time()
+            self.checkpointThread.join()
+            self.stallSeconds += time.time() - startTime
+            self.checkpointThread = None
+
+    def writeCheckpoint(self, state, writers):
+        # Everything goes to a new directory, which only becomes the latest checkpoint once complete
+        startTime = time.time()
+        name = 'checkpoint-%08d' % state['setsCompleted']
+        path = os.path.join(self.directory, name)
+        tempPath = path + '.tmp'
+        if os.path.isdir(tempPath):
+            shutil.rmtree(tempPath)
+        os.makedirs(tempPath)
+        for (filename, writer) in zip(state['learnerFiles'], writers):
+            writer(os.path.join(tempPath, filename))
+        _writeAtomically(os.path.join(tempPath, STATE_FILE), pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(tempPath, path)
+        _writeAtomically(os.path.join(self.directory, LATEST_FILE), name)
+        checkpoints = sorted(entry for entry in os.listdir(self.directory)
+                             if entry.startswith('checkpoint-') and not entry.endswith('.tmp'))
+        for oldName in checkpoints[:-self.keepCheckpoints]:
+            shutil.rmtree(os.path.join(self.directory, oldName))
+        self.checkpointSeconds += time.time() - startTime
+
+    def resume(self):
+        # Restores the last checkpoint, if any, and drops results of sets played after it. Returns the
+        # number of sets completed.
+        latestFilename = os.path.join(self.directory, LATEST_FILE)
+        if not os.path.isfile(latestFilename):
+            return self.setsCompleted
+        path = os.path.join(self.directory, open(latestFilename).read().strip())
+        with open(os.path.join(path, STATE_FILE), 'rb') as infile:
+            state = pickle.load(infile)
+        for (k, (learningAlgo, filename)) in enumerate(zip(self.learners, state['learnerFiles'])):
+            restoreLearner(learningAlgo, os.path.join(path, filename), os.path.join(self.directory, 'learner%d.bin' % k))
+        random.setstate(state['randomState'])
+        np.random.set_state(state['numpyRandomState'])
+        resultsFilename = self.getResultsFilename()
+        if os.path.isfile(resultsFilename):
+            with open(resultsFilename, 'r+b') as resultsFile:
+                resultsFile.truncate(state['resultsBytes'])
+        self.setsCompleted, self.gamesPerSet, self.gamesSinceCheckpoint = state['setsCompleted'], state['gamesPerSet'], 0
+        return self.setsCompleted
@@ -0,0 +1,249 @@
+from board import GridStates
+from ultimateboard import UTTTBoardDecision, SUBBOARD_MASK, BOARD_LOCATIONS, CELLS_OF_BOARD, CELLS_OF_BOARDS, \
+    ALL_CELLS, SNAPSHOT_SIZE, cellsOfMask
+from statekey import CELL_DIGITS, CELL_WEIGHTS, packBoardState
+
+# Cells are indexed in the same order as UTTTBoard.getBoardState(): cell = 9*board + place,
+# where board = 3*boardRow + boardColumn and place = 3*row + column inside that board.
+# Every 9-bit sub-board mask has its bit `place` set when that place is taken.
+
+NO_BOARD = -1
+# Change of the packed state (statekey.py) when a player takes a cell, per player and cell
+PACKED_STEPS = dict((who, tuple(digit*weight for weight in CELL_WEIGHTS)) for (who, digit) in CELL_DIGITS.iteritems())
+
+# Same scan order as TTTBoard.determineBoardState: rows, columns, then both diagonals
+WIN_LINES = (0x007, 0x038, 0x1C0,
+             0x049, 0x092, 0x124,
+             0x111, 0x054)
+
+def _firstWinLine(mask):
+    for (index, line) in enumerate(WIN_LINES):
+        if mask & line == line:
+            return index
+    return len(WIN_LINES)
+
+FIRST_WIN_LINE = tuple(_firstWinLine(m) for m in range(512))
+HAS_WIN_LINE = tuple(line < len(WIN_LINES) for line in FIRST_WIN_LINE)
+EMPTY_PLACES = BOARD_LOCATIONS     # Same (i, j) layout is used inside a board
+NEXT_BOARD_LOCATIONS = tuple([k // 3, k % 3] for k in range(9))
+
+def decideSubBoard(xBits, oBits):
+    # xBits, oBits are the 9-bit masks of a single board; returns a win/draw/active code
+    xLine, oLine = FIRST_WIN_LINE[xBits], FIRST_WIN_LINE[oBits]
+    if xLine < oLine:
+        return UTTTBoardDecision.WON_X
+    if oLine < xLine:
+        return UTTTBoardDecision.WON_O
+    if xBits | oBits == SUBBOARD_MASK:
+        return UTTTBoardDecision.DRAW
+    return UTTTBoardDecision.ACTIVE
+
+def decideMasterBoard(xWon, oWon, drawn):
+    xLine, oLine = FIRST_WIN_LINE[xWon], FIRST_WIN_LINE[oWon]
+    if xLine < oLine:
+        return UTTTBoardDecision.WON_X
+    if oLine < xLine:
+        return UTTTBoardDecision.WON_O
+    if xWon | oWon | drawn == SUBBOARD_MASK:
+        return UTTTBoardDecision.DRAW
+    return UTTTBoardDecision.ACTIVE
+
+# A position is an immutable tuple, so keeping a snapshot of it is free:
+# (xMask, oMask, xWon, oWon, drawn, nextBoard, decision)
+EMPTY_POSITION = (0, 0, 0, 0, 0, NO_BOARD, UTTTBoardDecision.ACTIVE)
+
+def playMove(position, who, cell):
+    xMask, oMask, xWon, oWon, drawn, nextBoard, decision = position
+    board, place = divmod(cell, 9)
+    shift = 9*board
+    if who == GridStates.PLAYER_X:
+        xMask |= 1 << cell
+        moverBits = (xMask >> shift) & SUBBOARD_MASK
+    else:
+        oMask |= 1 << cell
+        moverBits = (oMask >> shift) & SUBBOARD_MASK
+    xBits, oBits = (xMask >> shift) & SUBBOARD_MASK, (oMask >> shift) & SUBBOARD_MASK
+    if not HAS_WIN_LINE[moverBits] and xBits | oBits != SUBBOARD_MASK:
+        # Most moves neither complete a line nor fill their tile: no tile changes, and neither does the game
+        if decision != UTTTBoardDecision.ACTIVE or (xWon | oWon | drawn) & (1 << place):
+            return (xMask, oMask, xWon, oWon, drawn, NO_BOARD, decision)
+        return (xMask, oMask, xWon, oWon, drawn, place, decision)
+    boardBit = 1 << board
+    boardDecision = decideSubBoard(xBits, oBits)
+    xWon = xWon | boardBit if boardDecision == UTTTBoardDecision.WON_X else xWon & ~boardBit
+    oWon = oWon | boardBit if boardDecision == UTTTBoardDecision.WON_O else oWon & ~boardBit
+    drawn = drawn | boardBit if boardDecision == UTTTBoardDecision.DRAW else drawn & ~boardBit
+    decision = decideMasterBoard(xWon, oWon, drawn)
+    if decision != UTTTBoardDecision.ACTIVE or (xWon | oWon | drawn) & (1 << place):
+        nextBoard = NO_BOARD
+    else:
+        nextBoard = place
+    return (xMask, oMask, xWon, oWon, drawn, nextBoard, decision)
+
+def emptyBitsOfBoard(position, board):
+    shift = 9*board
+    return ~((position[0] | position[1]) >> shift) & SUBBOARD_MASK
+
+def availableBoards(position):
+    # Boards that are still undecided (see UTTTBoard.getActiveBoardLocations)
+    return SUBBOARD_MASK & ~(position[2] | position[3] | position[4])
+
+def legalMoveMask(position):
+    # Move mask of the cells the next move may be played at (see UTTTBoard.legalMoveMask)
+    if position[6] != UTTTBoardDecision.ACTIVE:
+        return 0
+    emptyCells = ALL_CELLS & ~(position[0] | position[1])
+    nextBoard = position[5]
+    if nextBoard != NO_BOARD:
+        return emptyCells & CELLS_OF_BOARD[nextBoard]
+    return emptyCells & CELLS_OF_BOARDS[availableBoards(position)]
+
+def legalMoves(position):
+    return cellsOfMask(legalMoveMask(position))
+
+def positionFromBoard(board):
+    # Build a position from anything exposing getBoardState/getNextBoardLocation, e.g. a UTTTBoard
+    position = EMPTY_POSITION
+    for (cell, grid) in enumerate(board.getBoardState()):
+        if grid != GridStates.EMPTY:
+            position = playMove(position, grid, cell)
+    nextBoardLocation = board.getNextBoardLocation()
+    nextBoard = NO_BOARD if None in nextBoardLocation else 3*nextBoardLocation[0] + nextBoardLocation[1]
+    return position[:5] + (nextBoard, board.getBoardDecision())
+
+def positionFromSnapshot(buffer):
+    # Position of a UTTTBoard/UTTTBitBoard snapshot
+    xMask = oMask = xWon = oWon = drawn = 0
+    for cell in range(81):
+        grid = chr(buffer[cell])
+        if grid == GridStates.PLAYER_X:
+            xMask |= 1 << cell
+        elif grid == GridStates.PLAYER_O:
+            oMask |= 1 << cell
+    for board in range(9):
+        boardDecision = decideSubBoard((xMask >> 9*board) & SUBBOARD_MASK, (oMask >> 9*board) & SUBBOARD_MASK)
+        if boardDecision == UTTTBoardDecision.WON_X:
+            xWon |= 1 << board
+        elif boardDecision == UTTTBoardDecision.WON_O:
+            oWon |= 1 << board
+        elif boardDecision == UTTTBoardDecision.DRAW:
+            drawn |= 1 << board
+    return (xMask, oMask, xWon, oWon, drawn, buffer[81] - 1, buffer[82] + UTTTBoardDecision.ACTIVE)
+
+def boardStateOf(position):
+    xMask, oMask = position[0], position[1]
+    return ''.join(GridStates.PLAYER_X if xMask & (1 << cell) else
+                   (GridStates.PLAYER_O if oMask & (1 << cell) else GridStates.EMPTY) for cell in range(81))
+
+class UTTTBitBoard(object):
+    # Drop-in replacement for UTTTBoard that keeps occupancy as bit masks
+    def __init__(self, verbose=True):
+        self.verbose = verbose
+        self.position = EMPTY_POSITION
+        self.boardState = GridStates.EMPTY*81
+        self.packedState = 0
+        self.undoStack = []     # Positions before every move made; they are immutable, so nothing is copied
+
+    def getEmptyBoardPlaces(self, whichBoard):
+        return EMPTY_PLACES[emptyBitsOfBoard(self.position, 3*whichBoard[0] + whichBoard[1])]
+
+    def getActiveBoardLocations(self):
+        return list(BOARD_LOCATIONS[availableBoards(self.position)])
+
+    def legalMoveMask(self):
+        return legalMoveMask(self.position)
+
+    def getNextBoardLocation(self):
+        nextBoard = self.position[5]
+        return [None, None] if nextBoard == NO_BOARD else NEXT_BOARD_LOCATIONS[nextBoard]
+
+    def makeMove(self, who, whichBoard, whichLocation):
+        cell = 27*whichBoard[0] + 9*whichBoard[1] + 3*whichLocation[0] + whichLocation[1]
+        position = self.position
+        if (position[0] | position[1]) & (1 << cell):
+            if self.verbose:
+                print 'That location is not empty'
+            return
+        self.undoStack.append(position)
+        self.position = position = playMove(position, who, cell)
+        boardState = self.boardState
+        self.boardState = boardState[:cell] + who + boardState[cell+1:]
+        self.packedState += PACKED_STEPS[who][cell]
+        if not self.verbose:
+            return
+        decision = position[6]
+        if decision == UTTTBoardDecision.DRAW:
+            print 'This Ultimate-TTT game was drawn!'
+        elif decision != UTTTBoardDecision.ACTIVE:
+            print 'This Ultimate-TTT game was won by %s'%(GridStates.PLAYER_X if decision == UTTTBoardDecision.WON_X else GridStates.PLAYER_O)
+
+    def unmakeMove(self):
+        previous = self.undoStack.pop()
+        cell = ((self.position[0] | self.position[1]) ^ (previous[0] | previous[1])).bit_length() - 1
+        self.packedState -= PACKED_STEPS[self.boardState[cell]][cell]
+        self.boardState = self.boardState[:cell] + GridStates.EMPTY + self.boardState[cell+1:]
+        self.position = previous
+
+    def getMoveHistory(self):
+        # Cells of the moves made since the board was created or last restored, in order
+        positions = self.undoStack + [self.position]
+        return [((after[0] | after[1]) ^ (before[0] | before[1])).bit_length() - 1
+                for (before, after) in zip(positions, positions[1:])]
+
+    def snapshot(self, buffer=None):
+        # Same layout as UTTTBoard.snapshot, so either board restores the other's snapshots
+        if buffer is None:
+            buffer = bytearray(SNAPSHOT_SIZE)
+        buffer[:81] = self.boardState
+        buffer[81] = self.position[5] + 1
+        buffer[82] = self.position[6] - UTTTBoardDecision.ACTIVE
+        return buffer
+
+    def restore(self, buffer):
+        self.position = positionFromSnapshot(buffer)
+        self.boardState = str(buffer[:81])
+        self.packedState = packBoardState(self.boardState)
+        self.undoStack = []
+
+    def printBoard(self):
+        delimiter = '-------------'*3+'\n'
+        for boardRow in range(3):
+            rowString = delimiter
+            rowString += self.getBoardRowString(boardRow, 0) + '\n' + delimiter
+            rowString += self.getBoardRowString(boardRow, 1) + '\n' + delimiter
+            rowString += self.getBoardRowString(boardRow, 2) + '\n' + delimiter[:-1]
+            print rowString
+
+    def getBoardRowString(self, boardRow, row):
+        rowString = ''
+        for boardColumn in range(3):
+            start = 27*boardRow + 9*boardColumn + 3*row
+            rowString += "| {0} | {1} | {2} |".format(*self.boardState[start:start+3])
+        return rowString
+
+    def getBoardState(self):
+        return self.boardState
+
+    def getPackedState(self):
+        return self.packedState
+
+    def childKey(self, boardLocation, placeOnBoard, who):
+        cell = 27*boardLocation[0] + 9*boardLocation[1] + 3*placeOnBoard[0] + placeOnBoard[1]
+        return self.packedState + PACKED_STEPS[who][cell]
+
+    def getBoardDecision(self):
+        return self.position[6]
+
+if __name__ == '__main__':
+    b = UTTTBitBoard()
+    b.makeMove(GridStates.PLAYER_X, (1,1), (1,1))
+    b.makeMove(GridStates.PLAYER_O, b.getNextBoardLocation(), (1, 2))
+    b.makeMove(GridStates.PLAYER_X, b.getNextBoardLocation(), (1, 1))
+    b.makeMove(GridStates.PLAYER_O, b.getNextBoardLocation(), (0, 0))
+    b.makeMove(GridStates.PLAYER_X, b.getNextBoardLocation(), (1, 1))
+    b.makeMove(GridStates.PLAYER_O, b.getNextBoardLocation(), (2, 2))
+    b.makeMove(GridStates.PLAYER_X, b.getNextBoardLocation(), (1, 1))
+    b.makeMove(GridStates.PLAYER_O, b.getNextBoardLocation(), (2, 1))
+    b.makeMove(GridStates.PLAYER_X, b.getNextBoardLocation(), (1, 1))
+    b.printBoard()
+    print b.getBoardState()
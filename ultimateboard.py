@@ -1,6 +1,30 @@
 from board import TTTBoard, TTTBoardDecision, GridStates
+from statekey import CELL_DIGITS, CELL_WEIGHTS, packBoardState
 import itertools
 
+# Move masks have bit `cell` set for every cell, indexed as in getBoardState(): cell = 9*board + place,
+# where board = 3*boardRow + boardColumn and place = 3*row + column inside that board. Masks of boards
+# (or of places inside one board) are 9-bit masks with bit `board` (or `place`) set.
+SUBBOARD_MASK = 0x1FF
+PLACES_OF = tuple(tuple(place for place in range(9) if m & (1 << place)) for m in range(512))
+BOARD_LOCATIONS = tuple(tuple((k // 3, k % 3) for k in PLACES_OF[m]) for m in range(512))
+CELLS_OF_BOARD = tuple(SUBBOARD_MASK << 9*board for board in range(9))
+CELLS_OF_BOARDS = tuple(sum(CELLS_OF_BOARD[board] for board in PLACES_OF[m]) for m in range(512))
+ALL_CELLS = (1 << 81) - 1
+SNAPSHOT_SIZE = 83      # See UTTTBoard.snapshot
+CELL_MOVES = tuple(((cell // 27, cell // 9 % 3), (cell % 9 // 3, cell % 3)) for cell in range(81))
+
+def cellsOfMask(mask):
+    # Cells set in a move mask, in increasing order
+    cells, base = [], 0
+    while mask:
+        bits = mask & SUBBOARD_MASK
+        if bits:
+            cells.extend([base + place for place in PLACES_OF[bits]])
+        mask >>= 9
+        base += 9
+    return cells
+
 class UTTTBoardDecision():
     ACTIVE = 10
     DRAW = 11
@@ -8,10 +32,18 @@ class UTTTBoardDecision():
     WON_O = 13
 
 class UTTTBoard(object):
-    def __init__(self):
+    def __init__(self, verbose=True):
+        # With verbose=False nothing is ever printed, e.g. for searches and rollouts
+        self.verbose = verbose
         self.board = self.emptyState()
         self.decision = UTTTBoardDecision.ACTIVE
         self.nextBoardLocation = [None, None]
+        self.boardState = GridStates.EMPTY*81   # Kept up to date by makeMove, see getBoardState
+        self.packedState = 0                    # The same state packed into an integer (see statekey.py)
+        self.emptyCells = ALL_CELLS
+        self.activeBoards = SUBBOARD_MASK       # Tiles that are still undecided
+        self.legalMask = ALL_CELLS              # See legalMoveMask
+        self.undoStack = []                     # One int per move made, see unmakeMove
 
     def emptyState(self):
         return [[TTTBoard(), TTTBoard(), TTTBoard()],
@@ -55,11 +87,13 @@ class UTTTBoard(object):
         return nextBoard.getEmptyBoardPlaces()
 
     def getActiveBoardLocations(self):
-        activeBoards = []
-        for (i, j) in itertools.product(range(3), range(3)):
-            if self.board[i][j].getBoardDecision() == TTTBoardDecision.ACTIVE or self.board[i][j].getDoesBoardHaveEmptyCell():
-                activeBoards.append((i, j))
-        return activeBoards
+        # Tiles a player may pick from when not sent to one: only undecided tiles, as a player sent to a
+        # decided tile by makeMove gets to choose instead
+        return list(BOARD_LOCATIONS[self.activeBoards])
+
+    def legalMoveMask(self):
+        # Cells the next move may be played at, as a move mask; kept up to date by makeMove
+        return self.legalMask
 
     def getNextBoardLocation(self):
         return self.nextBoardLocation
@@ -68,20 +102,94 @@ class UTTTBoard(object):
         tttboard = self.board[whichBoard[0]][whichBoard[1]]
         i, j = whichLocation[0], whichLocation[1]
         if tttboard.getGrid(i, j) != GridStates.EMPTY:
-            print 'That location is not empty'
+            if self.verbose:
+                print 'That location is not empty'
             return
+        cell = 27*whichBoard[0] + 9*whichBoard[1] + 3*i + j
+        nextBoardLocation = self.nextBoardLocation
+        nextBoard = -1 if None in nextBoardLocation else 3*nextBoardLocation[0] + nextBoardLocation[1]
+        self.undoStack.append(cell | (nextBoard + 1) << 7 | (self.decision - UTTTBoardDecision.ACTIVE) << 11)
         tttboard.makeMove(who, i, j, verbose=False)
-        #self.printBoard()
-        self.determineBoardState()
+        self.boardState = self.boardState[:cell] + who + self.boardState[cell+1:]
+        self.packedState += CELL_DIGITS[who]*CELL_WEIGHTS[cell]
+        self.emptyCells &= ~(1 << cell)
+        if tttboard.getBoardDecision() != TTTBoardDecision.ACTIVE:
+            self.activeBoards &= ~(1 << (3*whichBoard[0] + whichBoard[1]))
+            #self.printBoard()
+            self.determineBoardState()  # The game can only be decided by a move that decides its tile
         if self.decision == UTTTBoardDecision.DRAW:
-            print 'This Ultimate-TTT game was drawn!'
+            if self.verbose:
+                print 'This Ultimate-TTT game was drawn!'
             self.nextBoardLocation = [None, None]
         elif self.decision != UTTTBoardDecision.ACTIVE:
-            print 'This Ultimate-TTT game was won by %s'%(GridStates.PLAYER_X if self.decision == UTTTBoardDecision.WON_X else GridStates.PLAYER_O)
+            if self.verbose:
+                print 'This Ultimate-TTT game was won by %s'%(GridStates.PLAYER_X if self.decision == UTTTBoardDecision.WON_X else GridStates.PLAYER_O)
             self.nextBoardLocation = [None, None]
         else:
             nextTttboard = self.board[i][j]
             self.nextBoardLocation = [i, j] if nextTttboard.getBoardDecision() == TTTBoardDecision.ACTIVE else [None, None]
+        self.updateLegalMask()
+
+    def unmakeMove(self):
+        # Takes back the last move made. Every undo stack entry packs the cell of the move (7 bits),
+        # the next board before it (board + 1, 0 for none; 4 bits) and the game decision before it.
+        # Tile decisions follow from the cells.
+        entry = self.undoStack.pop()
+        cell, nextBoard, decision = entry & 0x7F, (entry >> 7 & 0xF) - 1, (entry >> 11) + UTTTBoardDecision.ACTIVE
+        board, place = divmod(cell, 9)
+        tttboard = self.board[board // 3][board % 3]
+        self.packedState -= CELL_DIGITS[self.boardState[cell]]*CELL_WEIGHTS[cell]
+        tttboard.unmakeMove(place // 3, place % 3)
+        self.boardState = self.boardState[:cell] + GridStates.EMPTY + self.boardState[cell+1:]
+        self.emptyCells |= 1 << cell
+        if tttboard.getBoardDecision() == TTTBoardDecision.ACTIVE:
+            self.activeBoards |= 1 << board
+        self.decision = decision
+        self.nextBoardLocation = [None, None] if nextBoard == -1 else [nextBoard // 3, nextBoard % 3]
+        self.updateLegalMask()
+
+    def getMoveHistory(self):
+        # Cells of the moves made since the board was created or last restored, in order
+        return [entry & 0x7F for entry in self.undoStack]
+
+    def updateLegalMask(self):
+        if self.decision != UTTTBoardDecision.ACTIVE:
+            self.legalMask = 0
+        elif None in self.nextBoardLocation:
+            self.legalMask = self.emptyCells & CELLS_OF_BOARDS[self.activeBoards]
+        else:
+            self.legalMask = self.emptyCells & CELLS_OF_BOARD[3*self.nextBoardLocation[0] + self.nextBoardLocation[1]]
+
+    def snapshot(self, buffer=None):
+        # The whole position as SNAPSHOT_SIZE bytes: the 81 cells of getBoardState(), the next board
+        # (board + 1, 0 for none) and the game decision. Written into `buffer` (a bytearray) when given,
+        # so that rollouts can reuse one buffer. The undo stack is not part of a snapshot.
+        if buffer is None:
+            buffer = bytearray(SNAPSHOT_SIZE)
+        nextBoardLocation = self.nextBoardLocation
+        buffer[:81] = self.boardState
+        buffer[81] = 0 if None in nextBoardLocation else 3*nextBoardLocation[0] + nextBoardLocation[1] + 1
+        buffer[82] = self.decision - UTTTBoardDecision.ACTIVE
+        return buffer
+
+    def restore(self, buffer):
+        # Back to a snapshot, without creating any board objects; the undo stack is cleared
+        boardState = str(buffer[:81])
+        for board in range(9):
+            tttboard = self.board[board // 3][board % 3]
+            tttboard.setBoardState(boardState[9*board:9*board+9])
+            if tttboard.getBoardDecision() == TTTBoardDecision.ACTIVE:
+                self.activeBoards |= 1 << board
+            else:
+                self.activeBoards &= ~(1 << board)
+        self.boardState = boardState
+        self.packedState = packBoardState(boardState)
+        self.emptyCells = sum(1 << cell for cell in range(81) if boardState[cell] == GridStates.EMPTY)
+        nextBoard = buffer[81] - 1
+        self.nextBoardLocation = [None, None] if nextBoard == -1 else [nextBoard // 3, nextBoard % 3]
+        self.decision = buffer[82] + UTTTBoardDecision.ACTIVE
+        self.undoStack = []
+        self.updateLegalMask()
 
     def printBoard(self):
         delimiter = '-------------'*3+'\n'
@@ -100,11 +208,15 @@ class UTTTBoard(object):
         return rowString
 
     def getBoardState(self):
-        boardStrings = []
-        for (i,j) in itertools.product(range(3), range(3)):
-            board = self.board[i][j]
-            [boardStrings.append(''.join(board.board[i])) for i in range(3)]
-        return ''.join(boardStrings)
+        return self.boardState
+
+    def getPackedState(self):
+        return self.packedState
+
+    def childKey(self, boardLocation, placeOnBoard, who):
+        # Packed state after `who` plays at the given place, without making the move
+        cell = 27*boardLocation[0] + 9*boardLocation[1] + 3*placeOnBoard[0] + placeOnBoard[1]
+        return self.packedState + CELL_DIGITS[who]*CELL_WEIGHTS[cell]
 
     def getBoardDecision(self):
         return self.decision
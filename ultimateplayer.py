@@ -1,5 +1,10 @@
-from ultimateboard import UTTTBoardDecision, UTTTBoard
+from ultimateboard import UTTTBoardDecision, UTTTBoard, SUBBOARD_MASK, PLACES_OF, CELL_MOVES, cellsOfMask
+from board import GridStates
+from ultimatebitboard import positionFromBoard, playMove
 from learning import TableLearning
+from alphabeta import AlphaBetaSearch
+from mcts import MCTSSearch, RootParallelSearch, LeafParallelSearch, LearnerEvaluator, cellToMove, otherPlayer
+from statekey import CELL_DIGITS, CELL_WEIGHTS
 import random
 
 class UTTTPlayer(object):
@@ -43,8 +48,11 @@ class RandomUTTTPlayer(UTTTPlayer):
         pass  # Random player does not learn from move
 
 class RLUTTTPlayer(UTTTPlayer):
-    def __init__(self, learningModel):
+    def __init__(self, learningModel, tablebase=None):
+        # With a tablebase (see tablebase.py), solved positions get their exact values when choosing
+        # moves and when learning
         self.learningAlgo = learningModel
+        self.tablebase = tablebase
         super(RLUTTTPlayer, self).__init__()
 
     def printValues(self):
@@ -52,9 +60,7 @@ class RLUTTTPlayer(UTTTPlayer):
 
     def testNextMove(self, state, boardLocation, placeOnBoard):
         loc = 27*boardLocation[0] + 9*boardLocation[1] + 3*placeOnBoard[0] + placeOnBoard[1]
-        boardCopy = list(state)
-        boardCopy[loc] = self.player
-        return ''.join(boardCopy)
+        return state[:loc] + self.player + state[loc+1:]
 
     def startNewGame(self):
         self.learningAlgo.resetForNewGame()
@@ -65,26 +71,40 @@ class RLUTTTPlayer(UTTTPlayer):
     def makeNextMove(self):
         previousState = self.board.getBoardState()
         if self.isBoardActive():
-            nextBoardLocation = self.board.getNextBoardLocation()
-            activeBoardLocations = [nextBoardLocation]
-            if None in nextBoardLocation:
-                activeBoardLocations = self.board.getActiveBoardLocations()
+            legalMask = self.board.legalMoveMask()
             if random.uniform(0, 1) < 0.8:      # Make a random move with probability 0.2
-                moveChoices = {}
-                for boardLocation in activeBoardLocations:
-                    emptyPlaces = self.board.getEmptyBoardPlaces(boardLocation)
-                    for placeOnBoard in emptyPlaces:
-                        possibleNextState = self.testNextMove(previousState, boardLocation, placeOnBoard)
-                        moveChoices[(tuple(boardLocation), placeOnBoard)] = self.learningAlgo.getBoardStateValue(self.player, self.board, possibleNextState)
-                (chosenBoard, pickOne) = max(moveChoices, key=moveChoices.get)
-            else:
-                chosenBoard = random.choice(activeBoardLocations)
-                emptyPlaces = self.board.getEmptyBoardPlaces(chosenBoard)
-                pickOne = random.choice(emptyPlaces)
+                cells = cellsOfMask(legalMask)
+                # Learning algorithms keyed by hashes take packed states, which the board derives without copying
+                if hasattr(self.board, 'getPackedState') and self.learningAlgo.acceptsPackedStates():
+                    packedState, digit = self.board.getPackedState(), CELL_DIGITS[self.player]
+                    possibleNextStates = [packedState + digit*CELL_WEIGHTS[cell] for cell in cells]
+                else:
+                    possibleNextStates = [previousState[:cell] + self.player + previousState[cell+1:] for cell in cells]
+                values = self.learningAlgo.getBoardStateValues(self.player, self.board, possibleNextStates)
+                if self.tablebase is not None and previousState.count(GridStates.EMPTY) - 1 <= self.tablebase.maxEmptyCells:
+                    self.useExactValues(cells, values)
+                (chosenBoard, pickOne) = CELL_MOVES[cells[values.index(max(values))]]
+            else:   # A board first and then a place on it, like RandomUTTTPlayer
+                boards = [board for board in range(9) if (legalMask >> 9*board) & SUBBOARD_MASK]
+                board = random.choice(boards)
+                place = random.choice(PLACES_OF[(legalMask >> 9*board) & SUBBOARD_MASK])
+                (chosenBoard, pickOne) = CELL_MOVES[9*board + place]
             self.board.makeMove(self.player, chosenBoard, pickOne)
         return previousState
 
+    def useExactValues(self, cells, values):
+        position = getattr(self.board, 'position', None) or positionFromBoard(self.board)
+        opponent = otherPlayer(self.player)
+        for (k, cell) in enumerate(cells):
+            value = self.tablebase.probe(playMove(position, self.player, cell), opponent)
+            if value is not None:
+                values[k] = 1.0 - value
+
     def learnFromMove(self, prevBoardState):
+        if self.tablebase is not None and hasattr(self.learningAlgo, 'setBoardStateValue') and self.isBoardActive():
+            value = self.tablebase.probeBoard(self.board, self.player)
+            if value is not None:   # Learn towards the exact value of where the move led
+                self.learningAlgo.setBoardStateValue(self.board.getBoardState(), value)
         self.learningAlgo.learnFromMove(self.player, self.board, prevBoardState)
 
     def saveLearning(self, filename):
@@ -93,6 +113,95 @@ class RLUTTTPlayer(UTTTPlayer):
     def loadLearning(self, filename):
         self.learningAlgo.loadLearning(filename)
 
+class MCTSUTTTPlayer(UTTTPlayer):
+    # Monte Carlo Tree Search with UCT (see mcts.py). Each move searches for `iterations` iterations or
+    # `timeLimit` seconds, whichever runs out first, and the tree below the actual moves is kept for the
+    # next search. A learning algorithm trained for this player can evaluate leaves instead of random
+    # playouts (leafEvaluation) and/or bias the search towards moves it likes (priorWeight > 0), and
+    # positions found in a tablebase (see tablebase.py) get their exact values.
+    # With numberOfProcesses > 1 the search runs over a pool of processes, either with a tree per
+    # process (parallelMode='root') or with playouts of one tree spread over them (parallelMode='leaf').
+    def __init__(self, iterations=1000, timeLimit=None, explorationConstant=1.4, learningAlgo=None,
+                 leafEvaluation=False, priorWeight=0.0, reuseTree=True, seed=None,
+                 numberOfProcesses=1, parallelMode='root', leafBatchSize=None, tablebase=None):
+        self.iterations = iterations
+        self.timeLimit = timeLimit
+        self.learningAlgo = learningAlgo
+        self.reuseTree = reuseTree
+        if numberOfProcesses == 1:
+            self.search = MCTSSearch(explorationConstant, None, leafEvaluation, priorWeight, seed)
+        elif parallelMode == 'root':
+            self.search = RootParallelSearch(MCTSSearch(explorationConstant, None, leafEvaluation, priorWeight),
+                                             numberOfProcesses, seed)
+        elif parallelMode == 'leaf':
+            self.search = LeafParallelSearch(explorationConstant, None, leafEvaluation, priorWeight, seed,
+                                             numberOfProcesses, leafBatchSize)
+        else:
+            raise ValueError('Unknown parallel mode: %s' % parallelMode)
+        self.search.tablebase = tablebase
+        self.lastSearchStats = {}
+        super(MCTSUTTTPlayer, self).__init__()
+
+    def setBoard(self, board, player):
+        super(MCTSUTTTPlayer, self).setBoard(board, player)
+        if self.learningAlgo is not None:
+            if self.search.evaluator is None:
+                self.search.evaluator = LearnerEvaluator(self.learningAlgo, player)
+            self.search.evaluator.player = player
+
+    def startNewGame(self):
+        self.search.resetTree()
+
+    def closePool(self):
+        # Worker processes of a parallel search are kept between moves and games until closed
+        if hasattr(self.search, 'closePool'):
+            self.search.closePool()
+
+    def makeNextMove(self):
+        previousState = self.board.getBoardState()
+        if self.isBoardActive():
+            position = getattr(self.board, 'position', None) or positionFromBoard(self.board)
+            self.search.setRoot(position, self.player, self.reuseTree)
+            self.lastSearchStats = self.search.search(self.iterations, self.timeLimit)
+            chosenBoard, pickOne = cellToMove(self.search.bestMove())
+            self.board.makeMove(self.player, chosenBoard, pickOne)
+        return previousState
+
+    def learnFromMove(self, prevBoardState):
+        pass  # The search player does not learn from moves
+
+class AlphaBetaUTTTPlayer(UTTTPlayer):
+    # Deterministic alpha-beta search (see alphabeta.py) to maxDepth plies, deepened one ply at a time
+    # while within timeLimit seconds if one is given. The transposition table is kept across moves and
+    # games. Leaves are scored by a heuristic, or by a learning algorithm trained for this player, and
+    # positions found in a tablebase end the search with their exact values.
+    def __init__(self, maxDepth=4, timeLimit=None, learningAlgo=None, transpositionTableSize=2**18, tablebase=None):
+        self.maxDepth = maxDepth
+        self.timeLimit = timeLimit
+        self.learningAlgo = learningAlgo
+        self.search = AlphaBetaSearch(transpositionTableSize)
+        self.search.tablebase = tablebase
+        self.lastSearchStats = {}
+        super(AlphaBetaUTTTPlayer, self).__init__()
+
+    def setBoard(self, board, player):
+        super(AlphaBetaUTTTPlayer, self).setBoard(board, player)
+        if self.learningAlgo is not None:
+            self.search.evaluator = LearnerEvaluator(self.learningAlgo, player)
+
+    def makeNextMove(self):
+        previousState = self.board.getBoardState()
+        if self.isBoardActive():
+            position = getattr(self.board, 'position', None) or positionFromBoard(self.board)
+            cell, score = self.search.search(position, self.player, self.maxDepth, self.timeLimit)
+            self.lastSearchStats = self.search.lastSearchStats
+            chosenBoard, pickOne = cellToMove(cell)
+            self.board.makeMove(self.player, chosenBoard, pickOne)
+        return previousState
+
+    def learnFromMove(self, prevBoardState):
+        pass  # The search player does not learn from moves
+
 if __name__  == '__main__':
     board = UTTTBoard()
     player1 = RandomUTTTPlayer()
@@ -0,0 +1,108 @@
+import mmap
+import os
+import struct
+import numpy as np
+
+# Binary value file: a sequence of segments, each made of a header, the sorted int64 state hashes
+# (see statekey.hashBoardState) and their float32 values. The first segment is a full snapshot;
+# incremental checkpoints append segments holding only the states changed since, and a state's value
+# is the one from the newest segment that has it. Segments are 8-byte aligned so the key and value
+# columns can be used in place from a memory map. A segment cut short by a crash while being appended
+# is ignored, and overwritten by the next append.
+
+VALUE_FILE_MAGIC = 'UTTTVALS'
+VALUE_FILE_VERSION = 1
+SEGMENT_HEADER = struct.Struct('<8sIIQ')    # magic, version, reserved, number of states
+SEGMENT_HEADER_SIZE = SEGMENT_HEADER.size
+
+def isValueFile(filename):
+    with open(filename, 'rb') as infile:
+        return infile.read(len(VALUE_FILE_MAGIC)) == VALUE_FILE_MAGIC
+
+def sortValueArrays(keys, values):
+    # Sort by key, keeping the last value given for a repeated key
+    keys, values = np.asarray(keys, dtype=np.int64), np.asarray(values, dtype=np.float32)
+    order = np.argsort(keys, kind='mergesort')
+    keys, values = keys[order], values[order]
+    isLast = np.ones(len(keys), dtype=bool)
+    isLast[:-1] = keys[1:] != keys[:-1]
+    return keys[isLast], values[isLast]
+
+def writeValueSegment(outfile, keys, values):
+    keys, values = sortValueArrays(keys, values)
+    outfile.write(SEGMENT_HEADER.pack(VALUE_FILE_MAGIC, VALUE_FILE_VERSION, 0, len(keys)))
+    outfile.write(keys.tostring())
+    outfile.write(values.tostring())
+    outfile.write('\0' * (-4*len(values) % 8))
+
+def writeValueFile(filename, keys, values):
+    # Written next to the target and renamed over it, so a crash never leaves a partial file behind
+    tempFilename = filename + '.tmp'
+    with open(tempFilename, 'wb') as outfile:
+        writeValueSegment(outfile, keys, values)
+    os.rename(tempFilename, filename)
+
+def readSegmentHeaders(infile):
+    # (offset, number of states) of every complete segment, and where they end. A trailing segment that
+    # a crash cut short while it was being appended is left out.
+    fileSize = os.fstat(infile.fileno()).st_size
+    segments, offset = [], 0
+    while offset + SEGMENT_HEADER_SIZE <= fileSize:
+        infile.seek(offset)
+        magic, version, reserved, count = SEGMENT_HEADER.unpack(infile.read(SEGMENT_HEADER_SIZE))
+        if magic != VALUE_FILE_MAGIC or version != VALUE_FILE_VERSION:
+            raise ValueError('%s is not a version %s value file' % (infile.name, VALUE_FILE_VERSION))
+        end = offset + SEGMENT_HEADER_SIZE + 8*count + 4*count + (-4*count % 8)
+        if end > fileSize:
+            break
+        segments.append((offset, count))
+        offset = end
+    return segments, offset
+
+def appendValueSegment(filename, keys, values):
+    with open(filename, 'r+b') as outfile:
+        segments, end = readSegmentHeaders(outfile)
+        outfile.truncate(end)   # Drops a segment left incomplete by an earlier crash
+        outfile.seek(end)
+        writeValueSegment(outfile, keys, values)
+
+class MappedValueFile(object):
+    # Read-only view of a value file. Nothing is read up front apart from the segment headers.
+    def __init__(self, filename):
+        self.filename = filename
+        self.segments = []
+        with open(filename, 'rb') as infile:
+            segments, end = readSegmentHeaders(infile)
+            self.map = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) if end > 0 else None
+        for (offset, count) in segments:
+            offset += SEGMENT_HEADER_SIZE
+            keys = np.frombuffer(self.map, dtype=np.int64, count=count, offset=offset)
+            values = np.frombuffer(self.map, dtype=np.float32, count=count, offset=offset + 8*count)
+            self.segments.insert(0, (keys, values))     # Newest first
+
+    def lookup(self, key, default=None):
+        for (keys, values) in self.segments:
+            index = keys.searchsorted(key)
+            if index < len(keys) and keys.item(index) == key:
+                return values.item(index)
+        return default
+
+    def getValueArrays(self):
+        # All states with their newest values, merged into a single pair of sorted arrays
+        if not self.segments:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return sortValueArrays(np.concatenate([keys for (keys, values) in reversed(self.segments)]),
+                               np.concatenate([values for (keys, values) in reversed(self.segments)]))
+
+    def close(self):
+        self.segments = []
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+def compactValueFile(filename):
+    # Fold all incremental segments into a single one
+    valueFile = MappedValueFile(filename)
+    keys, values = valueFile.getValueArrays()
+    valueFile.close()
+    writeValueFile(filename, keys, values)
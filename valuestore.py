@@ -0,0 +1,356 @@
+from statekey import DIGIT_STATES, hashOf
+from valuefile import MappedValueFile, sortValueArrays
+import numpy as np
+
+DIGIT_CHARACTERS = np.array([ord(state) for state in DIGIT_STATES], dtype=np.uint8)
+CHUNK_DIGITS = 20   # 3**20 < 2**32, so a 32-bit limb times 3**20 plus a carry fits in 64 bits
+CHUNK_STARTS = range(81 % CHUNK_DIGITS - CHUNK_DIGITS, 81, CHUNK_DIGITS)  # Cell 0 is in the first, shorter chunk
+# Weight of every cell in the value of its chunk, and what the packed state is multiplied by before adding a chunk
+CHUNK_WEIGHTS = np.array([[3.0**(start + CHUNK_DIGITS - 1 - cell) if start <= cell < start + CHUNK_DIGITS else 0.0
+                           for start in CHUNK_STARTS] for cell in range(81)])
+CHUNK_MULTIPLIERS = [np.uint64(3**(min(start + CHUNK_DIGITS, 81) - max(start, 0))) for start in CHUNK_STARTS]
+
+def cellArrayStates(cells):
+    # Board state strings of an (N, 81) array of cell digits (0/1/2 for EMPTY/X/O, as in statekey.py)
+    characters = DIGIT_CHARACTERS[cells].tostring()
+    return [characters[start:start+81] for start in xrange(0, len(characters), 81)]
+
+def hashCellArrays(cells):
+    # hashBoardState of every row of an (N, 81) array of cell digits, computed with NumPy: the packed
+    # states are put together from chunks of CHUNK_DIGITS cells in 32-bit limbs, then hashed as in
+    # hashPackedState
+    chunkValues = np.asarray(cells, dtype=np.float64).dot(CHUNK_WEIGHTS).astype(np.uint64)    # Exact, as chunks stay below 2**53
+    limbs = [np.zeros(len(chunkValues), dtype=np.uint64) for k in range(5)]     # Least significant first
+    for (chunk, multiplier) in enumerate(CHUNK_MULTIPLIERS):
+        carry = chunkValues[:, chunk]
+        for k in range(5):
+            product = limbs[k] * multiplier + carry
+            limbs[k], carry = product & np.uint64(0xFFFFFFFF), product >> np.uint64(32)
+    words = [limbs[0] | (limbs[1] << np.uint64(32)), limbs[2] | (limbs[3] << np.uint64(32)), limbs[4]]
+    value = words[0] + words[1] * np.uint64(0x9E3779B97F4A7C15) + words[2] * np.uint64(0xC2B2AE3D27D4EB4F)
+    value = (value ^ (value >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    value = (value ^ (value >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    value = (value ^ (value >> np.uint64(31))).view(np.int64)
+    value[value == 0] = 1
+    return value
+
+class EvictionPolicy():
+    LRU = 'lru'                         # Drop the states that were used least recently
+    LEAST_VISITED = 'least-visited'     # Drop the states that were looked up or updated the fewest times
+    UNKNOWLEDGEABLE = 'unknowledgeable' # Drop states still at the default value first
+
+class CompactValueStore(object):
+    # Dict-like store of board state values for TableLearning. States are keyed by a 64-bit hash of the
+    # packed state and values are kept as float32, in open-addressed (linear probing) NumPy arrays.
+    # Once maxEntries states are stored, a fraction of them is evicted according to the eviction policy.
+    MAX_LOAD_FACTOR = 0.7
+
+    def __init__(self, maxEntries=None, evictionPolicy=EvictionPolicy.LRU, evictionFraction=0.1,
+                 initialCapacity=1024, defaultValue=0.5):
+        if evictionPolicy not in (EvictionPolicy.LRU, EvictionPolicy.LEAST_VISITED, EvictionPolicy.UNKNOWLEDGEABLE):
+            raise ValueError('Unknown eviction policy: %s' % evictionPolicy)
+        self.maxEntries = maxEntries
+        self.evictionPolicy = evictionPolicy
+        self.evictionFraction = evictionFraction
+        self.defaultValue = defaultValue
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        self.clock = 0
+        if maxEntries is not None:
+            initialCapacity = int(maxEntries / self.MAX_LOAD_FACTOR) + 1
+        self.allocate(1 << max(4, (initialCapacity - 1).bit_length()))
+
+    def allocate(self, capacity):
+        self.capacity = capacity
+        self.size = 0
+        self.slotKeys = np.zeros(capacity, dtype=np.int64)   # 0 marks an unused slot
+        self.slotValues = np.zeros(capacity, dtype=np.float32)
+        # Bookkeeping is only kept for the policy that needs it
+        self.slotStamps = np.zeros(capacity, dtype=np.uint32) if self.evictionPolicy == EvictionPolicy.LRU else None
+        self.slotVisits = np.zeros(capacity, dtype=np.uint32) if self.evictionPolicy == EvictionPolicy.LEAST_VISITED else None
+
+    def findSlot(self, key):
+        # Slot holding `key`, or the empty slot where it would be inserted
+        keys, mask = self.slotKeys, self.capacity - 1
+        slot = key & mask
+        slotKey = keys.item(slot)
+        while slotKey != 0 and slotKey != key:
+            slot = (slot + 1) & mask
+            slotKey = keys.item(slot)
+        return slot, slotKey != 0
+
+    def findSlots(self, keys):
+        # Vectorized findSlot for an array of keys
+        mask = self.capacity - 1
+        slots = np.bitwise_and(keys, mask)
+        pending = np.arange(len(keys))
+        while len(pending) > 0:
+            slotKeys = self.slotKeys[slots[pending]]
+            pending = pending[(slotKeys != 0) & (slotKeys != keys[pending])]
+            slots[pending] = (slots[pending] + 1) & mask
+        return slots
+
+    def touch(self, slot):
+        if self.slotStamps is not None:
+            self.clock += 1
+            self.slotStamps[slot] = self.clock
+        elif self.slotVisits is not None:
+            self.slotVisits[slot] += 1
+
+    def lookup(self, state):
+        slot, found = self.findSlot(hashOf(state))
+        if found:
+            self.hits += 1
+            self.touch(slot)
+        else:
+            self.misses += 1
+        return slot, found
+
+    def __contains__(self, state):
+        return self.lookup(state)[1]
+
+    def __getitem__(self, state):
+        slot, found = self.lookup(state)
+        if not found:
+            raise KeyError(state)
+        return self.slotValues.item(slot)
+
+    def get(self, state, default=None):
+        slot, found = self.lookup(state)
+        return self.slotValues.item(slot) if found else default
+
+    def getMany(self, states, default=None):
+        return self.getManyHashed(np.fromiter((hashOf(state) for state in states), dtype=np.int64, count=len(states)), default)
+
+    def getManyHashed(self, keys, default=None):
+        # getMany for an array of state hashes, e.g. from statekey.hashCellArrays
+        slots = self.findSlots(keys)
+        found = self.slotKeys[slots] == keys
+        foundSlots = slots[found]
+        self.hits += len(foundSlots)
+        self.misses += len(keys) - len(foundSlots)
+        if self.slotStamps is not None:
+            self.clock += 1
+            self.slotStamps[foundSlots] = self.clock
+        elif self.slotVisits is not None:
+            np.add.at(self.slotVisits, foundSlots, 1)
+        return [value if isFound else default
+                for (value, isFound) in zip(self.slotValues[slots].tolist(), found.tolist())]
+
+    def setdefault(self, state, default=None):
+        slot, found = self.lookup(state)
+        if found:
+            return self.slotValues.item(slot)
+        self[state] = default
+        return default
+
+    def __setitem__(self, state, value):
+        key = hashOf(state)
+        slot, found = self.findSlot(key)
+        if not found:
+            if self.maxEntries is not None and self.size >= self.maxEntries:
+                self.evict()
+                slot, found = self.findSlot(key)
+            elif self.size + 1 > self.MAX_LOAD_FACTOR * self.capacity:
+                self.rebuild(2 * self.capacity)
+                slot, found = self.findSlot(key)
+            self.slotKeys[slot] = key
+            self.size += 1
+        self.slotValues[slot] = value
+        self.touch(slot)
+
+    def update(self, values):
+        for (state, value) in values.iteritems():
+            self[state] = value
+
+    def __len__(self):
+        return self.size
+
+    def occupiedSlots(self):
+        return np.flatnonzero(self.slotKeys)
+
+    def iteritems(self):
+        # Only the hashed keys are stored, so these are (hash, value) pairs
+        slots = self.occupiedSlots()
+        return iter(zip(self.slotKeys[slots].tolist(), self.slotValues[slots].tolist()))
+
+    def items(self):
+        return list(self.iteritems())
+
+    def keys(self):
+        return self.slotKeys[self.occupiedSlots()].tolist()
+
+    def values(self):
+        return self.slotValues[self.occupiedSlots()].tolist()
+
+    def evict(self):
+        slots = self.occupiedSlots()
+        numberToEvict = min(len(slots), max(1, int(self.maxEntries * self.evictionFraction)))
+        if self.evictionPolicy == EvictionPolicy.LRU:
+            order = self.slotStamps[slots]
+        elif self.evictionPolicy == EvictionPolicy.LEAST_VISITED:
+            order = self.slotVisits[slots]
+        else:
+            order = self.slotValues[slots] != self.defaultValue
+        evicted = slots[np.argsort(order, kind='mergesort')[:numberToEvict]]
+        self.slotKeys[evicted] = 0
+        self.evictions += numberToEvict
+        self.rebuild(self.capacity)
+
+    def rebuild(self, capacity):
+        # Reinsert the occupied slots into fresh arrays of the given capacity
+        slots = self.occupiedSlots()
+        columns = [self.slotKeys[slots], self.slotValues[slots]]
+        bookkeeping = [column[slots] if column is not None else None for column in (self.slotStamps, self.slotVisits)]
+        self.allocate(capacity)
+        self.insertNew(columns[0], columns[1], *bookkeeping)
+
+    def insertNew(self, keys, values, stamps=None, visits=None):
+        # Vectorized insertion of distinct keys that are not in the store yet. Every round places at
+        # most one pending key per free slot; the others move on to their next probe slot.
+        mask = self.capacity - 1
+        slots = np.bitwise_and(keys, mask)
+        pending = np.arange(len(keys))
+        while len(pending) > 0:
+            free = self.slotKeys[slots[pending]] == 0
+            candidates = pending[free]
+            placedSlots, first = np.unique(slots[candidates], return_index=True)
+            placed = candidates[first]
+            self.slotKeys[placedSlots] = keys[placed]
+            self.slotValues[placedSlots] = values[placed]
+            if stamps is not None and self.slotStamps is not None:
+                self.slotStamps[placedSlots] = stamps[placed]
+            if visits is not None and self.slotVisits is not None:
+                self.slotVisits[placedSlots] = visits[placed]
+            isPlaced = np.zeros(len(keys), dtype=bool)
+            isPlaced[placed] = True
+            pending = pending[~isPlaced[pending]]
+            slots[pending] = (slots[pending] + 1) & mask
+        self.size += len(keys)
+
+    def getMemoryUsage(self):
+        return sum(column.nbytes for column in (self.slotKeys, self.slotValues, self.slotStamps, self.slotVisits) if column is not None)
+
+    def getStats(self):
+        return {'entries': self.size, 'capacity': self.capacity, 'bytes': self.getMemoryUsage(),
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def getHashedArrays(self):
+        slots = self.occupiedSlots()
+        return self.slotKeys[slots], self.slotValues[slots]
+
+    def loadHashedArrays(self, keys, values):
+        neededCapacity = 1 << max(4, int(len(keys) / self.MAX_LOAD_FACTOR).bit_length())
+        self.allocate(max(self.capacity, neededCapacity))
+        self.insertNew(keys, values)
+
+class MappedValueStore(object):
+    # Dict-like store over a memory-mapped value file (see valuefile.py). Values are looked up lazily in
+    # the file; states set since it was opened are kept in memory, keyed by their hash, and take precedence.
+    def __init__(self, filename):
+        self.valueFile = MappedValueFile(filename)
+        self.changedValues = {}
+        self.hits, self.misses = 0, 0
+        self.size = None    # Number of states, counted on first use and kept up to date from then on
+
+    def reload(self):
+        # Pick up segments appended to the file, after which the in-memory changes are no longer needed
+        filename = self.valueFile.filename
+        self.valueFile.close()
+        self.valueFile = MappedValueFile(filename)
+        self.changedValues = {}
+
+    def get(self, state, default=None):
+        key = hashOf(state)
+        value = self.changedValues.get(key)
+        if value is None:
+            value = self.valueFile.lookup(key)
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def __contains__(self, state):
+        return self.get(state) is not None
+
+    def getMany(self, states, default=None):
+        return self.getManyHashed(np.fromiter((hashOf(state) for state in states), dtype=np.int64, count=len(states)), default)
+
+    def getManyHashed(self, keys, default=None):
+        values = [self.changedValues.get(key) for key in keys.tolist()]
+        pending = np.array([k for (k, value) in enumerate(values) if value is None], dtype=np.intp)
+        pendingKeys = keys[pending]
+        for (segmentKeys, segmentValues) in self.valueFile.segments:
+            if len(pending) == 0 or len(segmentKeys) == 0:
+                continue
+            indices = np.minimum(segmentKeys.searchsorted(pendingKeys), len(segmentKeys) - 1)
+            found = segmentKeys[indices] == pendingKeys
+            for (k, value) in zip(pending[found].tolist(), segmentValues[indices[found]].tolist()):
+                values[k] = value
+            pending, pendingKeys = pending[~found], pendingKeys[~found]
+        self.misses += len(pending)
+        self.hits += len(keys) - len(pending)
+        for k in pending.tolist():
+            values[k] = default
+        return values
+
+    def __getitem__(self, state):
+        value = self.get(state)
+        if value is None:
+            raise KeyError(state)
+        return value
+
+    def setdefault(self, state, default=None):
+        value = self.get(state)
+        if value is None:
+            self[state] = value = default
+        return value
+
+    def __setitem__(self, state, value):
+        key = hashOf(state)
+        if self.size is not None and key not in self.changedValues and self.valueFile.lookup(key) is None:
+            self.size += 1
+        self.changedValues[key] = value
+
+    def update(self, values):
+        for (state, value) in values.iteritems():
+            self[state] = value
+
+    def getHashedArrays(self):
+        keys, values = self.valueFile.getValueArrays()
+        if self.changedValues:
+            keys = np.concatenate([keys, np.fromiter(self.changedValues.iterkeys(), dtype=np.int64)])
+            values = np.concatenate([values, np.fromiter(self.changedValues.itervalues(), dtype=np.float32)])
+            keys, values = sortValueArrays(keys, values)
+        return keys, values
+
+    def __len__(self):
+        # Reloading keeps the count, as the file then holds the same states
+        if self.size is None:
+            self.size = len(self.getHashedArrays()[0])
+        return self.size
+
+    def iteritems(self):
+        # Only the hashed keys are stored, so these are (hash, value) pairs
+        keys, values = self.getHashedArrays()
+        return iter(zip(keys.tolist(), values.tolist()))
+
+    def items(self):
+        return list(self.iteritems())
+
+    def keys(self):
+        return self.getHashedArrays()[0].tolist()
+
+    def values(self):
+        return self.getHashedArrays()[1].tolist()
+
+    def getStats(self):
+        return {'segments': len(self.valueFile.segments), 'changed': len(self.changedValues),
+                'hits': self.hits, 'misses': self.misses}
+
+def getHashedValueArrays(values):
+    # (hash, value) arrays of any value store, including a plain dict keyed by board states
+    if hasattr(values, 'getHashedArrays'):
+        return values.getHashedArrays()
+    return np.fromiter((hashOf(state) for state in values.iterkeys()), dtype=np.int64, count=len(values)), \
+           np.fromiter(values.itervalues(), dtype=np.float32, count=len(values))